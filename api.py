@@ -1,12 +1,67 @@
-from flask import Flask
+import os
+from flask import Flask, g, request
+import compressao
+import metricas
 import views
+from serializacao import ProvedorJSON
+from fila_escrita import FilaCheia
+from utils import ErroConexao, cache_imoveis, permitir_replica
 
 app = Flask(__name__)
+app.json = ProvedorJSON(app)
+
+@app.before_request
+def iniciar_medicao():
+    g.medicao = metricas.iniciar_requisicao()
+
+@app.before_request
+def escolher_destino_leitura():
+    permitir_replica(views.leitura_em_replica(request))
+
+@app.after_request
+def finalizar_medicao(response):
+    rota = request.url_rule.rule if request.url_rule else None
+    server_timing = metricas.finalizar_requisicao(g.pop('medicao', None), rota, request.method, response.status_code)
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+@app.after_request
+def fixar_leituras_no_primario(response):
+    return views.marcar_escrita(response, request)
+
+# Registrado depois da medição, roda antes dela (after_request vai na ordem inversa)
+@app.after_request
+def comprimir_resposta(response):
+    if compressao.compressivel(response, response.is_streamed):
+        codificacao = compressao.negociar(request.accept_encodings)
+        compressao.aplicar(response, response.get_data(), codificacao, request.full_path, cache_imoveis)
+    return response
+
+@app.errorhandler(ErroConexao)
+def erro_conexao(erro):
+    return views.banco_indisponivel(erro)
+
+@app.errorhandler(FilaCheia)
+def erro_fila_cheia(erro):
+    return views.fila_cheia(erro)
 
 @app.route('/imoveis', methods=['GET'])
 def get_imoveis():
     return views.listar_imoveis()
 
+@app.route('/imoveis/search', methods=['GET'])
+def get_busca_imoveis():
+    return views.pesquisar_imoveis()
+
+@app.route('/imoveis/stats', methods=['GET'])
+def get_estatisticas_imoveis():
+    return views.estatisticas_imoveis()
+
+@app.route('/imoveis/changes', methods=['GET'])
+def get_alteracoes():
+    return views.listar_alteracoes()
+
 @app.route('/imoveis/<int:imovel_id>', methods=['GET'])
 def get_imovel_por_id(imovel_id):
     return views.buscar_imovel_por_id(imovel_id)
@@ -27,10 +82,39 @@ def post_imovel():
 def atualizar_imovel(imovel_id):
     return views.atualizar_imovel(imovel_id)
 
+@app.route('/imoveis/<int:imovel_id>', methods=['PATCH'])
+def atualizar_imovel_parcial(imovel_id):
+    return views.atualizar_imovel_parcial(imovel_id)
+
 @app.route('/imoveis/<int:imovel_id>', methods=['DELETE'])
 def remover_imovel(imovel_id):
     return views.remover_imovel(imovel_id)
+
+@app.route('/imoveis/bulk', methods=['POST'])
+def post_imoveis_em_lote():
+    return views.adicionar_imoveis_em_lote()
+
+@app.route('/imoveis/bulk', methods=['PATCH'])
+def patch_imoveis_em_lote():
+    return views.atualizar_imoveis_em_lote()
+
+@app.route('/imoveis/bulk', methods=['DELETE'])
+def delete_imoveis_em_lote():
+    return views.remover_imoveis_em_lote()
+
+@app.route('/cache/estatisticas', methods=['GET'])
+def get_estatisticas_cache():
+    return views.estatisticas_cache()
+
+@app.route('/metrics', methods=['GET'])
+def get_metricas():
+    return views.exportar_metricas()
     
     
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # IMOVEIS_ASYNC=1 sobe o modo assíncrono (api_async.py) com as mesmas rotas
+    if os.getenv('IMOVEIS_ASYNC') == '1':
+        from api_async import app as app_async
+        app_async.run(debug=True)
+    else:
+        app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from functools import wraps
+from quart import Quart, Response, current_app, g, jsonify, make_response, request
+from quart.wrappers.response import IterableBody
+import compressao
+import metricas
+import utils_async
+import views
+from serializacao import ProvedorJSON
+from fila_escrita import FilaCheia
+from utils import ErroConexao, cache_imoveis, permitir_replica
+
+# Modo assíncrono da API (ASGI): mesmas rotas e mesmas respostas do api.py.
+# As leituras usam o driver assíncrono (utils_async.py), então cada processo
+# atende muitas requisições simultâneas enquanto aguardam o MySQL. A validação
+# da query string e a montagem das respostas vêm do views.py; as escritas
+# reutilizam as funções síncronas, executadas em threads.
+#
+# Execução: hypercorn api_async:app  (ou IMOVEIS_ASYNC=1 python api.py)
+
+app = Quart(__name__)
+app.json = ProvedorJSON(app)
+
+# Os hooks são corrotinas para rodar na mesma tarefa da view (funções síncronas
+# iriam para uma thread, fora do contexto em que a medição é aberta)
+@app.before_request
+async def iniciar_medicao():
+    g.medicao = metricas.iniciar_requisicao()
+
+@app.before_request
+async def escolher_destino_leitura():
+    permitir_replica(views.leitura_em_replica(request))
+
+@app.after_request
+async def finalizar_medicao(response):
+    rota = request.url_rule.rule if request.url_rule else None
+    server_timing = metricas.finalizar_requisicao(g.pop('medicao', None), rota, request.method, response.status_code)
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+@app.after_request
+async def fixar_leituras_no_primario(response):
+    return views.marcar_escrita(response, request)
+
+# Registrado depois da medição, roda antes dela (after_request vai na ordem inversa)
+@app.after_request
+async def comprimir_resposta(response):
+    if compressao.compressivel(response, isinstance(response.response, IterableBody)):
+        codificacao = compressao.negociar(request.accept_encodings)
+        argumentos = (response, await response.get_data(), codificacao, request.full_path, cache_imoveis)
+        if cache_imoveis.ativo and cache_imoveis.bloqueante:
+            # A versão comprimida é lida do cache (arquivo, redis) fora do event loop
+            await asyncio.to_thread(compressao.aplicar, *argumentos)
+        else:
+            compressao.aplicar(*argumentos)
+    return response
+
+@app.errorhandler(ErroConexao)
+async def erro_conexao(erro):
+    return views.banco_indisponivel(erro)
+
+@app.errorhandler(FilaCheia)
+async def erro_fila_cheia(erro):
+    return views.fila_cheia(erro)
+
+def condicional(view):
+    """Versão assíncrona de views.condicional (ETag/Last-Modified e 304)"""
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        versao, atualizado_em = await utils_async.get_versao_tabela()
+        etag, ultima_alteracao = views.validadores(versao, atualizado_em, views.formato_stream(request))
+        if views.nao_modificado(request, etag, ultima_alteracao):
+            response = Response('', status=304)
+        else:
+            response = await make_response(await view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        return views.aplica_validadores(response, etag, ultima_alteracao)
+    return wrapper
+
+async def _gera_json(imoveis, self_link, json, com_links=True):
+    yield views.abertura_json(self_link, json)
+    separador = ''
+    async for imovel in imoveis:
+        yield separador + views.item_stream(imovel, json, com_links)
+        separador = ','
+    yield views.FECHAMENTO_JSON
+
+async def _gera_ndjson(imoveis, json, com_links=True):
+    async for imovel in imoveis:
+        yield views.item_stream(imovel, json, com_links) + '\n'
+
+def _responder_stream(formato, self_link, plano):
+    imoveis = utils_async.iterar_imoveis(filtros=plano['filtros'], ordem=plano['ordem'], colunas=plano['colunas'])
+    if formato == 'ndjson':
+        return Response(_gera_ndjson(imoveis, current_app.json, plano['com_links']), mimetype='application/x-ndjson')
+    return Response(_gera_json(imoveis, self_link, current_app.json, plano['com_links']), mimetype='application/json')
+
+async def _responder_lista(self_link, cidade=None, tipo=None):
+    plano, erro = views.preparar_lista(request.args, cidade=cidade, tipo=tipo)
+    if erro:
+        return erro
+    formato = views.formato_stream(request)
+    if plano['limite'] is None and formato:
+        return _responder_stream(formato, self_link, plano)
+    imoveis = await utils_async.get_imoveis(**views.consulta_do_plano(plano))
+    return views.montar_lista(imoveis, plano, request.args, self_link)
+
+async def _itens_bulk():
+    return views.ler_itens_bulk(request.mimetype, await request.get_data(as_text=True))
+
+@app.route('/imoveis', methods=['GET'])
+@condicional
+async def get_imoveis():
+    return await _responder_lista('/imoveis')
+
+@app.route('/imoveis/search', methods=['GET'])
+@condicional
+async def get_busca_imoveis():
+    plano, erro = views.preparar_busca(request.args)
+    if erro:
+        return erro
+    return views.montar_busca(await utils_async.buscar_imoveis(**views.consulta_da_busca(plano)), plano, request.args)
+
+@app.route('/imoveis/stats', methods=['GET'])
+@condicional
+async def get_estatisticas_imoveis():
+    plano, erro = views.preparar_estatisticas(request.args)
+    if erro:
+        return erro
+    return views.montar_estatisticas(await utils_async.get_estatisticas(**plano), request.args)
+
+async def _gera_eventos(plano, json):
+    """Versão assíncrona de views._gera_eventos (stream SSE do log de alterações)"""
+    estado = views.inicio_eventos(plano)
+    yield views.INICIO_EVENTOS
+    while True:
+        texto, espera = views.passo_eventos(estado, await utils_async.get_alteracoes(estado['desde'], estado['limite']), json)
+        if texto:
+            yield texto
+        if espera is None:
+            return
+        await asyncio.sleep(espera)
+
+@app.route('/imoveis/changes', methods=['GET'])
+async def get_alteracoes():
+    plano, erro = views.preparar_alteracoes(request.args, request.headers.get('Last-Event-ID'))
+    if erro:
+        return erro
+    if views.quer_eventos(request):
+        return Response(_gera_eventos(plano, current_app.json), mimetype=views.MIMETYPE_EVENTOS, headers=views.CABECALHOS_EVENTOS)
+    prazo = time.monotonic() + plano['espera']
+    while True:
+        resultado = await utils_async.get_alteracoes(plano['desde'], plano['limite'])
+        espera = views.espera_alteracoes(resultado, prazo)
+        if espera is None:
+            break
+        await asyncio.sleep(espera)
+    return views.montar_alteracoes(resultado, plano)
+
+@app.route('/imoveis/<int:imovel_id>', methods=['GET'])
+async def get_imovel_por_id(imovel_id):
+    projecao_pedida = views.parametros_projecao(request.args)
+    if projecao_pedida is None:
+        return views.CAMPOS_INVALIDOS
+    colunas, com_links = projecao_pedida
+    _, atualizado_em = await utils_async.get_versao_tabela()
+    imovel = await utils_async.get_imovel_por_id(imovel_id, colunas=views.colunas_com_versao(colunas))
+    return views.responder_imovel(request, imovel, colunas, com_links, atualizado_em)
+
+@app.route('/imoveis/tipo/<string:tipo>', methods=['GET'])
+@condicional
+async def get_imoveis_por_tipo(tipo):
+    return await _responder_lista(f'/imoveis/tipo/{tipo}', tipo=tipo)
+
+@app.route('/imoveis/cidade/<string:cidade>', methods=['GET'])
+@condicional
+async def get_imoveis_por_cidade(cidade):
+    return await _responder_lista(f'/imoveis/cidade/{cidade}', cidade=cidade)
+
+@app.route('/imoveis', methods=['POST'])
+async def post_imovel():
+    return await asyncio.to_thread(views.processar_adicao, await request.get_json())
+
+@app.route('/imoveis/<int:imovel_id>', methods=['PUT'])
+async def atualizar_imovel(imovel_id):
+    return await asyncio.to_thread(views.processar_atualizacao, imovel_id, await request.get_json())
+
+@app.route('/imoveis/<int:imovel_id>', methods=['PATCH'])
+async def atualizar_imovel_parcial(imovel_id):
+    return await asyncio.to_thread(views.processar_atualizacao_parcial, imovel_id,
+                                   await request.get_json(silent=True), views.versao_if_match(request))
+
+@app.route('/imoveis/<int:imovel_id>', methods=['DELETE'])
+async def remover_imovel(imovel_id):
+    return await asyncio.to_thread(views.processar_remocao, imovel_id)
+
+@app.route('/imoveis/bulk', methods=['POST'])
+async def post_imoveis_em_lote():
+    return await asyncio.to_thread(views.processar_adicao_em_lote, await _itens_bulk())
+
+@app.route('/imoveis/bulk', methods=['PATCH'])
+async def patch_imoveis_em_lote():
+    return await asyncio.to_thread(views.processar_atualizacao_em_lote, await _itens_bulk())
+
+@app.route('/imoveis/bulk', methods=['DELETE'])
+async def delete_imoveis_em_lote():
+    return await asyncio.to_thread(views.processar_remocao_em_lote, await _itens_bulk())
+
+@app.route('/cache/estatisticas', methods=['GET'])
+async def get_estatisticas_cache():
+    return jsonify(cache_imoveis.estatisticas())
+
+@app.route('/metrics', methods=['GET'])
+async def get_metricas():
+    medidores = views.medidores(utils_async.pool, utils_async.roteador)
+    return Response(metricas.exportar(medidores), content_type=views.MIMETYPE_METRICAS)
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
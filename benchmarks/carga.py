@@ -0,0 +1,274 @@
+"""Teste de carga de todas as rotas do api.py contra um banco local.
+
+Sobe a massa de dados a partir do imoveis.sql (replicada sinteticamente até
+--linhas) e dispara requisições em paralelo contra um servidor já em execução,
+rota por rota, relatando p50/p95/p99 e requisições por segundo.
+
+    python benchmarks/carga.py --semear --linhas 100000            # prepara o banco (.cred)
+    gunicorn -w 4 api:app  (ou hypercorn -w 4 api_async:app)       # em outro terminal
+    python benchmarks/carga.py --url http://127.0.0.1:8000 --duracao 10 --concorrencia 16
+
+As rotas de escrita só alteram imóveis criados pelo próprio teste, que são
+removidos ao final; a massa semeada não é modificada.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from urllib.parse import quote, urlsplit
+
+from comum import resumo_latencias, salvar_resultado
+
+from carregador import gerar_sinteticos
+
+LOTE_SEMEADURA = 1000
+TAMANHO_BULK = 100
+
+
+def semear(linhas):
+    """Completa a tabela imoveis até `linhas` registros com dados sintéticos determinísticos"""
+    from utils import obter_conexao, adicionar_imoveis_db, CAMPOS_IMOVEL
+
+    with obter_conexao() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM imoveis")
+        existentes = cursor.fetchone()[0]
+        cursor.close()
+    faltam = max(0, linhas - existentes)
+    # Mesma semente do carregador.py --sinteticos: a massa é igual entre execuções
+    novas = islice(gerar_sinteticos(linhas), existentes, None)
+    for _ in range(0, faltam, LOTE_SEMEADURA):
+        lote = [dict(zip(CAMPOS_IMOVEL, linha)) for linha in islice(novas, LOTE_SEMEADURA)]
+        adicionar_imoveis_db(lote)
+    print(f'{existentes} imóveis já existiam; {faltam} inseridos')
+
+
+class Cliente:
+    """Conexão HTTP persistente de uma thread do teste (reabre se o servidor fechar)"""
+
+    def __init__(self, url):
+        partes = urlsplit(url)
+        self.host = partes.hostname
+        self.porta = partes.port or 80
+        self.conn = None
+
+    def requisitar(self, metodo, caminho, corpo=None, headers=None):
+        headers = dict(headers or {})
+        if corpo is not None:
+            corpo = json.dumps(corpo).encode()
+            headers['Content-Type'] = 'application/json'
+        for tentativa in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.porta, timeout=30)
+            try:
+                self.conn.request(metodo, caminho, body=corpo, headers=headers)
+                resposta = self.conn.getresponse()
+                dados = resposta.read()
+                return resposta.status, dados, resposta
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if tentativa:
+                    raise
+
+
+def _novo_imovel(aleatorio, base):
+    logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data = aleatorio.choice(base)
+    return {
+        'logradouro': f'{logradouro} (carga)', 'tipo_logradouro': tipo_logradouro, 'bairro': bairro,
+        'cidade': cidade, 'cep': cep, 'tipo': tipo, 'valor': valor, 'data_aquisicao': data
+    }
+
+
+class Contexto:
+    """Dados de apoio compartilhados pelas threads: ids, cidades e tipos existentes e ids criados"""
+
+    def __init__(self, cliente):
+        status, dados, _ = cliente.requisitar('GET', '/imoveis?limit=100&fields=id,cidade,tipo&links=0')
+        amostra = json.loads(dados)['imoveis'] if status == 200 else []
+        self.ids = [imovel['id'] for imovel in amostra] or [1]
+        self.cidades = sorted({imovel['cidade'] for imovel in amostra}) or ['Judymouth']
+        self.tipos = sorted({imovel['tipo'] for imovel in amostra}) or ['terreno']
+        status, _, resposta = cliente.requisitar('GET', '/imoveis?limit=50')
+        self.etag = resposta.getheader('ETag')
+        self.base = list(gerar_sinteticos(len(self.ids)))
+        self.criados = []
+        self.lock = threading.Lock()
+
+    def registrar(self, ids):
+        with self.lock:
+            self.criados.extend(ids)
+
+    def retirar(self, quantidade=1):
+        with self.lock:
+            retirados, self.criados = self.criados[:quantidade], self.criados[quantidade:]
+        return retirados
+
+
+# Cada rota recebe (cliente, contexto, aleatório) e faz uma requisição, devolvendo o status.
+# A ordem importa: as rotas de criação vêm antes das que atualizam e removem os ids criados.
+def _get(caminho, headers=None):
+    def rota(cliente, contexto, aleatorio):
+        alvo = caminho(contexto, aleatorio) if callable(caminho) else caminho
+        return cliente.requisitar('GET', alvo, headers=headers(contexto) if headers else None)[0]
+    return rota
+
+
+def _post_imovel(cliente, contexto, aleatorio):
+    status, dados, _ = cliente.requisitar('POST', '/imoveis', _novo_imovel(aleatorio, contexto.base))
+    if status == 201:
+        contexto.registrar([json.loads(dados)['id']])
+    return status
+
+
+def _put_imovel(cliente, contexto, aleatorio):
+    ids = contexto.retirar()
+    imovel_id = ids[0] if ids else 0
+    status = cliente.requisitar('PUT', f'/imoveis/{imovel_id}', _novo_imovel(aleatorio, contexto.base))[0]
+    contexto.registrar(ids)
+    return status
+
+
+def _patch_imovel(cliente, contexto, aleatorio):
+    ids = contexto.retirar()
+    imovel_id = ids[0] if ids else 0
+    status = cliente.requisitar('PATCH', f'/imoveis/{imovel_id}', {'valor': round(aleatorio.uniform(1e5, 1e6), 2)})[0]
+    contexto.registrar(ids)
+    return status
+
+
+def _delete_imovel(cliente, contexto, aleatorio):
+    ids = contexto.retirar()
+    return cliente.requisitar('DELETE', f'/imoveis/{ids[0] if ids else 0}')[0]
+
+
+def _post_bulk(cliente, contexto, aleatorio):
+    itens = [_novo_imovel(aleatorio, contexto.base) for _ in range(TAMANHO_BULK)]
+    status, dados, _ = cliente.requisitar('POST', '/imoveis/bulk', itens)
+    if status in (201, 207):
+        contexto.registrar([item['id'] for item in json.loads(dados)['resultados'] if item['status'] == 201])
+    return status
+
+
+def _patch_bulk(cliente, contexto, aleatorio):
+    ids = contexto.retirar(TAMANHO_BULK)
+    itens = [{'id': imovel_id, 'valor': round(aleatorio.uniform(1e5, 1e6), 2)} for imovel_id in ids] or [{'id': 0, 'valor': 1.0}]
+    status = cliente.requisitar('PATCH', '/imoveis/bulk', itens)[0]
+    contexto.registrar(ids)
+    return status
+
+
+def _delete_bulk(cliente, contexto, aleatorio):
+    ids = contexto.retirar(TAMANHO_BULK) or [0]
+    return cliente.requisitar('DELETE', '/imoveis/bulk', ids)[0]
+
+
+ROTAS = [
+    ('GET /imoveis?limit=50', _get('/imoveis?limit=50')),
+    ('GET /imoveis (completa)', _get('/imoveis')),
+    ('GET /imoveis (ndjson)', _get('/imoveis', headers=lambda contexto: {'Accept': 'application/x-ndjson'})),
+    ('GET /imoveis?filtros&sort', _get(lambda contexto, aleatorio:
+        f'/imoveis?valor_min={aleatorio.randint(1, 5) * 100000}&sort=-valor&limit=50')),
+    ('GET /imoveis (304)', _get('/imoveis?limit=50', headers=lambda contexto: {'If-None-Match': contexto.etag or ''})),
+    ('GET /imoveis/<id>', _get(lambda contexto, aleatorio: f'/imoveis/{aleatorio.choice(contexto.ids)}')),
+    ('GET /imoveis/tipo/<tipo>', _get(lambda contexto, aleatorio:
+        f'/imoveis/tipo/{quote(aleatorio.choice(contexto.tipos))}?limit=50')),
+    ('GET /imoveis/cidade/<cidade>', _get(lambda contexto, aleatorio:
+        f'/imoveis/cidade/{quote(aleatorio.choice(contexto.cidades))}?limit=50')),
+    ('GET /imoveis/search', _get(lambda contexto, aleatorio:
+        f'/imoveis/search?q={quote(aleatorio.choice(contexto.cidades))}&limit=10')),
+    ('GET /imoveis/stats', _get('/imoveis/stats?group_by=cidade,tipo&metrics=count,avg,p50')),
+    ('GET /imoveis/changes', _get('/imoveis/changes?since=0&limit=100')),
+    ('GET /cache/estatisticas', _get('/cache/estatisticas')),
+    ('GET /metrics', _get('/metrics')),
+    ('POST /imoveis', _post_imovel),
+    ('PUT /imoveis/<id>', _put_imovel),
+    ('PATCH /imoveis/<id>', _patch_imovel),
+    ('POST /imoveis/bulk', _post_bulk),
+    ('PATCH /imoveis/bulk', _patch_bulk),
+    ('DELETE /imoveis/bulk', _delete_bulk),
+    ('DELETE /imoveis/<id>', _delete_imovel),
+]
+
+
+def medir_rota(url, contexto, rota, duracao, concorrencia, semente):
+    """Dispara a rota com `concorrencia` threads por `duracao` segundos"""
+    latencias = []
+    status = Counter()
+    lock = threading.Lock()
+    prazo = time.perf_counter() + duracao
+
+    def trabalhador(numero):
+        cliente = Cliente(url)
+        aleatorio = random.Random(semente + numero)
+        minhas, meus_status = [], Counter()
+        while time.perf_counter() < prazo:
+            inicio = time.perf_counter()
+            try:
+                codigo = rota(cliente, contexto, aleatorio)
+            except (http.client.HTTPException, OSError):
+                codigo = 'erro'
+            minhas.append(time.perf_counter() - inicio)
+            meus_status[str(codigo)] += 1
+        with lock:
+            latencias.extend(minhas)
+            status.update(meus_status)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=trabalhador, args=(numero,)) for numero in range(concorrencia)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    decorrido = time.perf_counter() - inicio
+    return {
+        'requisicoes': len(latencias),
+        'rps': round(len(latencias) / decorrido, 1),
+        **resumo_latencias(latencias),
+        'status': dict(status)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--semear', action='store_true', help='completa a tabela até --linhas e encerra')
+    parser.add_argument('--linhas', type=int, default=100000)
+    parser.add_argument('--duracao', type=float, default=10, help='segundos por rota')
+    parser.add_argument('--concorrencia', type=int, default=8)
+    parser.add_argument('--rotas', help='trecho do nome das rotas a executar (ex.: GET)')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='arquivo JSON de saída (padrão: benchmarks/resultados/)')
+    args = parser.parse_args()
+
+    if args.semear:
+        semear(args.linhas)
+        return
+
+    contexto = Contexto(Cliente(args.url))
+    resultados = {}
+    for nome, rota in ROTAS:
+        if args.rotas and args.rotas not in nome:
+            continue
+        resultados[nome] = medir_rota(args.url, contexto, rota, args.duracao, args.concorrencia, args.semente)
+        r = resultados[nome]
+        print(f"{nome:<30} {r['rps']:>9.1f} req/s  p50 {r['p50_ms'] or 0:>8.2f} ms  "
+              f"p95 {r['p95_ms'] or 0:>8.2f} ms  p99 {r['p99_ms'] or 0:>8.2f} ms  {r['status']}")
+
+    # Remove o que sobrou dos imóveis criados pelo teste
+    restantes = contexto.retirar(len(contexto.criados))
+    cliente = Cliente(args.url)
+    for inicio in range(0, len(restantes), TAMANHO_BULK):
+        cliente.requisitar('DELETE', '/imoveis/bulk', restantes[inicio:inicio + TAMANHO_BULK])
+
+    parametros = {'url': args.url, 'duracao': args.duracao, 'concorrencia': args.concorrencia, 'semente': args.semente}
+    caminho = salvar_resultado('carga', resultados, parametros, args.saida)
+    print(f'Resultados gravados em {caminho}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compara dois resultados de benchmark (micro, consultas, escritas ou carga) e aponta regressões.
+
+    python benchmarks/comparar.py antes.json depois.json [--tolerancia 10]
+
+Nos micro-benchmarks compara a mediana de cada caso/tamanho; nas consultas, a
+mediana e o p95 de cada caso com e sem sentenças preparadas; nas escritas, o
+p95 e as escritas por segundo com e sem a fila; na carga, o p95 e as
+requisições por segundo de cada rota. Sai com código 1 se alguma métrica
+piorar mais que a tolerância (em %), para uso em CI.
+"""
+import argparse
+import json
+import sys
+
+
+def _metricas(documento):
+    """{(nome, métrica): (valor, maior_e_melhor)} de um arquivo de resultados"""
+    metricas = {}
+    if documento['tipo'] == 'micro':
+        for resultado in documento['resultados']:
+            metricas[(f"{resultado['caso']} [{resultado['linhas']}]", 'mediana_ms')] = (resultado['mediana_ms'], False)
+    elif documento['tipo'] == 'consultas':
+        for resultado in documento['resultados']:
+            modo = 'preparadas' if resultado['preparadas'] else 'texto'
+            metricas[(f"{resultado['caso']} [{modo}]", 'mediana_us')] = (resultado['mediana_us'], False)
+            metricas[(f"{resultado['caso']} [{modo}]", 'p95_us')] = (resultado['p95_us'], False)
+    elif documento['tipo'] == 'escritas':
+        for resultado in documento['resultados']:
+            metricas[(resultado['caso'], 'p95_ms')] = (resultado['p95_ms'], False)
+            metricas[(resultado['caso'], 'escritas_s')] = (resultado['escritas_s'], True)
+    else:
+        for rota, resultado in documento['resultados'].items():
+            metricas[(rota, 'p95_ms')] = (resultado['p95_ms'], False)
+            metricas[(rota, 'rps')] = (resultado['rps'], True)
+    return metricas
+
+
+def comparar(antes, depois, tolerancia):
+    """Lista (nome, métrica, antes, depois, variação %, regressão) das métricas presentes nos dois"""
+    if antes['tipo'] != depois['tipo']:
+        raise ValueError(f"Resultados de tipos diferentes: {antes['tipo']} e {depois['tipo']}")
+    metricas_antes, metricas_depois = _metricas(antes), _metricas(depois)
+    linhas = []
+    for chave, (valor_antes, maior_e_melhor) in metricas_antes.items():
+        if chave not in metricas_depois or not valor_antes or metricas_depois[chave][0] is None:
+            continue
+        valor_depois = metricas_depois[chave][0]
+        variacao = (valor_depois - valor_antes) / valor_antes * 100
+        piora = -variacao if maior_e_melhor else variacao
+        linhas.append((chave[0], chave[1], valor_antes, valor_depois, variacao, piora > tolerancia))
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('antes')
+    parser.add_argument('depois')
+    parser.add_argument('--tolerancia', type=float, default=10, help='piora máxima aceita, em %% (padrão 10)')
+    args = parser.parse_args()
+
+    with open(args.antes, encoding='utf-8') as arquivo:
+        antes = json.load(arquivo)
+    with open(args.depois, encoding='utf-8') as arquivo:
+        depois = json.load(arquivo)
+
+    print(f"{antes.get('commit')} -> {depois.get('commit')} ({antes['tipo']})")
+    regressoes = 0
+    for nome, metrica, valor_antes, valor_depois, variacao, regressao in comparar(antes, depois, args.tolerancia):
+        marca = '  REGRESSÃO' if regressao else ''
+        print(f'{nome:<40} {metrica:<11} {valor_antes:>12.3f} {valor_depois:>12.3f} {variacao:>+8.1f}%{marca}')
+        regressoes += regressao
+    sys.exit(1 if regressoes else 0)
+
+
+if __name__ == '__main__':
+    main()
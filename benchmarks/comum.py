@@ -0,0 +1,83 @@
+"""Funções compartilhadas pelos benchmarks (percentis e gravação dos resultados)"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRETORIO_RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'resultados')
+
+# Os benchmarks importam os módulos da API (utils, views, api) e o gerador de dados
+# sintéticos do carregador.py a partir da raiz do projeto
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+def percentil(ordenadas, p):
+    """Percentil p (0-100) de uma lista já ordenada, por interpolação linear"""
+    if not ordenadas:
+        return None
+    posicao = (len(ordenadas) - 1) * p / 100
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(ordenadas) - 1)
+    return ordenadas[inferior] + (ordenadas[superior] - ordenadas[inferior]) * (posicao - inferior)
+
+
+def resumo_latencias(amostras):
+    """p50/p95/p99/máximo em milissegundos de latências medidas em segundos"""
+    ordenadas = sorted(amostras)
+    return {
+        'p50_ms': _ms(percentil(ordenadas, 50)),
+        'p95_ms': _ms(percentil(ordenadas, 95)),
+        'p99_ms': _ms(percentil(ordenadas, 99)),
+        'max_ms': _ms(ordenadas[-1] if ordenadas else None)
+    }
+
+
+def _ms(segundos):
+    return None if segundos is None else round(segundos * 1000, 3)
+
+
+def commit_atual():
+    """Hash curto do commit em que o benchmark rodou (None fora de um repositório git)"""
+    try:
+        saida = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return saida.stdout.strip()
+
+
+def salvar_resultado(tipo, resultados, parametros, destino=None):
+    """Grava os resultados em JSON com commit, data e ambiente; retorna o caminho do arquivo"""
+    commit = commit_atual()
+    agora = datetime.now(timezone.utc)
+    documento = {
+        'tipo': tipo,
+        'commit': commit,
+        'data': agora.isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parametros': parametros,
+        'resultados': resultados
+    }
+    if destino is None:
+        os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+        destino = os.path.join(DIRETORIO_RESULTADOS, f"{tipo}-{commit or 'sem-commit'}-{agora:%Y%m%dT%H%M%S}.json")
+    with open(destino, 'w', encoding='utf-8') as arquivo:
+        json.dump(documento, arquivo, ensure_ascii=False, indent=2)
+    return destino
+
+
+class Cronometro:
+    """Mede o tempo de um bloco with em segundos (time.perf_counter)"""
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.segundos = time.perf_counter() - self.inicio
+        return False
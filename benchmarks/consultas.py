@@ -0,0 +1,92 @@
+"""Benchmark das consultas fixas da camada de dados contra o banco local (.cred).
+
+Executa a busca por id, a listagem filtrada e a leitura da versão da tabela
+muitas vezes seguidas, primeiro com o SQL em texto e depois com prepared
+statements (DB_PREPARADAS), sem o cache de leitura e reaproveitando a mesma
+conexão do pool. Mostra a mediana e o p95 de cada caso e o ganho das
+sentenças preparadas.
+
+    python benchmarks/carga.py --semear --linhas 100000      # massa de dados, se ainda não houver
+    python benchmarks/consultas.py [--execucoes 2000] [--saida arquivo.json]
+"""
+import argparse
+import statistics
+import time
+
+from comum import percentil, salvar_resultado
+
+import utils
+
+
+def _amostras():
+    """Ids e cidades existentes, usados como parâmetros das consultas"""
+    with utils.obter_conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM imoveis ORDER BY id LIMIT 1000")
+            ids = [linha[0] for linha in cursor.fetchall()]
+            cursor.execute("SELECT DISTINCT cidade FROM imoveis LIMIT 100")
+            cidades = [linha[0] for linha in cursor.fetchall()]
+        finally:
+            cursor.close()
+    if not ids:
+        raise SystemExit('Tabela imoveis vazia; use benchmarks/carga.py --semear')
+    return ids, cidades
+
+
+def _casos(ids, cidades):
+    colunas = utils.COLUNAS_IMOVEL
+    return {
+        'por_id': lambda i: utils._consulta_imovel_por_id(ids[i % len(ids)], colunas),
+        'listagem_filtrada': lambda i: utils._consulta_imoveis({'cidade': (cidades[i % len(cidades)],)}, 20,
+                                                               None, None, colunas, None, None),
+        'versao': lambda i: utils.get_versao_tabela(),
+    }
+
+
+def executar(execucoes, aquecimento=100):
+    utils.cache_imoveis.ativo = False
+    casos = _casos(*_amostras())
+    resultados = []
+    medianas = {}
+    for preparadas in (False, True):
+        utils.PREPARADAS = preparadas
+        for nome, consulta in casos.items():
+            for indice in range(aquecimento):
+                consulta(indice)
+            tempos = []
+            for indice in range(execucoes):
+                inicio = time.perf_counter()
+                consulta(indice)
+                tempos.append(time.perf_counter() - inicio)
+            tempos.sort()
+            mediana = statistics.median(tempos)
+            medianas[(nome, preparadas)] = mediana
+            resultados.append({
+                'caso': nome,
+                'preparadas': preparadas,
+                'execucoes': execucoes,
+                'mediana_us': round(mediana * 1e6, 1),
+                'p95_us': round(percentil(tempos, 95) * 1e6, 1)
+            })
+            print(f"{nome:<18} {'preparadas' if preparadas else 'texto':<10}  mediana {mediana * 1e6:>9.1f} us"
+                  f"  p95 {percentil(tempos, 95) * 1e6:>9.1f} us")
+    for nome in casos:
+        texto, preparada = medianas[(nome, False)], medianas[(nome, True)]
+        print(f'{nome:<18} ganho das sentenças preparadas: {(1 - preparada / texto) * 100:.1f}%')
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--execucoes', type=int, default=2000, help='execuções de cada caso (padrão 2000)')
+    parser.add_argument('--saida', help='arquivo JSON de saída (padrão: benchmarks/resultados/)')
+    args = parser.parse_args()
+
+    resultados = executar(args.execucoes)
+    caminho = salvar_resultado('consultas', resultados, {'execucoes': args.execucoes}, args.saida)
+    print(f'Resultados gravados em {caminho}')
+
+
+if __name__ == '__main__':
+    main()
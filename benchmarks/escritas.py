@@ -0,0 +1,95 @@
+"""Benchmark das escritas de um imóvel contra o banco local (.cred), com e sem a fila de escritas.
+
+Várias threads criam um imóvel e o removem em seguida, repetidamente, por
+alguns segundos: primeiro com um commit por requisição e depois com a fila
+de commit em grupo (IMOVEIS_FILA_ESCRITA). Mostra escritas por segundo,
+p50/p95/p99 de latência e o tamanho médio dos lotes. As linhas criadas são
+removidas pelo próprio benchmark.
+
+    python benchmarks/escritas.py [--threads 32] [--duracao 10] [--saida arquivo.json]
+"""
+import argparse
+import threading
+import time
+
+from comum import resumo_latencias, salvar_resultado
+
+import utils
+from carregador import gerar_sinteticos
+from fila_escrita import FilaEscrita
+
+
+def _rodar(threads, duracao, imoveis):
+    """Executa as threads por `duracao` segundos; retorna (latências, escritas)"""
+    latencias = [[] for _ in range(threads)]
+    fim = time.perf_counter() + duracao
+
+    def trabalhar(indice):
+        amostras = latencias[indice]
+        contador = indice
+        while time.perf_counter() < fim:
+            dados = imoveis[contador % len(imoveis)]
+            contador += threads
+            inicio = time.perf_counter()
+            novo_id = utils.adicionar_imovel_db(dados)
+            meio = time.perf_counter()
+            utils.remover_imovel_db(novo_id)
+            amostras.extend((meio - inicio, time.perf_counter() - meio))
+
+    trabalhadores = [threading.Thread(target=trabalhar, args=(indice,)) for indice in range(threads)]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    todas = [amostra for amostras in latencias for amostra in amostras]
+    return todas, len(todas)
+
+
+def executar(threads, duracao, fila_max, lote_max, intervalo):
+    utils.cache_imoveis.ativo = False
+    imoveis = [dict(zip(utils.CAMPOS_IMOVEL, linha)) for linha in gerar_sinteticos(1000)]
+    fila_original = utils.fila_escritas
+    resultados = []
+    try:
+        for modo in ('commit_por_requisicao', 'fila'):
+            fila = FilaEscrita(utils._gravar_escritas, fila_max, lote_max, intervalo,
+                               ativa=modo == 'fila', sem_repetir=fila_original.sem_repetir)
+            utils.fila_escritas = fila
+            latencias, escritas = _rodar(threads, duracao, imoveis)
+            estatisticas = fila.estatisticas()
+            resultado = {
+                'caso': modo,
+                'threads': threads,
+                'escritas': escritas,
+                'escritas_s': round(escritas / duracao, 1),
+                **resumo_latencias(latencias),
+                'lote_medio': round(estatisticas['escritas'] / estatisticas['lotes'], 1) if estatisticas['lotes'] else 1
+            }
+            resultados.append(resultado)
+            print(f"{modo:<22} {resultado['escritas_s']:>9.1f} escritas/s  p50 {resultado['p50_ms']:>8.3f} ms"
+                  f"  p95 {resultado['p95_ms']:>8.3f} ms  p99 {resultado['p99_ms']:>8.3f} ms  lote médio {resultado['lote_medio']}")
+    finally:
+        utils.fila_escritas = fila_original
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32, help='escritores simultâneos (padrão 32)')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos de cada modo (padrão 10)')
+    parser.add_argument('--fila-max', type=int, default=utils.fila_escritas.tamanho_max)
+    parser.add_argument('--lote', type=int, default=utils.fila_escritas.lote_max, help='escritas por commit na fila')
+    parser.add_argument('--intervalo', type=float, default=utils.fila_escritas.intervalo,
+                        help='segundos de espera por mais escritas antes do commit')
+    parser.add_argument('--saida', help='arquivo JSON de saída (padrão: benchmarks/resultados/)')
+    args = parser.parse_args()
+
+    resultados = executar(args.threads, args.duracao, args.fila_max, args.lote, args.intervalo)
+    parametros = {'threads': args.threads, 'duracao': args.duracao, 'fila_max': args.fila_max,
+                  'lote': args.lote, 'intervalo': args.intervalo}
+    caminho = salvar_resultado('escritas', resultados, parametros, args.saida)
+    print(f'Resultados gravados em {caminho}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Micro-benchmarks dos caminhos Python mais quentes da listagem.
+
+Mede, para coleções de 1k/10k/100k linhas: o mapeamento linha -> dict feito em
+get_imoveis (linhas_para_imoveis), adiciona_hateoas_link, adiciona_hateoas_em_lista,
+o jsonify da coleção com links e o filtro por cidade na lista de dicionários e
+no instantâneo colunar (instantaneo.py), cuja memória por linha também é
+comparada com a da lista. Não precisa de banco.
+
+    python benchmarks/micro.py [--tamanhos 1000,10000,100000] [--repeticoes 5] [--saida arquivo.json]
+"""
+import argparse
+import statistics
+import tracemalloc
+from types import SimpleNamespace
+
+from comum import Cronometro, salvar_resultado
+
+from api import app
+from carregador import gerar_sinteticos
+from flask import jsonify
+from instantaneo import Instantaneo
+from utils import COLUNAS_IMOVEL, linhas_para_imoveis, adiciona_hateoas_link, adiciona_hateoas_em_lista
+
+
+def _linhas(tamanho):
+    """Linhas no formato devolvido pelo cursor (id + colunas da tabela)"""
+    return [(indice + 1,) + linha for indice, linha in enumerate(gerar_sinteticos(tamanho))]
+
+
+def _instantaneo(linhas):
+    instantaneo = Instantaneo()
+    instantaneo.adicionar(linhas)
+    instantaneo.indexar()
+    return instantaneo
+
+
+def _bytes_por_linha(linhas):
+    """Memória por linha da lista de dicionários e do instantâneo montados a partir das linhas"""
+    cursor = SimpleNamespace(description=[(coluna,) for coluna in COLUNAS_IMOVEL])
+    medidas = []
+    for montar in (lambda: linhas_para_imoveis(cursor, linhas), lambda: _instantaneo(linhas)):
+        tracemalloc.start()
+        estrutura = montar()
+        medidas.append(tracemalloc.get_traced_memory()[0] / len(linhas))
+        tracemalloc.stop()
+        del estrutura
+    return medidas
+
+
+def _medir(preparar, executar, repeticoes):
+    """Executa preparar() fora do cronômetro e executar(dados) dentro, repeticoes vezes"""
+    tempos = []
+    for _ in range(repeticoes):
+        dados = preparar()
+        with Cronometro() as cronometro:
+            executar(dados)
+        tempos.append(cronometro.segundos)
+    return tempos
+
+
+def _casos(linhas):
+    cursor = SimpleNamespace(description=[(coluna,) for coluna in COLUNAS_IMOVEL])
+    imoveis = linhas_para_imoveis(cursor, linhas)
+
+    def copias():
+        return [dict(imovel) for imovel in imoveis]
+
+    def com_links():
+        return adiciona_hateoas_em_lista(copias())
+
+    def jsonify_colecao(corpo):
+        with app.app_context():
+            jsonify(corpo).get_data()
+
+    instantaneo = _instantaneo(linhas)
+    cidade = linhas[0][4]
+
+    return {
+        'linhas_para_imoveis': (lambda: linhas, lambda dados: linhas_para_imoveis(cursor, dados)),
+        'adiciona_hateoas_link': (copias, lambda dados: [adiciona_hateoas_link(imovel) for imovel in dados]),
+        'adiciona_hateoas_em_lista': (copias, adiciona_hateoas_em_lista),
+        'jsonify': (com_links, jsonify_colecao),
+        'filtro_cidade_lista': (lambda: imoveis, lambda dados: [imovel for imovel in dados if imovel['cidade'] == cidade]),
+        'filtro_cidade_instantaneo': (lambda: instantaneo, lambda dados: dados.consultar({'cidade': (cidade,)})),
+        'instantaneo_carga': (lambda: linhas, _instantaneo)
+    }
+
+
+def executar(tamanhos, repeticoes):
+    resultados = []
+    for tamanho in tamanhos:
+        linhas = _linhas(tamanho)
+        for nome, (preparar, funcao) in _casos(linhas).items():
+            tempos = _medir(preparar, funcao, repeticoes)
+            mediana = statistics.median(tempos)
+            resultados.append({
+                'caso': nome,
+                'linhas': tamanho,
+                'repeticoes': repeticoes,
+                'min_ms': round(min(tempos) * 1000, 3),
+                'mediana_ms': round(mediana * 1000, 3),
+                'media_ms': round(statistics.mean(tempos) * 1000, 3),
+                'ns_por_linha': round(mediana / tamanho * 1e9, 1)
+            })
+            print(f"{nome:<28} {tamanho:>7} linhas  mediana {mediana * 1000:>10.3f} ms  {mediana / tamanho * 1e9:>8.1f} ns/linha")
+        lista, colunar = _bytes_por_linha(linhas)
+        print(f"{'memória':<28} {tamanho:>7} linhas  lista {lista:>6.0f} B/linha  instantâneo {colunar:>6.0f} B/linha")
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos', default='1000,10000,100000', help='tamanhos das coleções, separados por vírgula')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--saida', help='arquivo JSON de saída (padrão: benchmarks/resultados/)')
+    args = parser.parse_args()
+
+    tamanhos = [int(tamanho) for tamanho in args.tamanhos.split(',')]
+    resultados = executar(tamanhos, args.repeticoes)
+    caminho = salvar_resultado('micro', resultados, {'tamanhos': tamanhos, 'repeticoes': args.repeticoes}, args.saida)
+    print(f'Resultados gravados em {caminho}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+import hashlib
+import hmac
+import io
+import os
+import pickle
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# Valor devolvido por obter() quando a chave não está no cache (None é um valor válido)
+AUSENTE = object()
+
+
+class ErroBackendCache(Exception):
+    """Falha de comunicação com o armazenamento do cache (tratada como falha de leitura)."""
+
+
+# Únicas classes que uma entrada do cache compartilhado pode referenciar: datas e
+# decimais das linhas do MySQL. O resto (dict, list, tuple, str, bytes, números)
+# é desserializado sem importar nada, então uma entrada forjada por quem escreve
+# no Redis ou no arquivo não consegue chamar funções arbitrárias no load.
+CLASSES_PERMITIDAS = {
+    ('datetime', 'date'), ('datetime', 'datetime'), ('datetime', 'time'),
+    ('datetime', 'timedelta'), ('datetime', 'timezone'), ('decimal', 'Decimal')
+}
+
+
+class _UnpicklerRestrito(pickle.Unpickler):
+    def find_class(self, modulo, nome):
+        if (modulo, nome) not in CLASSES_PERMITIDAS:
+            raise pickle.UnpicklingError(f'classe não permitida no cache: {modulo}.{nome}')
+        return super().find_class(modulo, nome)
+
+
+class BackendCache:
+    """Interface dos backends de cache usados pelo utils.py.
+
+    obter(chave, tags) retorna (valor, marca): valor é AUSENTE quando a chave
+    não está no cache, e a marca deve ser repassada a gravar() depois da
+    consulta ao banco, para que uma escrita concorrente não deixe no cache um
+    valor já desatualizado. invalidar(tags) torna inválidas as entradas
+    gravadas com qualquer uma das tags. bloqueante indica que as chamadas
+    fazem E/S (arquivo, rede); o api_async.py as executa em uma thread.
+    """
+
+    ativo = True
+    bloqueante = False
+
+    def obter(self, chave, tags=()):
+        raise NotImplementedError
+
+    def gravar(self, chave, valor, tags=(), marca=None):
+        raise NotImplementedError
+
+    def invalidar(self, tags):
+        raise NotImplementedError
+
+    def limpar(self):
+        raise NotImplementedError
+
+    def estatisticas(self):
+        raise NotImplementedError
+
+
+class CacheLRU(BackendCache):
+    """Cache em memória com limite de entradas (LRU), expiração (TTL) e invalidação por tags.
+
+    Cada entrada é gravada com um conjunto de tags (ex.: ('id', 5) ou
+    ('lista', 'São Paulo', None)). invalidar(tags) remove apenas as entradas
+    marcadas com alguma dessas tags, sem esvaziar o cache inteiro. Vale só
+    para o processo atual: com vários workers, use CacheArquivo ou CacheRedis.
+    """
+
+    def __init__(self, max_entradas=1024, ttl=60.0, ativo=True):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.ativo = ativo
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # chave -> (expira_em, valor, tags)
+        self._por_tag = {}  # tag -> conjunto de chaves
+        self._marca = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self.invalidacoes = 0
+
+    def obter(self, chave, tags=()):
+        """Retorna (valor, marca); a marca é o contador de invalidações no momento da leitura."""
+        if not self.ativo:
+            return AUSENTE, None
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    self._remover(chave)
+                self.falhas += 1
+                return AUSENTE, self._marca
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada[1], self._marca
+
+    def gravar(self, chave, valor, tags=(), marca=None):
+        """Grava o valor; com marca, ignora a gravação se houve invalidação desde a leitura."""
+        if not self.ativo:
+            return
+        with self._lock:
+            if marca is not None and marca != self._marca:
+                return
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = (time.monotonic() + self.ttl, valor, tuple(tags))
+            for tag in tags:
+                self._por_tag.setdefault(tag, set()).add(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._remover(next(iter(self._entradas)))
+                self.remocoes += 1
+
+    def invalidar(self, tags):
+        """Remove as entradas marcadas com qualquer uma das tags."""
+        with self._lock:
+            self._marca += 1
+            for tag in tags:
+                for chave in self._por_tag.pop(tag, ()):
+                    if chave in self._entradas:
+                        self._remover(chave)
+                        self.invalidacoes += 1
+
+    def limpar(self):
+        """Esvazia o cache e zera os contadores."""
+        with self._lock:
+            self._entradas.clear()
+            self._por_tag.clear()
+            self._marca += 1
+            self.acertos = self.falhas = self.remocoes = self.invalidacoes = 0
+
+    def estatisticas(self):
+        """Retorna os contadores de acertos, falhas e remoções."""
+        with self._lock:
+            return {
+                'ativo': self.ativo,
+                'backend': type(self).__name__,
+                'entradas': len(self._entradas),
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'remocoes': self.remocoes,
+                'invalidacoes': self.invalidacoes
+            }
+
+    def _remover(self, chave):
+        _, _, tags = self._entradas.pop(chave)
+        for tag in tags:
+            chaves = self._por_tag.get(tag)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_tag[tag]
+
+
+class CacheVersionado(BackendCache):
+    """Base dos backends compartilhados entre workers, com invalidação por versão.
+
+    Cada tag tem um contador de versão no armazenamento compartilhado. A
+    entrada é gravada junto com as versões das suas tags lidas antes da
+    consulta ao banco. invalidar() apenas incrementa os contadores; como toda
+    leitura compara as versões gravadas com as atuais, a escrita feita por um
+    worker já é vista pelos outros na requisição seguinte.
+    """
+
+    TAG_GLOBAL = ('todos',)
+    bloqueante = True
+
+    def __init__(self, ttl=60.0, ativo=True, prefixo='imoveis', chave_assinatura=None):
+        self.ttl = ttl
+        self.ativo = ativo
+        self.prefixo = prefixo
+        # Com a chave, cada entrada leva um HMAC-SHA256 e as que não conferem são ignoradas
+        self.chave_assinatura = chave_assinatura.encode() if isinstance(chave_assinatura, str) else chave_assinatura
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.invalidacoes = 0
+        self.erros = 0
+
+    def obter(self, chave, tags=()):
+        if not self.ativo:
+            return AUSENTE, None
+        tags = (self.TAG_GLOBAL,) + tuple(tags)
+        try:
+            bruto, *versoes = self._ler([self._chave_entrada(chave)] + [self._chave_versao(tag) for tag in tags])
+        except ErroBackendCache:
+            self._contar('erros')
+            return AUSENTE, None
+        versoes = tuple(int(versao or 0) for versao in versoes)
+        if bruto is not None:
+            try:
+                versoes_gravadas, valor = self._desserializar(bruto)
+            except (pickle.UnpicklingError, ValueError, TypeError, EOFError):
+                self._contar('erros')
+                return AUSENTE, versoes
+            if versoes_gravadas == versoes:
+                self._contar('acertos')
+                return valor, versoes
+        self._contar('falhas')
+        return AUSENTE, versoes
+
+    def gravar(self, chave, valor, tags=(), marca=None):
+        if not self.ativo or marca is None:
+            return
+        try:
+            self._escrever(self._chave_entrada(chave), self._serializar((marca, valor)), self.ttl)
+        except ErroBackendCache:
+            self._contar('erros')
+
+    def invalidar(self, tags):
+        try:
+            self._incrementar([self._chave_versao(tag) for tag in tags])
+            self._contar('invalidacoes')
+        except ErroBackendCache:
+            self._contar('erros')
+
+    def limpar(self):
+        """Invalida todas as entradas (em todos os workers) e zera os contadores locais."""
+        self.invalidar([self.TAG_GLOBAL])
+        with self._lock:
+            self.acertos = self.falhas = self.invalidacoes = self.erros = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'ativo': self.ativo,
+                'backend': type(self).__name__,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'invalidacoes': self.invalidacoes,
+                'erros': self.erros
+            }
+
+    def _serializar(self, entrada):
+        dados = pickle.dumps(entrada, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.chave_assinatura:
+            dados = hmac.digest(self.chave_assinatura, dados, hashlib.sha256) + dados
+        return dados
+
+    def _desserializar(self, bruto):
+        """Entrada gravada por _serializar; ValueError se a assinatura não confere"""
+        if self.chave_assinatura:
+            assinatura, bruto = bruto[:32], bruto[32:]
+            if not hmac.compare_digest(assinatura, hmac.digest(self.chave_assinatura, bruto, hashlib.sha256)):
+                raise ValueError('assinatura inválida na entrada do cache')
+        return _UnpicklerRestrito(io.BytesIO(bruto)).load()
+
+    def _contar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def _chave_entrada(self, chave):
+        return f'{self.prefixo}:e:{chave!r}'
+
+    def _chave_versao(self, tag):
+        return f'{self.prefixo}:v:{tag!r}'
+
+    def _ler(self, chaves):
+        """Retorna o valor bruto da primeira chave e as versões das demais (None se ausentes)."""
+        raise NotImplementedError
+
+    def _escrever(self, chave, valor, ttl):
+        raise NotImplementedError
+
+    def _incrementar(self, chaves):
+        raise NotImplementedError
+
+
+class CacheArquivo(CacheVersionado):
+    """Cache compartilhado pelos workers de um mesmo host, guardado em um arquivo SQLite.
+
+    Por padrão o arquivo fica em /dev/shm (memória compartilhada) quando
+    disponível. Cada thread de cada processo abre a própria conexão.
+    """
+
+    def __init__(self, caminho=None, max_entradas=10000, **kwargs):
+        super().__init__(**kwargs)
+        diretorio = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        self.caminho = caminho or os.path.join(diretorio, 'imoveis_cache.sqlite')
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        self._gravacoes = 0
+
+    def _conexao(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.caminho, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # Conteúdo descartável: dispensa fsync
+            conn.execute('CREATE TABLE IF NOT EXISTS entradas (chave TEXT PRIMARY KEY, valor BLOB, expira_em REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS versoes (chave TEXT PRIMARY KEY, versao INTEGER)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ler(self, chaves):
+        entrada, *chaves_versao = chaves
+        try:
+            conn = self._conexao()
+            linha = conn.execute(
+                'SELECT valor FROM entradas WHERE chave = ? AND expira_em > ?', (entrada, time.time())
+            ).fetchone()
+            marcadores = ','.join('?' * len(chaves_versao))
+            versoes = dict(conn.execute(f'SELECT chave, versao FROM versoes WHERE chave IN ({marcadores})', chaves_versao))
+        except sqlite3.Error as err:
+            raise ErroBackendCache(str(err)) from err
+        return [linha[0] if linha else None] + [versoes.get(chave) for chave in chaves_versao]
+
+    def _escrever(self, chave, valor, ttl):
+        try:
+            conn = self._conexao()
+            conn.execute('INSERT OR REPLACE INTO entradas VALUES (?, ?, ?)', (chave, valor, time.time() + ttl))
+            self._gravacoes += 1
+            if self._gravacoes % 256 == 0:
+                # Limpeza periódica: expiradas e, acima do limite, as que expiram antes
+                conn.execute('DELETE FROM entradas WHERE expira_em <= ?', (time.time(),))
+                conn.execute(
+                    'DELETE FROM entradas WHERE chave IN '
+                    '(SELECT chave FROM entradas ORDER BY expira_em DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entradas,)
+                )
+        except sqlite3.Error as err:
+            raise ErroBackendCache(str(err)) from err
+
+    def _incrementar(self, chaves):
+        try:
+            self._conexao().executemany(
+                'INSERT INTO versoes VALUES (?, 1) ON CONFLICT(chave) DO UPDATE SET versao = versao + 1',
+                [(chave,) for chave in chaves]
+            )
+        except sqlite3.Error as err:
+            raise ErroBackendCache(str(err)) from err
+
+
+class CacheRedis(CacheVersionado):
+    """Cache compartilhado em um servidor que fala o protocolo do Redis (RESP).
+
+    Usa um cliente mínimo sobre socket (MGET, SET PX e INCR), com uma conexão
+    por thread. Falhas de rede viram falhas de cache, sem derrubar a API.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=0.5, **kwargs):
+        super().__init__(**kwargs)
+        partes = urlparse(url)
+        self.host = partes.hostname or 'localhost'
+        self.porta = partes.port or 6379
+        self.banco = int(partes.path.lstrip('/') or 0)
+        self.senha = partes.password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _ler(self, chaves):
+        return self._executar([('MGET', *chaves)])[0]
+
+    def _escrever(self, chave, valor, ttl):
+        self._executar([('SET', chave, valor, 'PX', int(ttl * 1000))])
+
+    def _incrementar(self, chaves):
+        self._executar([('INCR', chave) for chave in chaves])
+
+    def _executar(self, comandos):
+        """Envia os comandos em pipeline e retorna as respostas na mesma ordem.
+
+        Qualquer erro descarta a conexão: um -ERR no meio do pipeline deixaria
+        as respostas seguintes no socket, e o próximo comando leria a errada.
+        """
+        try:
+            sock, leitor = self._conexao()
+            sock.sendall(b''.join(self._codificar(comando) for comando in comandos))
+            return [self._ler_resposta(leitor) for _ in comandos]
+        except (OSError, ValueError, ErroBackendCache) as err:
+            self._desconectar()
+            if isinstance(err, ErroBackendCache):
+                raise
+            raise ErroBackendCache(str(err)) from err
+
+    def _conexao(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.sock = None
+        if self._local.sock is None:
+            sock = socket.create_connection((self.host, self.porta), timeout=self.timeout)
+            leitor = sock.makefile('rb')
+            iniciais = []
+            if self.senha:
+                iniciais.append(('AUTH', self.senha))
+            if self.banco:
+                iniciais.append(('SELECT', self.banco))
+            try:
+                for comando in iniciais:
+                    sock.sendall(self._codificar(comando))
+                    self._ler_resposta(leitor)
+            except BaseException:
+                # AUTH/SELECT recusados: a conexão não autenticada não é guardada
+                sock.close()
+                raise
+            self._local.sock, self._local.leitor, self._local.pid = sock, leitor, os.getpid()
+        return self._local.sock, self._local.leitor
+
+    def _desconectar(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _codificar(comando):
+        partes = [b'*%d\r\n' % len(comando)]
+        for argumento in comando:
+            if not isinstance(argumento, bytes):
+                argumento = str(argumento).encode()
+            partes.append(b'$%d\r\n%s\r\n' % (len(argumento), argumento))
+        return b''.join(partes)
+
+    def _ler_resposta(self, leitor):
+        linha = leitor.readline()
+        if not linha:
+            raise ConnectionError('conexão encerrada pelo servidor')
+        tipo, conteudo = linha[:1], linha[1:-2]
+        if tipo == b'+':
+            return conteudo
+        if tipo == b'-':
+            raise ErroBackendCache(conteudo.decode())
+        if tipo == b':':
+            return int(conteudo)
+        if tipo == b'$':
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            dados = leitor.read(tamanho + 2)
+            return dados[:-2]
+        if tipo == b'*':
+            tamanho = int(conteudo)
+            if tamanho < 0:
+                return None
+            return [self._ler_resposta(leitor) for _ in range(tamanho)]
+        raise ErroBackendCache(f'resposta inesperada do servidor: {linha!r}')
+
+
+def criar_cache(backend='local', max_entradas=1024, ttl=60.0, ativo=True, arquivo=None, url_redis=None,
+                chave_assinatura=None):
+    """Cria o backend de cache escolhido: 'local', 'arquivo' ou 'redis'."""
+    if backend == 'arquivo':
+        return CacheArquivo(caminho=arquivo, max_entradas=max_entradas, ttl=ttl, ativo=ativo,
+                            chave_assinatura=chave_assinatura)
+    if backend == 'redis':
+        return CacheRedis(url=url_redis or 'redis://localhost:6379/0', ttl=ttl, ativo=ativo,
+                          chave_assinatura=chave_assinatura)
+    if backend == 'local':
+        return CacheLRU(max_entradas=max_entradas, ttl=ttl, ativo=ativo)
+    raise ValueError(f'Backend de cache desconhecido: {backend}')
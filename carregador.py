@@ -0,0 +1,237 @@
+"""Carga rápida da tabela imoveis para staging e testes de carga.
+
+    python carregador.py dados.csv                   # CSV com cabeçalho (colunas de CAMPOS_IMOVEL)
+    python carregador.py dados.ndjson                # um objeto JSON por linha
+    python carregador.py --sinteticos 5000000        # massa com a distribuição do imoveis.sql
+    python carregador.py dados.csv --load-data       # LOAD DATA LOCAL INFILE em vez de INSERT
+
+Insere em lotes grandes (INSERT de várias linhas ou LOAD DATA, um commit por
+lote) e informa o progresso em linhas por segundo. Por padrão os índices
+secundários são removidos antes da carga e recriados no final, o que é bem mais
+rápido do que atualizá-los linha a linha; --manter-indices desliga isso. Cada
+lote entra no log de alterações (imoveis_alteracoes) no mesmo commit, então os
+consumidores de /imoveis/changes recebem as linhas carregadas.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+from utils import connect_db, CAMPOS_IMOVEL, _incrementar_versao
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+LOTE_PADRAO = 5000
+INTERVALO_PROGRESSO = 2.0
+
+_INSERT = re.compile(r"INSERT INTO imoveis \([^)]*\) VALUES \((.*)\);")
+_VALOR = re.compile(r"'((?:[^']|'')*)'|([-\d.]+)")
+# Índices secundários na saída do SHOW CREATE TABLE (KEY, UNIQUE KEY, FULLTEXT KEY, SPATIAL KEY)
+_INDICE = re.compile(r"^\s*((?:UNIQUE |FULLTEXT |SPATIAL )?KEY `([^`]+)` .*?),?$")
+
+
+def imoveis_do_sql(caminho=None):
+    """Lê as linhas de exemplo (sem id) dos INSERTs do imoveis.sql"""
+    caminho = caminho or os.path.join(RAIZ, 'imoveis.sql')
+    linhas = []
+    with open(caminho, encoding='utf-8') as arquivo:
+        for texto in arquivo:
+            encontrado = _INSERT.search(texto)
+            if not encontrado:
+                continue
+            valores = []
+            for literal, numero in _VALOR.findall(encontrado.group(1)):
+                valores.append(float(numero) if numero else literal.replace("''", "'"))
+            linhas.append(tuple(valores))
+    return linhas
+
+
+def gerar_sinteticos(quantidade, semente=42, base=None):
+    """Gera linhas com a distribuição do imoveis.sql, uma por vez (sem montar a massa em memória).
+
+    Cada linha parte de um imóvel sorteado da semente, o que mantém juntos
+    bairro, cidade, CEP e tipo e preserva as proporções de cada um. O valor
+    varia com um fator log-normal em torno de 1 e o ano é sorteado entre os da
+    semente, então médias por grupo e o histograma por ano seguem os originais.
+    """
+    base = base or imoveis_do_sql()
+    anos = [linha[7][:4] for linha in base if linha[7]]
+    aleatorio = random.Random(semente)
+    for indice in range(quantidade):
+        logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, _ = aleatorio.choice(base)
+        data = f'{aleatorio.choice(anos)}-{aleatorio.randint(1, 12):02d}-{aleatorio.randint(1, 28):02d}'
+        yield (f'{logradouro} {indice + 1}', tipo_logradouro, bairro, cidade, cep, tipo,
+               round(valor * aleatorio.lognormvariate(0, 0.15), 2), data)
+
+
+def _linha(dados):
+    """Dicionário de um imóvel -> tupla na ordem de CAMPOS_IMOVEL (texto vazio vira NULL)"""
+    faltando = [campo for campo in CAMPOS_IMOVEL if campo not in dados]
+    if faltando:
+        raise ValueError(f"Campos obrigatórios ausentes: {', '.join(faltando)}")
+    valores = {campo: None if dados[campo] == '' else dados[campo] for campo in CAMPOS_IMOVEL}
+    if isinstance(valores['valor'], str):
+        valores['valor'] = float(valores['valor'])
+    return tuple(valores.values())
+
+
+def ler_arquivo(caminho):
+    """Linhas de um CSV (com cabeçalho) ou NDJSON, pela extensão do arquivo"""
+    with open(caminho, encoding='utf-8', newline='') as arquivo:
+        if caminho.endswith(('.ndjson', '.jsonl')):
+            for texto in arquivo:
+                if texto.strip():
+                    yield _linha(json.loads(texto))
+        else:
+            for dados in csv.DictReader(arquivo):
+                yield _linha(dados)
+
+
+def _lotes(linhas, tamanho):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) == tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def indices_secundarios(cursor):
+    """{nome: definição} dos índices secundários da tabela imoveis, pelo SHOW CREATE TABLE"""
+    cursor.execute("SHOW CREATE TABLE imoveis")
+    definicao = cursor.fetchone()[1]
+    indices = {}
+    for texto in definicao.splitlines():
+        encontrado = _INDICE.match(texto)
+        if encontrado:
+            indices[encontrado.group(2)] = encontrado.group(1)
+    return indices
+
+
+def _campo_tsv(valor):
+    """Valor no formato padrão do LOAD DATA (tab entre campos, \\N para NULL, barra invertida como escape)"""
+    if valor is None:
+        return '\\N'
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def _inserir(cursor, lote):
+    colunas = ', '.join(CAMPOS_IMOVEL)
+    linha = '(' + ', '.join(['%s'] * len(CAMPOS_IMOVEL)) + ')'
+    cursor.execute(f"INSERT INTO imoveis ({colunas}) VALUES {', '.join([linha] * len(lote))}",
+                   tuple(valor for item in lote for valor in item))
+
+
+def _load_data(cursor, lote):
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv', delete=False) as arquivo:
+        for item in lote:
+            arquivo.write('\t'.join(_campo_tsv(valor) for valor in item) + '\n')
+    try:
+        cursor.execute(f"LOAD DATA LOCAL INFILE %s INTO TABLE imoveis CHARACTER SET utf8mb4 "
+                       f"({', '.join(CAMPOS_IMOVEL)})", (arquivo.name,))
+    finally:
+        os.remove(arquivo.name)
+
+
+def _maior_id(cursor):
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM imoveis")
+    return cursor.fetchone()[0]
+
+
+def _registrar_lote(cursor, maior_id):
+    """Acrescenta uma entrada 'criado' ao log para cada linha do lote, na transação do lote.
+
+    Os ids são os acima do maior antes do lote, lidos do banco porque o LOAD
+    DATA não informa os ids gerados. Uma escrita da API que caia no meio do
+    lote entra duas vezes no log, o que não muda o resultado para quem aplica
+    as entradas em ordem. Como em utils._registrar_alteracoes, a versão da
+    tabela é incrementada antes, para os seq seguirem a ordem dos commits.
+    """
+    _incrementar_versao(cursor)
+    cursor.execute("INSERT INTO imoveis_alteracoes (imovel_id, operacao) SELECT id, 'criado' FROM imoveis WHERE id > %s",
+                   (maior_id,))
+
+
+def _recriar_indices(cursor, indices, saida):
+    print(f'Recriando {len(indices)} índices...', file=saida)
+    inicio = time.perf_counter()
+    cursor.execute(f"ALTER TABLE imoveis {', '.join(f'ADD {definicao}' for definicao in indices.values())}")
+    print(f'Índices recriados em {time.perf_counter() - inicio:.1f} s', file=saida)
+
+
+def carregar(linhas, tamanho_lote=LOTE_PADRAO, adiar_indices=True, load_data=False, saida=sys.stderr):
+    """Insere as linhas em lotes e retorna (linhas inseridas, segundos).
+
+    Com adiar_indices, os índices secundários são removidos antes da carga e
+    recriados ao final, mesmo que a carga falhe no meio (as definições também
+    são impressas na saída, para recriação manual se o processo for morto).
+    Se a recriação também falhar após um erro na carga, o erro levantado
+    continua sendo o da carga.
+    """
+    conn = connect_db(allow_local_infile=True) if load_data else connect_db()
+    cursor = conn.cursor()
+    inserir = _load_data if load_data else _inserir
+    indices = {}
+    total = 0
+    inicio = ultimo_aviso = time.perf_counter()
+    try:
+        existentes = indices_secundarios(cursor) if adiar_indices else {}
+        if existentes:
+            print(f"Removendo índices (recriar com ALTER TABLE imoveis ADD ...): "
+                  f"{'; '.join(existentes.values())}", file=saida)
+            cursor.execute(f"ALTER TABLE imoveis {', '.join(f'DROP INDEX `{nome}`' for nome in existentes)}")
+            indices = existentes
+        for lote in _lotes(linhas, tamanho_lote):
+            maior_id = _maior_id(cursor)
+            inserir(cursor, lote)
+            _registrar_lote(cursor, maior_id)
+            conn.commit()
+            total += len(lote)
+            agora = time.perf_counter()
+            if agora - ultimo_aviso >= INTERVALO_PROGRESSO:
+                print(f'{total} linhas ({total / (agora - inicio):.0f} linhas/s)', file=saida)
+                ultimo_aviso = agora
+    except BaseException:
+        if indices:
+            try:
+                # O ALTER TABLE confirma a transação aberta; o lote que falhou é desfeito antes
+                conn.rollback()
+                _recriar_indices(cursor, indices, saida)
+            except Exception as erro:
+                print(f"Falha ao recriar os índices ({erro}); recrie-os com ALTER TABLE imoveis ADD ...: "
+                      f"{'; '.join(indices.values())}", file=saida)
+        raise
+    else:
+        if indices:
+            _recriar_indices(cursor, indices, saida)
+    finally:
+        cursor.close()
+        conn.close()
+    return total, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('arquivo', nargs='?', help='CSV ou NDJSON (.ndjson/.jsonl)')
+    parser.add_argument('--sinteticos', type=int, help='gera N imóveis com a distribuição do imoveis.sql')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--lote', type=int, default=LOTE_PADRAO, help=f'linhas por lote (padrão {LOTE_PADRAO})')
+    parser.add_argument('--load-data', action='store_true', help='usa LOAD DATA LOCAL INFILE (requer local_infile no servidor)')
+    parser.add_argument('--manter-indices', action='store_true', help='não remove os índices durante a carga')
+    args = parser.parse_args()
+    if bool(args.arquivo) == bool(args.sinteticos):
+        parser.error('informe um arquivo ou --sinteticos N')
+
+    linhas = gerar_sinteticos(args.sinteticos, args.semente) if args.sinteticos else ler_arquivo(args.arquivo)
+    total, segundos = carregar(linhas, args.lote, not args.manter_indices, args.load_data)
+    print(f'{total} imóveis carregados em {segundos:.1f} s ({total / segundos if segundos else 0:.0f} linhas/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import threading
+
+# Coalescência de consultas idênticas (single-flight, IMOVEIS_COALESCER=0 desliga).
+# Quando várias requisições simultâneas fazem a mesma listagem (ex.: a página de
+# uma cidade compartilhada), só a primeira vai ao banco; as outras esperam o
+# resultado dela. Vale para as threads (api.py) e para as corrotinas
+# (api_async.py) de um mesmo processo. Quem espera mais que `espera` segundos
+# desiste e consulta o banco sozinho, então uma consulta lenta não segura a fila
+# inteira por mais que isso.
+
+logger = logging.getLogger('imoveis.coalescencia')
+
+
+class _Voo:
+    __slots__ = ('pronto', 'resultado', 'erro')
+
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class Coalescedor:
+    """Executa uma só vez as chamadas simultâneas com a mesma chave.
+
+    executar(chave, funcao) chama funcao() se não houver outra chamada com a
+    chave em andamento; se houver, espera por ela e devolve o mesmo resultado
+    (ou levanta o mesmo erro). O resultado é compartilhado: quem recebe deve
+    copiá-lo antes de alterar. invalidar() é chamado após cada escrita: as
+    chamadas já em andamento terminam, mas quem chega depois não se junta a
+    elas, porque podem ter lido o banco antes da escrita.
+    """
+
+    def __init__(self, ativo=True, espera=5.0):
+        self.ativo = ativo
+        self.espera = espera
+        self._reiniciar()
+        if hasattr(os, 'register_at_fork'):
+            # Os voos em andamento são de threads do pai, que não existem no filho
+            os.register_at_fork(after_in_child=self._reiniciar)
+
+    def _reiniciar(self):
+        self._lock = threading.Lock()
+        self._voos = {}
+        self._voos_async = {}
+        self._geracao = 0
+        self.consultas = 0
+        self.coalescidas = 0
+        self.esgotadas = 0
+
+    def invalidar(self):
+        with self._lock:
+            self._geracao += 1
+
+    def executar(self, chave, funcao):
+        if not self.ativo:
+            return funcao()
+        with self._lock:
+            chave = (self._geracao, chave)
+            voo = self._voos.get(chave)
+            lider = voo is None
+            if lider:
+                voo = self._voos[chave] = _Voo()
+                self.consultas += 1
+        if not lider:
+            return self._esperar(voo, funcao)
+        try:
+            voo.resultado = funcao()
+            return voo.resultado
+        except BaseException as erro:
+            voo.erro = erro
+            raise
+        finally:
+            with self._lock:
+                del self._voos[chave]
+            voo.pronto.set()
+
+    def _esperar(self, voo, funcao):
+        if not voo.pronto.wait(self.espera):
+            with self._lock:
+                self.esgotadas += 1
+            logger.warning('Consulta coalescida passou de %.1f s; consultando o banco sem esperar', self.espera)
+            return funcao()
+        with self._lock:
+            self.coalescidas += 1
+        if voo.erro is not None:
+            raise voo.erro
+        return voo.resultado
+
+    async def executar_async(self, chave, funcao):
+        """Versão para corrotinas: funcao() devolve o awaitable da consulta"""
+        if not self.ativo:
+            return await funcao()
+        with self._lock:
+            # Futures pertencem a um event loop; cada loop tem os próprios voos
+            chave = (id(asyncio.get_running_loop()), self._geracao, chave)
+            voo = self._voos_async.get(chave)
+            lider = voo is None
+            if lider:
+                voo = self._voos_async[chave] = asyncio.get_running_loop().create_future()
+                self.consultas += 1
+        if not lider:
+            try:
+                resultado = await asyncio.wait_for(asyncio.shield(voo), self.espera)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.esgotadas += 1
+                logger.warning('Consulta coalescida passou de %.1f s; consultando o banco sem esperar', self.espera)
+                return await funcao()
+            except asyncio.CancelledError:
+                if not voo.cancelled():
+                    raise
+                # A requisição que consultava o banco foi cancelada (cliente desconectou)
+                return await funcao()
+            with self._lock:
+                self.coalescidas += 1
+            return resultado
+        try:
+            resultado = await funcao()
+        except Exception as erro:
+            voo.set_exception(erro)
+            # Sem seguidores, ninguém lê a exceção do future
+            voo.exception()
+            raise
+        except BaseException:
+            voo.cancel()
+            raise
+        else:
+            voo.set_result(resultado)
+            return resultado
+        finally:
+            with self._lock:
+                del self._voos_async[chave]
+
+    def estatisticas(self):
+        """Retorna contadores da coalescência."""
+        with self._lock:
+            return {
+                'em_andamento': len(self._voos) + len(self._voos_async),
+                'consultas': self.consultas,
+                'coalescidas': self.coalescidas,
+                'esgotadas': self.esgotadas
+            }
@@ -0,0 +1,87 @@
+import gzip
+import os
+from cache import AUSENTE
+from metricas import fase
+
+try:
+    import brotli
+except ImportError:  # sem o pacote brotli, 'br' não é oferecido
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # sem o pacote zstandard, 'zstd' não é oferecido
+    zstandard = None
+
+# Compressão negociada das respostas JSON (Accept-Encoding). As listagens têm
+# chaves, prefixos de links e cidades repetidos em toda linha e encolhem cerca
+# de 10x. Respostas com ETag são comprimidas uma vez por versão da tabela: os
+# bytes comprimidos ficam no cache de leitura, junto das listagens.
+
+ATIVO = os.getenv('IMOVEIS_COMPRESSAO', '1') != '0'
+TAMANHO_MIN = int(os.getenv('IMOVEIS_COMPRESSAO_MIN', 1024))
+
+# Nível de cada algoritmo (gzip 1-9, br 0-11, zstd 1-22)
+NIVEIS = {
+    'gzip': int(os.getenv('IMOVEIS_COMPRESSAO_NIVEL_GZIP', 6)),
+    'br': int(os.getenv('IMOVEIS_COMPRESSAO_NIVEL_BR', 5)),
+    'zstd': int(os.getenv('IMOVEIS_COMPRESSAO_NIVEL_ZSTD', 3)),
+}
+
+# Algoritmos disponíveis, do preferido ao menos preferido (vale em caso de empate no q=)
+CODIFICACOES = tuple(
+    codificacao for codificacao, modulo in (('zstd', zstandard), ('br', brotli), ('gzip', gzip)) if modulo
+)
+
+MIMETYPES = ('application/json', 'application/x-ndjson')
+
+
+def negociar(accept_encodings):
+    """Melhor codificação aceita pelo cliente (request.accept_encodings), ou None"""
+    if not ATIVO:
+        return None
+    return accept_encodings.best_match(CODIFICACOES)
+
+
+def comprimir(dados, codificacao):
+    nivel = NIVEIS[codificacao]
+    with fase('compressao'):
+        if codificacao == 'gzip':
+            return gzip.compress(dados, compresslevel=nivel, mtime=0)
+        if codificacao == 'br':
+            return brotli.compress(dados, quality=nivel)
+        return zstandard.ZstdCompressor(level=nivel).compress(dados)
+
+
+def compressivel(response, em_streaming):
+    """Indica se a resposta pode variar com o Accept-Encoding (JSON com corpo já montado)"""
+    return (ATIVO and response.status_code == 200 and not em_streaming
+            and response.mimetype in MIMETYPES and 'Content-Encoding' not in response.headers)
+
+
+def aplicar(response, dados, codificacao, caminho, cache):
+    """Troca o corpo pela versão comprimida com codificacao, se valer a pena.
+
+    Com ETag, a versão comprimida é lida do cache (ou gravada nele) pela chave
+    (ETag, caminho, codificação); como o ETag muda a cada escrita na tabela,
+    as entradas antigas nunca são servidas e apenas expiram.
+    """
+    response.vary.add('Accept-Encoding')
+    if codificacao is None or len(dados) < TAMANHO_MIN:
+        return response
+    etag, _ = response.get_etag()
+    comprimidos = AUSENTE
+    if etag:
+        chave = ('comprimida', etag, caminho, codificacao)
+        comprimidos, marca = cache.obter(chave)
+    if comprimidos is AUSENTE:
+        comprimidos = comprimir(dados, codificacao)
+        if etag:
+            cache.gravar(chave, comprimidos, marca=marca)
+    response.set_data(comprimidos)
+    response.headers['Content-Encoding'] = codificacao
+    if etag:
+        # A representação comprimida não é idêntica byte a byte: o ETag passa a
+        # ser fraco, e If-None-Match continua valendo para as duas versões
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,177 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+
+# Fila de escritas com commit em grupo (IMOVEIS_FILA_ESCRITA=1).
+# As escritas de um imóvel (POST/PUT/DELETE) de várias requisições simultâneas
+# são entregues a uma única thread, que as executa em ordem na mesma transação
+# e faz um só commit por lote. Cada requisição continua esperando o commit do
+# seu lote e recebe o próprio resultado (o id gerado no POST, as linhas
+# alteradas no PUT/DELETE), então nada é confirmado ao cliente antes de gravado.
+
+logger = logging.getLogger('imoveis.fila_escrita')
+
+
+class FilaCheia(Exception):
+    """A fila de escritas está cheia; o cliente deve tentar de novo após `espera` segundos"""
+
+    def __init__(self, espera):
+        super().__init__(f'Fila de escritas cheia; tente novamente em {espera} s')
+        self.espera = espera
+
+
+class _Pedido:
+    __slots__ = ('operacao', 'funcao', 'pronto', 'resultado', 'erro')
+
+    def __init__(self, operacao, funcao=None):
+        self.operacao = operacao
+        self.funcao = funcao
+        self.pronto = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class FilaEscrita:
+    """Agrupa escritas enviadas por várias threads em transações com um único commit.
+
+    executar(operacoes) grava a lista de operações em uma transação e devolve
+    o resultado de cada uma, na mesma ordem. Um lote reúne o que chegar em
+    até `intervalo` segundos após a primeira operação, com no máximo
+    `lote_max` operações. Como uma só thread grava, na ordem de chegada, as
+    escritas de um mesmo id nunca são reordenadas. Se o lote falhar (ex.: um
+    valor recusado pelo banco ou um corpo malformado), cada operação é
+    gravada de novo sozinha, para que só a que falhou receba o erro. Os erros
+    em `sem_repetir` (ex.: banco indisponível) não dependem da operação e vão
+    direto para todas as do lote.
+
+    enviar_grupo(funcao) serve às operações em lote, que têm transação
+    própria: funcao() roda na mesma thread, sozinha, depois das escritas que
+    chegaram antes dela e antes das que chegarem depois, então as escritas de
+    um id seguem a ordem de chegada também entre as rotas /imoveis/bulk e as
+    de um imóvel.
+    """
+
+    def __init__(self, executar, tamanho_max=1000, lote_max=100, intervalo=0.002, ativa=False, sem_repetir=()):
+        self._executar = executar
+        self.tamanho_max = tamanho_max
+        self.lote_max = lote_max
+        self.intervalo = intervalo
+        self.ativa = ativa
+        self.sem_repetir = tuple(sem_repetir)
+        self._reiniciar()
+        if hasattr(os, 'register_at_fork'):
+            # A thread de gravação não sobrevive ao fork; o filho cria a sua no primeiro envio
+            os.register_at_fork(after_in_child=self._reiniciar)
+
+    def _reiniciar(self):
+        self._fila = queue.Queue(self.tamanho_max)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._duracao_media = self.intervalo
+        self.lotes = 0
+        self.escritas = 0
+        self.rejeitadas = 0
+        self.maior_lote = 0
+
+    def enviar(self, operacao):
+        """Enfileira a operação e espera o commit do lote; devolve o resultado ou levanta o erro dela"""
+        return self._aguardar(_Pedido(operacao))
+
+    def enviar_grupo(self, funcao):
+        """Enfileira funcao (uma gravação com transação própria) e espera ela rodar na thread da fila"""
+        return self._aguardar(_Pedido(None, funcao))
+
+    def _aguardar(self, pedido):
+        self._iniciar()
+        try:
+            self._fila.put_nowait(pedido)
+        except queue.Full:
+            with self._lock:
+                self.rejeitadas += 1
+            raise FilaCheia(self.espera_estimada()) from None
+        pedido.pronto.wait()
+        if pedido.erro is not None:
+            raise pedido.erro
+        return pedido.resultado
+
+    def espera_estimada(self):
+        """Segundos (inteiros, mínimo 1) até a fila atual ser gravada, pela duração média dos lotes"""
+        lotes = math.ceil(self._fila.qsize() / self.lote_max)
+        return max(1, math.ceil(lotes * self._duracao_media))
+
+    def _iniciar(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._trabalhar, name='fila-escrita', daemon=True)
+                    self._thread.start()
+
+    def _trabalhar(self):
+        seguinte = None
+        while True:
+            lote = [seguinte or self._fila.get()]
+            seguinte = None
+            prazo = time.monotonic() + self.intervalo
+            while lote[0].funcao is None and len(lote) < self.lote_max:
+                restante = prazo - time.monotonic()
+                try:
+                    pedido = self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if pedido.funcao is not None:
+                    # Um grupo fecha o lote e roda sozinho logo depois dele
+                    seguinte = pedido
+                    break
+                lote.append(pedido)
+            inicio = time.perf_counter()
+            if lote[0].funcao is None:
+                self._gravar(lote)
+            else:
+                self._gravar_grupo(lote[0])
+            with self._lock:
+                self._duracao_media = 0.8 * self._duracao_media + 0.2 * (time.perf_counter() - inicio)
+                self.lotes += 1
+                self.escritas += len(lote)
+                self.maior_lote = max(self.maior_lote, len(lote))
+
+    def _gravar(self, lote):
+        try:
+            resultados = self._executar([pedido.operacao for pedido in lote])
+            for pedido, resultado in zip(lote, resultados):
+                pedido.resultado = resultado
+        except Exception as erro:
+            if len(lote) == 1 or isinstance(erro, self.sem_repetir):
+                for pedido in lote:
+                    pedido.erro = erro
+            else:
+                logger.warning('Lote de %d escritas falhou (%s); gravando uma a uma', len(lote), erro)
+                for pedido in lote:
+                    try:
+                        pedido.resultado = self._executar([pedido.operacao])[0]
+                    except Exception as erro_pedido:
+                        pedido.erro = erro_pedido
+        finally:
+            for pedido in lote:
+                pedido.pronto.set()
+
+    def _gravar_grupo(self, pedido):
+        try:
+            pedido.resultado = pedido.funcao()
+        except Exception as erro:
+            pedido.erro = erro
+        finally:
+            pedido.pronto.set()
+
+    def estatisticas(self):
+        """Retorna contadores da fila."""
+        with self._lock:
+            return {
+                'pendentes': self._fila.qsize(),
+                'lotes': self.lotes,
+                'escritas': self.escritas,
+                'rejeitadas': self.rejeitadas,
+                'maior_lote': self.maior_lote
+            }
@@ -1,13 +1,57 @@
 CREATE TABLE IF NOT EXISTS imoveis (
     id INTEGER PRIMARY KEY AUTO_INCREMENT,
-    logradouro TEXT NOT NULL,
-    tipo_logradouro TEXT,
-    bairro TEXT,
-    cidade TEXT NOT NULL,
-    cep TEXT,
-    tipo TEXT,
+    logradouro VARCHAR(255) NOT NULL,
+    tipo_logradouro VARCHAR(50),
+    bairro VARCHAR(100),
+    cidade VARCHAR(100) NOT NULL,
+    cep VARCHAR(9),
+    tipo VARCHAR(50),
     valor REAL,
-    data_aquisicao TEXT
+    data_aquisicao VARCHAR(10),
+    -- Versão do imóvel, incrementada a cada alteração (If-Match do PATCH; ver migracoes/005_versao_imovel.sql)
+    versao INT UNSIGNED NOT NULL DEFAULT 1,
+    -- CEP só com dígitos (8), calculado do cep; coordenadas opcionais e o ponto do índice espacial
+    -- (linhas sem coordenadas ficam no ponto 0,0; ver migracoes/004_cep_e_coordenadas.sql)
+    cep_num INT UNSIGNED AS (
+        CASE CHAR_LENGTH(REGEXP_REPLACE(cep, '[^0-9]', ''))
+            WHEN 8 THEN CAST(REGEXP_REPLACE(cep, '[^0-9]', '') AS UNSIGNED)
+            WHEN 5 THEN CAST(REGEXP_REPLACE(cep, '[^0-9]', '') AS UNSIGNED) * 1000
+        END) STORED,
+    latitude DOUBLE NULL,
+    longitude DOUBLE NULL,
+    localizacao POINT SRID 4326 AS (
+        ST_SRID(POINT(COALESCE(longitude, 0), COALESCE(latitude, 0)), 4326)) STORED NOT NULL,
+    -- Índices dos filtros e do sort= da listagem (cidade/tipo/valor cobre o caso mais comum)
+    INDEX idx_cidade_tipo_valor (cidade, tipo, valor),
+    INDEX idx_tipo_valor (tipo, valor),
+    INDEX idx_valor (valor),
+    INDEX idx_data_aquisicao (data_aquisicao),
+    INDEX idx_bairro (bairro),
+    INDEX idx_cep (cep),
+    INDEX idx_tipo_logradouro (tipo_logradouro),
+    INDEX idx_cep_num (cep_num),
+    SPATIAL INDEX idx_localizacao (localizacao),
+    -- Busca textual de /imoveis/search
+    FULLTEXT INDEX ft_endereco (logradouro, bairro, cidade)
+);
+
+-- Contador de alterações da tabela imoveis, incrementado pelas escritas do utils.py
+-- na mesma transação. É a base dos ETags/Last-Modified das rotas GET.
+CREATE TABLE IF NOT EXISTS imoveis_controle (
+    id INTEGER PRIMARY KEY,
+    versao BIGINT NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+);
+
+INSERT IGNORE INTO imoveis_controle (id, versao) VALUES (1, 0);
+
+-- Log de alterações (GET /imoveis/changes); seq segue a ordem dos commits
+CREATE TABLE IF NOT EXISTS imoveis_alteracoes (
+    seq BIGINT PRIMARY KEY AUTO_INCREMENT,
+    imovel_id INTEGER NOT NULL,
+    operacao VARCHAR(10) NOT NULL,
+    criado_em TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    INDEX idx_alteracoes_imovel (imovel_id)
 );
 
 -- ALGUMAS OBSERVAÇÕES SOBRE A CRIAÇÃO
@@ -0,0 +1,490 @@
+import bisect
+import functools
+import heapq
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from cache import AUSENTE
+
+# Instantâneo colunar da tabela imoveis para as rotas de listagem (IMOVEIS_INSTANTANEO=1).
+# Em vez de uma lista de dicionários (um por linha, com 9 chaves), cada coluna é
+# um array: id, valor e data como números, textos repetidos (cidade, tipo,
+# bairro, tipo_logradouro, cep) como códigos de um dicionário e o logradouro
+# como um único buffer UTF-8. cidade, tipo e bairro têm índice invertido
+# (código -> posições) e o valor, um índice ordenado; os dicionários só são
+# montados para as linhas da página devolvida. Os índices só escolhem as
+# posições candidatas: a verificação dos filtros em cada uma é um laço em
+# Python, então os filtros sem índice (cep, tipo_logradouro, datas) percorrem
+# o intervalo de ids linha a linha, até completar a página.
+
+logger = logging.getLogger('imoveis.instantaneo')
+
+COLUNAS = ('id', 'logradouro', 'tipo_logradouro', 'bairro', 'cidade', 'cep', 'tipo', 'valor', 'data_aquisicao')
+CODIFICADAS = ('tipo_logradouro', 'bairro', 'cidade', 'cep', 'tipo')
+INDEXADAS = ('cidade', 'tipo', 'bairro')
+FAIXAS = ('valor_min', 'valor_max', 'data_aquisicao_min', 'data_aquisicao_max')
+
+# Datas AAAA-MM-DD viram o inteiro AAAAMMDD; NULL e textos em outro formato ficam com SEM_DATA
+SEM_DATA = -1
+_DATA_ISO = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def chave_texto(texto):
+    """Forma de comparação de um texto sem maiúsculas nem acentos, como a collation padrão do MySQL 8 (utf8mb4_0900_ai_ci)"""
+    decomposto = unicodedata.normalize('NFKD', str(texto).casefold())
+    return ''.join(caractere for caractere in decomposto if not unicodedata.combining(caractere))
+
+
+def _data_int(texto):
+    if texto is None or not _DATA_ISO.fullmatch(texto):
+        return SEM_DATA
+    return int(texto[:4] + texto[5:7] + texto[8:])
+
+
+@functools.lru_cache(maxsize=65536)
+def _data_iso(numero):
+    return f'{numero // 10000:04d}-{numero // 100 % 100:02d}-{numero % 100:02d}'
+
+
+def _fatia(posicoes, primeiro, final, para_tras):
+    """Posições posicoes[primeiro:final] sem copiar o array, do fim para o início se para_tras"""
+    indices = range(final - 1, primeiro - 1, -1) if para_tras else range(primeiro, final)
+    return map(posicoes.__getitem__, indices)
+
+
+def _bytes_array(valores):
+    return valores.itemsize * len(valores)
+
+
+class _Dicionario:
+    """Coluna de texto codificada por dicionário: um código (array 'I') por linha; 0 é NULL"""
+
+    def __init__(self):
+        self.valores = [None]
+        self._codigos = {None: 0}
+        self._por_chave = {}  # chave_texto -> códigos dos valores com essa forma de comparação
+        self.codigos = array('I')
+
+    def codificar(self, valor):
+        codigo = self._codigos.get(valor)
+        if codigo is None:
+            codigo = self._codigos[valor] = len(self.valores)
+            self.valores.append(valor)
+            self._por_chave.setdefault(chave_texto(valor), []).append(codigo)
+        return codigo
+
+    def codigos_iguais(self, valores):
+        """Códigos iguais a algum dos valores pela comparação do MySQL (sem caixa e acentos)"""
+        codigos = set()
+        for valor in valores:
+            codigos.update(self._por_chave.get(chave_texto(valor), ()))
+        return codigos
+
+    def memoria(self):
+        return _bytes_array(self.codigos) + sum(sys.getsizeof(valor) for valor in self.valores)
+
+
+class Instantaneo:
+    """Cópia colunar da tabela imoveis em uma versão, com consultas da listagem.
+
+    As linhas ficam na ordem do id; a posição de uma linha nunca muda. Linhas
+    removidas viram lápides (vivas[posição] = 0) até a próxima recarga, e um
+    logradouro alterado é acrescentado ao fim do buffer de texto. Cada linha
+    guarda a sua versão (coluna versao da tabela), para que uma alteração
+    aplicada fora da ordem dos commits não sobrescreva uma mais nova.
+    """
+
+    def __init__(self, versao=0):
+        self.versao = versao
+        self.ids = array('q')
+        self.valores = array('d')  # NULL é NaN, que não passa em nenhuma comparação
+        self.datas = array('i')
+        self.versoes = array('I')
+        self._datas_texto = {}  # posição -> data_aquisicao fora do formato AAAA-MM-DD
+        self._texto = bytearray()
+        self._texto_inicio = array('Q')
+        self._texto_tamanho = array('I')
+        self.vivas = bytearray()
+        self.total = 0
+        self.dicionarios = {coluna: _Dicionario() for coluna in CODIFICADAS}
+        self.indices = {coluna: {} for coluna in INDEXADAS}  # código -> array('I') de posições, crescente
+        self._por_valor = array('I')  # posições ordenadas por (valor, posição), sem os valores NULL
+        self._leitores = {
+            'id': self.ids.__getitem__,
+            'logradouro': self._logradouro,
+            'valor': self._valor,
+            'data_aquisicao': self._data,
+        }
+        for coluna, dicionario in self.dicionarios.items():
+            self._leitores[coluna] = lambda posicao, dicionario=dicionario: dicionario.valores[dicionario.codigos[posicao]]
+
+    # Carga e escrita
+
+    def adicionar(self, linhas):
+        """Acrescenta linhas (tuplas na ordem de COLUNAS, id crescente) sem atualizar os índices.
+
+        Uma coluna a mais ao fim da tupla é a versão da linha (1 se ausente).
+        """
+        for linha in linhas:
+            imovel_id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data = linha[:len(COLUNAS)]
+            if self.ids and imovel_id <= self.ids[-1]:
+                raise ValueError(f'id fora de ordem no instantâneo: {imovel_id}')
+            posicao = len(self.ids)
+            self.ids.append(imovel_id)
+            self._gravar_texto(logradouro)
+            for coluna, texto in zip(CODIFICADAS, (tipo_logradouro, bairro, cidade, cep, tipo)):
+                dicionario = self.dicionarios[coluna]
+                dicionario.codigos.append(dicionario.codificar(texto))
+            self.valores.append(math.nan if valor is None else float(valor))
+            self.datas.append(_data_int(data))
+            if data is not None and self.datas[posicao] == SEM_DATA:
+                self._datas_texto[posicao] = data
+            self.versoes.append(linha[len(COLUNAS)] if len(linha) > len(COLUNAS) else 1)
+            self.vivas.append(1)
+            self.total += 1
+
+    def indexar(self):
+        """(Re)cria os índices invertidos e o índice de valor a partir das colunas"""
+        for coluna in INDEXADAS:
+            indice = {}
+            codigos = self.dicionarios[coluna].codigos
+            for posicao, viva in enumerate(self.vivas):
+                if viva:
+                    posicoes = indice.get(codigos[posicao])
+                    if posicoes is None:
+                        posicoes = indice[codigos[posicao]] = array('I')
+                    posicoes.append(posicao)
+            self.indices[coluna] = indice
+        valores = self.valores
+        self._por_valor = array('I', sorted(
+            (posicao for posicao, viva in enumerate(self.vivas) if viva and not math.isnan(valores[posicao])),
+            key=lambda posicao: (valores[posicao], posicao)))
+
+    def inserir(self, itens):
+        """Inclui (id, dados) de imóveis recém-criados, mantendo os índices"""
+        for imovel_id, dados in itens:
+            posicao = len(self.ids)
+            self.adicionar([(imovel_id,) + tuple(dados.get(coluna) for coluna in COLUNAS[1:]) + (dados.get('versao', 1),)])
+            self._indexar_linha(posicao)
+
+    def atualizar(self, itens):
+        """Aplica {id: linha gravada}, com as colunas de COLUNAS e a versao da linha.
+
+        Uma linha em versão igual ou anterior à do instantâneo é ignorada (a
+        escrita mais nova já foi aplicada), assim como ids removidos. Um id
+        acima do último indica uma inclusão ainda não aplicada: KeyError.
+        """
+        for imovel_id, dados in itens.items():
+            if not self.ids or imovel_id > self.ids[-1]:
+                raise KeyError(imovel_id)
+            posicao = self._posicao(imovel_id)
+            if posicao is None or dados['versao'] <= self.versoes[posicao]:
+                continue
+            self._desindexar_linha(posicao)
+            self.versoes[posicao] = dados['versao']
+            if 'logradouro' in dados:
+                self._gravar_texto(dados['logradouro'], posicao)
+            for coluna in CODIFICADAS:
+                if coluna in dados:
+                    dicionario = self.dicionarios[coluna]
+                    dicionario.codigos[posicao] = dicionario.codificar(dados[coluna])
+            if 'valor' in dados:
+                self.valores[posicao] = math.nan if dados['valor'] is None else float(dados['valor'])
+            if 'data_aquisicao' in dados:
+                data = dados['data_aquisicao']
+                self.datas[posicao] = _data_int(data)
+                self._datas_texto.pop(posicao, None)
+                if data is not None and self.datas[posicao] == SEM_DATA:
+                    self._datas_texto[posicao] = data
+            self._indexar_linha(posicao)
+
+    def remover(self, ids):
+        for imovel_id in ids:
+            posicao = self._posicao(imovel_id)
+            if posicao is not None:
+                self._desindexar_linha(posicao)
+                self.vivas[posicao] = 0
+                self.total -= 1
+
+    def _posicao(self, imovel_id):
+        posicao = bisect.bisect_left(self.ids, imovel_id)
+        if posicao < len(self.ids) and self.ids[posicao] == imovel_id and self.vivas[posicao]:
+            return posicao
+        return None
+
+    def _gravar_texto(self, texto, posicao=None):
+        dados = texto.encode('utf-8')
+        inicio = len(self._texto)
+        self._texto += dados
+        if posicao is None:
+            self._texto_inicio.append(inicio)
+            self._texto_tamanho.append(len(dados))
+        else:
+            self._texto_inicio[posicao] = inicio
+            self._texto_tamanho[posicao] = len(dados)
+
+    def _chave_valor(self, posicao):
+        return (self.valores[posicao], posicao)
+
+    def _indexar_linha(self, posicao):
+        for coluna in INDEXADAS:
+            posicoes = self.indices[coluna].setdefault(self.dicionarios[coluna].codigos[posicao], array('I'))
+            posicoes.insert(bisect.bisect_left(posicoes, posicao), posicao)
+        if not math.isnan(self.valores[posicao]):
+            indice = bisect.bisect_left(self._por_valor, self._chave_valor(posicao), key=self._chave_valor)
+            self._por_valor.insert(indice, posicao)
+
+    def _desindexar_linha(self, posicao):
+        for coluna in INDEXADAS:
+            posicoes = self.indices[coluna].get(self.dicionarios[coluna].codigos[posicao])
+            indice = bisect.bisect_left(posicoes, posicao)
+            del posicoes[indice]
+        if not math.isnan(self.valores[posicao]):
+            indice = bisect.bisect_left(self._por_valor, self._chave_valor(posicao), key=self._chave_valor)
+            del self._por_valor[indice]
+
+    # Leitura
+
+    def _logradouro(self, posicao):
+        inicio = self._texto_inicio[posicao]
+        return self._texto[inicio:inicio + self._texto_tamanho[posicao]].decode('utf-8')
+
+    def _valor(self, posicao):
+        valor = self.valores[posicao]
+        return None if valor != valor else valor
+
+    def _data(self, posicao):
+        numero = self.datas[posicao]
+        return self._datas_texto.get(posicao) if numero == SEM_DATA else _data_iso(numero)
+
+    def consultar(self, filtros, limite=None, apos_id=None, antes_id=None, colunas=COLUNAS):
+        """Imóveis (dicionários com colunas) que atendem os filtros, em ordem de id.
+
+        filtros está na forma de utils.normaliza_filtros e só usa CODIFICADAS e
+        FAIXAS. Como na listagem do banco, apos_id/antes_id com limite devolvem
+        a página seguinte/anterior ao cursor.
+        """
+        para_tras = antes_id is not None
+        inicio = bisect.bisect_right(self.ids, apos_id) if apos_id is not None and not para_tras else 0
+        fim = bisect.bisect_left(self.ids, antes_id) if para_tras else len(self.ids)
+
+        # Igualdades: códigos aceitos em cada coluna; as indexadas podem guiar a varredura
+        igualdades = []
+        guias = []
+        for coluna in CODIFICADAS:
+            valores = filtros.get(coluna)
+            if not valores:
+                continue
+            codigos = self.dicionarios[coluna].codigos_iguais(valores)
+            if not codigos:
+                return []
+            igualdades.append((self.dicionarios[coluna].codigos, codigos))
+            if coluna in self.indices:
+                listas = [self.indices[coluna][codigo] for codigo in codigos if codigo in self.indices[coluna]]
+                fatias = [(lista, bisect.bisect_left(lista, inicio), bisect.bisect_left(lista, fim)) for lista in listas]
+                guias.append((sum(final - primeiro for _, primeiro, final in fatias), fatias))
+
+        valor_min = filtros.get('valor_min', -math.inf)
+        valor_max = filtros.get('valor_max', math.inf)
+        tem_valor = 'valor_min' in filtros or 'valor_max' in filtros
+        data_min, data_max = filtros.get('data_aquisicao_min'), filtros.get('data_aquisicao_max')
+        tem_data = data_min is not None or data_max is not None
+        data_min_int = _data_int(data_min) if data_min is not None else -math.inf
+        data_max_int = _data_int(data_max) if data_max is not None else math.inf
+
+        # Guia da varredura: a menor lista de candidatos entre os índices e o intervalo [inicio, fim)
+        candidatos = None
+        estimativa = fim - inicio
+        if guias:
+            estimativa, fatias = min(guias, key=lambda guia: guia[0])
+            iteradores = [_fatia(lista, primeiro, final, para_tras) for lista, primeiro, final in fatias]
+            candidatos = iteradores[0] if len(iteradores) == 1 else heapq.merge(*iteradores, reverse=para_tras)
+        if tem_valor:
+            primeiro = bisect.bisect_left(self._por_valor, (valor_min, -1), key=self._chave_valor)
+            final = bisect.bisect_right(self._por_valor, (valor_max, math.inf), key=self._chave_valor)
+            # Ordenar as posições da faixa só compensa se ela for bem menor que a varredura
+            if (final - primeiro) * 4 < estimativa:
+                posicoes = sorted(posicao for posicao in self._por_valor[primeiro:final] if inicio <= posicao < fim)
+                candidatos = reversed(posicoes) if para_tras else posicoes
+        if candidatos is None:
+            candidatos = range(fim - 1, inicio - 1, -1) if para_tras else range(inicio, fim)
+
+        vivas, valores, datas = self.vivas, self.valores, self.datas
+        encontradas = []
+        for posicao in candidatos:
+            if not vivas[posicao]:
+                continue
+            if igualdades and not all(codigos[posicao] in aceitos for codigos, aceitos in igualdades):
+                continue
+            if tem_valor and not valor_min <= valores[posicao] <= valor_max:
+                continue
+            if tem_data:
+                numero = datas[posicao]
+                if numero == SEM_DATA:
+                    texto = self._datas_texto.get(posicao)
+                    if texto is None or (data_min is not None and texto < data_min) or (data_max is not None and texto > data_max):
+                        continue
+                elif not data_min_int <= numero <= data_max_int:
+                    continue
+            encontradas.append(posicao)
+            if limite is not None and len(encontradas) >= limite:
+                break
+        if para_tras:
+            encontradas.reverse()
+        leitores = [(coluna, self._leitores[coluna]) for coluna in colunas]
+        return [{coluna: ler(posicao) for coluna, ler in leitores} for posicao in encontradas]
+
+    def memoria(self):
+        """Bytes ocupados pelas colunas, dicionários e índices (estimativa)"""
+        total = sum(_bytes_array(coluna) for coluna in (self.ids, self.valores, self.datas, self.versoes,
+                                                         self._texto_inicio, self._texto_tamanho, self._por_valor))
+        total += len(self._texto) + len(self.vivas)
+        total += sum(dicionario.memoria() for dicionario in self.dicionarios.values())
+        total += sum(_bytes_array(posicoes) for indice in self.indices.values() for posicoes in indice.values())
+        return total
+
+
+def suporta(filtros, colunas, ordem=None, chave_cursor=None):
+    """Indica se a consulta da listagem pode ser respondida pelo instantâneo (senão vai ao banco)"""
+    return (ordem in (None, ('id', False)) and chave_cursor is None
+            and all(chave in CODIFICADAS or chave in FAIXAS for chave in filtros)
+            and all(coluna in COLUNAS for coluna in colunas))
+
+
+class GerenciadorInstantaneo:
+    """Mantém o instantâneo atual, aplica as escritas do processo e recarrega quando preciso.
+
+    carregar(instantaneo) preenche um Instantaneo vazio (versão e linhas lidas
+    na mesma transação) e ler_versao() devolve a versão atual da tabela. O
+    instantâneo só responde enquanto reflete a maior versão já vista pelo
+    processo (get_versao_tabela chama observar_versao a cada leitura e, sem
+    leituras há mais de `intervalo` segundos, a consulta lê a versão). Se
+    outro processo alterou a tabela, a recarga roda em uma thread e, até ela
+    terminar, consultar devolve AUSENTE e a listagem vai ao banco.
+    """
+
+    def __init__(self, carregar, ler_versao, ativo=False, intervalo=1.0, espera_falha=30.0):
+        self._carregar = carregar
+        self._ler_versao = ler_versao
+        self.ativo = ativo
+        self.intervalo = intervalo
+        self.espera_falha = espera_falha
+        self._atual = None
+        self._reiniciar()
+        if hasattr(os, 'register_at_fork'):
+            # O instantâneo herdado continua válido no filho (cópia sob demanda das páginas)
+            os.register_at_fork(after_in_child=self._reiniciar)
+
+    def _reiniciar(self):
+        self._lock = threading.Lock()
+        self._carregando = False
+        self._proxima_tentativa = 0.0
+        self._versao_vista = -1
+        self._vista_em = -math.inf
+        self.recargas = 0
+        self.respondidas = 0
+        self.recusadas = 0
+
+    def observar_versao(self, versao):
+        if not self.ativo:
+            return
+        with self._lock:
+            self._versao_vista = max(self._versao_vista, versao)
+            self._vista_em = time.monotonic()
+
+    def precisa_versao(self):
+        """Indica se a versão da tabela não é lida há mais de `intervalo` segundos"""
+        return self.ativo and time.monotonic() - self._vista_em > self.intervalo
+
+    def consultar(self, filtros, limite=None, apos_id=None, antes_id=None, colunas=COLUNAS, ordem=None, chave_cursor=None):
+        """Imóveis da listagem (None se não houver nenhum) ou AUSENTE se a consulta deve ir ao banco"""
+        if not self.ativo or not suporta(filtros, colunas, ordem, chave_cursor):
+            return AUSENTE
+        if self.precisa_versao():
+            self.observar_versao(self._ler_versao())
+        with self._lock:
+            atual = self._atual
+            if atual is None or atual.versao < self._versao_vista:
+                self._agendar_recarga()
+                self.recusadas += 1
+                return AUSENTE
+            imoveis = atual.consultar(filtros, limite, apos_id, antes_id, colunas)
+            self.respondidas += 1
+        return imoveis or None
+
+    def registrar(self, inseridos=(), atualizados=None, removidos=()):
+        """Aplica uma escrita já confirmada no banco, que incrementou a versão da tabela em 1.
+
+        inseridos são pares (id, dados), atualizados é {id: linha gravada, com
+        a versao} e removidos, ids. As threads podem chamar registrar fora da
+        ordem dos commits: cada linha alterada só é trocada por uma de versão
+        maior. Se a escrita não puder ser aplicada (ex.: id menor que o último),
+        o instantâneo é descartado e recarregado.
+        """
+        if not self.ativo:
+            return
+        with self._lock:
+            atual = self._atual
+            if atual is None:
+                return
+            try:
+                atual.inserir(inseridos)
+                atual.atualizar(atualizados or {})
+                atual.remover(removidos)
+                atual.versao += 1
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.exception('Escrita não aplicada ao instantâneo; ele será recarregado')
+                self._atual = None
+
+    def recarregar(self):
+        """Lê a tabela inteira em um novo instantâneo e passa a usá-lo (bloqueia até o fim da leitura)"""
+        inicio = time.perf_counter()
+        novo = Instantaneo()
+        self._carregar(novo)
+        novo.indexar()
+        with self._lock:
+            if self._atual is None or novo.versao >= self._atual.versao:
+                self._atual = novo
+            self.recargas += 1
+        logger.info('Instantâneo carregado: %d imóveis, versão %d, %.1f MB em %.1f s', novo.total, novo.versao,
+                    novo.memoria() / 1e6, time.perf_counter() - inicio)
+        return novo
+
+    def _agendar_recarga(self):
+        """Inicia a recarga em segundo plano, se não houver uma em andamento (chamado com o lock)"""
+        if self._carregando or time.monotonic() < self._proxima_tentativa:
+            return
+        self._carregando = True
+        threading.Thread(target=self._recarregar_em_segundo_plano, name='instantaneo-imoveis', daemon=True).start()
+
+    def _recarregar_em_segundo_plano(self):
+        try:
+            self.recarregar()
+        except Exception:
+            logger.exception('Falha ao carregar o instantâneo; nova tentativa em %.0f s', self.espera_falha)
+            with self._lock:
+                self._proxima_tentativa = time.monotonic() + self.espera_falha
+        finally:
+            with self._lock:
+                self._carregando = False
+
+    def estatisticas(self):
+        """Retorna contadores do instantâneo."""
+        with self._lock:
+            atual = self._atual
+            memoria = atual.memoria() if atual else 0
+            return {
+                'linhas': atual.total if atual else 0,
+                'bytes': memoria,
+                'bytes_por_linha': memoria // atual.total if atual and atual.total else 0,
+                'versao': atual.versao if atual else -1,
+                'recargas': self.recargas,
+                'respondidas': self.respondidas,
+                'recusadas': self.recusadas
+            }
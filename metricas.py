@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Instrumentação das requisições: tempo por fase (conexão, consulta, fetch,
+# mapeamento, HATEOAS, JSON), contagem de conexões e consultas, cabeçalho
+# Server-Timing, métricas no formato texto do Prometheus (GET /metrics) e log
+# das consultas lentas. IMOVEIS_METRICAS=0 desliga.
+
+ATIVO = os.getenv('IMOVEIS_METRICAS', '1') != '0'
+CONSULTA_LENTA = float(os.getenv('IMOVEIS_CONSULTA_LENTA_MS', 200)) / 1000
+
+# Limites (s) dos buckets dos histogramas de duração
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+logger = logging.getLogger('imoveis.consultas')
+
+# Estado da requisição em andamento (vale para threads e para tarefas asyncio)
+_requisicao = ContextVar('requisicao', default=None)
+
+
+class _Histograma:
+    __slots__ = ('contagens', 'soma', 'total')
+
+    def __init__(self):
+        self.contagens = [0] * len(BUCKETS)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for indice, limite in enumerate(BUCKETS):
+            if valor <= limite:
+                self.contagens[indice] += 1
+                break
+        self.soma += valor
+        self.total += 1
+
+
+class Registro:
+    """Contadores e histogramas acumulados pelo processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.limpar()
+
+    def limpar(self):
+        with self._lock:
+            self.contadores = {}   # (nome, rótulos) -> valor
+            self.histogramas = {}  # (nome, rótulos) -> _Histograma
+
+    def incrementar(self, nome, rotulos=(), valor=1):
+        with self._lock:
+            chave = (nome, rotulos)
+            self.contadores[chave] = self.contadores.get(chave, 0) + valor
+
+    def observar(self, nome, rotulos, valor):
+        with self._lock:
+            chave = (nome, rotulos)
+            histograma = self.histogramas.get(chave)
+            if histograma is None:
+                histograma = self.histogramas[chave] = _Histograma()
+            histograma.observar(valor)
+
+
+registro = Registro()
+
+DESCRICOES = {
+    'imoveis_requisicoes_total': ('counter', 'Requisições atendidas por rota, método e status'),
+    'imoveis_requisicao_segundos': ('histogram', 'Duração das requisições'),
+    'imoveis_fase_segundos': ('histogram', 'Tempo gasto em cada fase das requisições'),
+    'imoveis_conexoes_abertas_total': ('counter', 'Conexões abertas com o banco (handshakes)'),
+    'imoveis_consultas_total': ('counter', 'Comandos SQL executados'),
+    'imoveis_sentencas_preparadas_total': ('counter', 'Prepared statements criados (um por texto SQL e conexão)'),
+    'imoveis_consultas_lentas_total': ('counter', 'Comandos SQL acima de IMOVEIS_CONSULTA_LENTA_MS'),
+}
+
+
+def registrar_fase(nome, segundos):
+    """Soma a duração à fase na requisição atual e no histograma do processo"""
+    estado = _requisicao.get()
+    if estado is not None:
+        fases = estado['fases']
+        fases[nome] = fases.get(nome, 0.0) + segundos
+    registro.observar('imoveis_fase_segundos', (('fase', nome),), segundos)
+
+
+@contextmanager
+def fase(nome):
+    """Mede o bloco como uma fase da requisição (ex.: with fase('mapeamento'): ...)"""
+    if not ATIVO:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_fase(nome, time.perf_counter() - inicio)
+
+
+# Eventos contados por requisição e o contador do processo correspondente
+_CONTADORES = {'conexoes': 'imoveis_conexoes_abertas_total', 'consultas': 'imoveis_consultas_total',
+               'preparacoes': 'imoveis_sentencas_preparadas_total'}
+
+
+def contar(evento):
+    """Conta um evento ('conexoes', 'consultas' ou 'preparacoes') na requisição atual e no processo"""
+    if not ATIVO:
+        return
+    estado = _requisicao.get()
+    if estado is not None:
+        estado[evento] += 1
+    registro.incrementar(_CONTADORES[evento])
+
+
+def consulta_executada(sql, params, segundos):
+    """Registra um comando SQL e loga os que passaram do limite de consulta lenta"""
+    if not ATIVO:
+        return
+    contar('consultas')
+    registrar_fase('consulta', segundos)
+    if segundos >= CONSULTA_LENTA:
+        registro.incrementar('imoveis_consultas_lentas_total')
+        logger.warning('Consulta lenta (%.1f ms): %s params=%r', segundos * 1000, sql, params)
+
+
+def iniciar_requisicao():
+    """Abre o estado de medição de uma requisição; devolve o token para finalizar_requisicao"""
+    if not ATIVO:
+        return None
+    return _requisicao.set({'inicio': time.perf_counter(), 'fases': {}, 'conexoes': 0, 'consultas': 0,
+                             'preparacoes': 0})
+
+
+def finalizar_requisicao(token, rota, metodo, status):
+    """Fecha a medição da requisição e devolve o valor do cabeçalho Server-Timing"""
+    if token is None:
+        return None
+    estado = _requisicao.get()
+    _requisicao.reset(token)
+    total = time.perf_counter() - estado['inicio']
+    rota = rota or 'desconhecida'
+    registro.incrementar('imoveis_requisicoes_total', (('metodo', metodo), ('rota', rota), ('status', str(status))))
+    registro.observar('imoveis_requisicao_segundos', (('metodo', metodo), ('rota', rota)), total)
+
+    partes = [f'{nome};dur={segundos * 1000:.2f}' for nome, segundos in estado['fases'].items()]
+    partes.append(f'db;desc="conexoes={estado["conexoes"]} consultas={estado["consultas"]}"')
+    partes.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(partes)
+
+
+class CursorMedido:
+    """Cursor que mede execute (consulta) e fetch*; o restante vai direto ao cursor original"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def execute(self, sql, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(sql, *args, **kwargs)
+        finally:
+            consulta_executada(sql, args[0] if args else kwargs.get('params'), time.perf_counter() - inicio)
+
+    def fetchone(self):
+        with fase('fetch'):
+            return self._cursor.fetchone()
+
+    def fetchall(self):
+        with fase('fetch'):
+            return self._cursor.fetchall()
+
+    def fetchmany(self, tamanho):
+        with fase('fetch'):
+            return self._cursor.fetchmany(tamanho)
+
+
+class ConexaoMedida:
+    """Conexão cujos cursores são medidos (CursorMedido)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def cursor(self, *args, **kwargs):
+        return CursorMedido(self._conn.cursor(*args, **kwargs))
+
+
+def _rotulos(rotulos, extra=()):
+    pares = tuple(rotulos) + tuple(extra)
+    if not pares:
+        return ''
+    texto = ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares)
+    return '{' + texto + '}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exportar(medidores=None):
+    """Métricas no formato texto do Prometheus.
+
+    medidores é um dicionário opcional nome -> (descrição, valor) com valores
+    instantâneos (gauges), como o estado do pool e do cache.
+    """
+    with registro._lock:
+        contadores = dict(registro.contadores)
+        histogramas = {chave: (list(h.contagens), h.soma, h.total) for chave, h in registro.histogramas.items()}
+
+    linhas = []
+    nomes = sorted({nome for nome, _ in contadores} | {nome for nome, _ in histogramas})
+    for nome in nomes:
+        tipo, descricao = DESCRICOES.get(nome, ('untyped', nome))
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for (nome_contador, rotulos), valor in sorted(contadores.items()):
+            if nome_contador == nome:
+                linhas.append(f'{nome}{_rotulos(rotulos)} {valor}')
+        for (nome_histograma, rotulos), (contagens, soma, total) in sorted(histogramas.items()):
+            if nome_histograma != nome:
+                continue
+            acumulado = 0
+            for limite, contagem in zip(BUCKETS, contagens):
+                acumulado += contagem
+                linhas.append(f'{nome}_bucket{_rotulos(rotulos, (("le", limite),))} {acumulado}')
+            linhas.append(f'{nome}_bucket{_rotulos(rotulos, (("le", "+Inf"),))} {total}')
+            linhas.append(f'{nome}_sum{_rotulos(rotulos)} {soma:.6f}')
+            linhas.append(f'{nome}_count{_rotulos(rotulos)} {total}')
+    for nome, (descricao, valor) in sorted((medidores or {}).items()):
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} gauge')
+        linhas.append(f'{nome} {valor}')
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,12 @@
+-- Migração 001: contador de alterações da tabela imoveis (ETag / Last-Modified)
+-- Pode ser executada em bancos criados com a versão anterior do imoveis.sql.
+
+CREATE TABLE IF NOT EXISTS imoveis_controle (
+    id INTEGER PRIMARY KEY,
+    versao BIGINT NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+);
+
+INSERT IGNORE INTO imoveis_controle (id, versao) VALUES (1, 0);
+
+COMMIT;
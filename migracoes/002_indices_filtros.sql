@@ -0,0 +1,25 @@
+-- Migração 002: colunas de texto filtráveis passam de TEXT para VARCHAR e ganham índices
+-- Colunas TEXT só aceitam índice por prefixo; com VARCHAR os filtros, faixas e sort= da
+-- listagem (ver monta_consulta_imoveis no utils.py) deixam de varrer a tabela inteira.
+-- data_aquisicao continua texto ISO (AAAA-MM-DD): a ordem alfabética é a cronológica e
+-- a API segue devolvendo a data no mesmo formato.
+
+ALTER TABLE imoveis
+    MODIFY logradouro VARCHAR(255) NOT NULL,
+    MODIFY tipo_logradouro VARCHAR(50),
+    MODIFY bairro VARCHAR(100),
+    MODIFY cidade VARCHAR(100) NOT NULL,
+    MODIFY cep VARCHAR(9),
+    MODIFY tipo VARCHAR(50),
+    MODIFY data_aquisicao VARCHAR(10);
+
+ALTER TABLE imoveis
+    ADD INDEX idx_cidade_tipo_valor (cidade, tipo, valor),
+    ADD INDEX idx_tipo_valor (tipo, valor),
+    ADD INDEX idx_valor (valor),
+    ADD INDEX idx_data_aquisicao (data_aquisicao),
+    ADD INDEX idx_bairro (bairro),
+    ADD INDEX idx_cep (cep),
+    ADD INDEX idx_tipo_logradouro (tipo_logradouro);
+
+COMMIT;
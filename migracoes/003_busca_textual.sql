@@ -0,0 +1,10 @@
+-- Migração 003: índice FULLTEXT dos campos de endereço, usado por GET /imoveis/search
+-- A busca usa MATCH ... AGAINST em modo booleano com cada palavra como prefixo
+-- (ver termos_busca no utils.py), o que atende ao autocompletar sem varrer a tabela.
+-- Palavras com menos de innodb_ft_min_token_size letras (padrão 3) não entram no
+-- índice; para encontrar siglas de 2 letras, ajuste a variável para 2 e recrie o índice.
+
+ALTER TABLE imoveis
+    ADD FULLTEXT INDEX ft_endereco (logradouro, bairro, cidade);
+
+COMMIT;
@@ -0,0 +1,30 @@
+-- Migração 004: CEP numérico indexado e coordenadas com índice espacial
+-- cep_num é calculado pelo próprio MySQL a partir do cep (só os dígitos; CEPs antigos de
+-- 5 dígitos são completados com 000), então as linhas existentes são preenchidas no ALTER
+-- e as escritas da API não precisam mudar. Os filtros cep_min/cep_max/cep_prefix da
+-- listagem comparam cep_num (ver normaliza_cep no utils.py).
+--
+-- latitude/longitude são opcionais. localizacao é o ponto correspondente no SRID 4326, com
+-- índice espacial para o filtro near=. POINT(x, y) com SRID geográfico lê x como longitude
+-- e y como latitude; o WKT das consultas (ST_GeomFromText) segue a ordem do EPSG, latitude
+-- longitude. Índices espaciais exigem coluna NOT NULL: linhas sem coordenadas ficam com o
+-- ponto (0, 0) e são descartadas pela condição latitude IS NOT NULL. Para preencher as coordenadas a partir
+-- de uma tabela CEP -> coordenadas, use migracoes/preencher_coordenadas.py.
+-- Requer MySQL 8.0.
+
+ALTER TABLE imoveis
+    ADD COLUMN cep_num INT UNSIGNED AS (
+        CASE CHAR_LENGTH(REGEXP_REPLACE(cep, '[^0-9]', ''))
+            WHEN 8 THEN CAST(REGEXP_REPLACE(cep, '[^0-9]', '') AS UNSIGNED)
+            WHEN 5 THEN CAST(REGEXP_REPLACE(cep, '[^0-9]', '') AS UNSIGNED) * 1000
+        END) STORED,
+    ADD COLUMN latitude DOUBLE NULL,
+    ADD COLUMN longitude DOUBLE NULL,
+    ADD COLUMN localizacao POINT SRID 4326 AS (
+        ST_SRID(POINT(COALESCE(longitude, 0), COALESCE(latitude, 0)), 4326)) STORED NOT NULL;
+
+ALTER TABLE imoveis
+    ADD INDEX idx_cep_num (cep_num),
+    ADD SPATIAL INDEX idx_localizacao (localizacao);
+
+COMMIT;
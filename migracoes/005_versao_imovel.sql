@@ -0,0 +1,10 @@
+-- Migração 005: versão de cada imóvel, para o controle de concorrência otimista do PATCH
+-- Toda escrita que altera o imóvel (PUT, PATCH, PATCH /imoveis/bulk) incrementa versao na
+-- mesma instrução UPDATE. O PATCH /imoveis/<id> aceita a versão esperada em If-Match (ou no
+-- campo versao do corpo) e só grava se o imóvel ainda estiver nela; senão responde 412.
+-- As linhas existentes começam na versão 1.
+
+ALTER TABLE imoveis
+    ADD COLUMN versao INT UNSIGNED NOT NULL DEFAULT 1;
+
+COMMIT;
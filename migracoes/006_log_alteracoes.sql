@@ -0,0 +1,17 @@
+-- Migração 006: log de alterações dos imóveis, lido por GET /imoveis/changes
+-- Cada escrita (POST, PUT, PATCH, DELETE e /imoveis/bulk) grava uma linha por imóvel
+-- na mesma transação, depois de incrementar imoveis_controle. O lock da linha de
+-- controle vai até o commit, então os seq são gerados na ordem dos commits e um
+-- consumidor que lê "seq > último visto" nunca pula uma alteração.
+-- Linhas antigas podem ser apagadas (DELETE ... WHERE criado_em < ...); quem pedir
+-- um since anterior ao menor seq restante recebe 410 e refaz a sincronização completa.
+
+CREATE TABLE IF NOT EXISTS imoveis_alteracoes (
+    seq BIGINT PRIMARY KEY AUTO_INCREMENT,
+    imovel_id INTEGER NOT NULL,
+    operacao VARCHAR(10) NOT NULL,
+    criado_em TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    INDEX idx_alteracoes_imovel (imovel_id)
+);
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Migração 007: ordem dos eixos de localizacao
+-- Bancos criados com a versão anterior da migração 004 calculavam localizacao com
+-- POINT(latitude, longitude). Com o SRID 4326, POINT(x, y) lê x como longitude, então os
+-- pontos ficavam com os eixos trocados (o near= comparava com pontos errados) e uma
+-- longitude fora de -90..90 era recusada no INSERT/UPDATE. A coluna passa a ser calculada
+-- como POINT(longitude, latitude); o ALTER recalcula todas as linhas e o índice espacial.
+-- Bancos criados depois da correção da 004 (ou pelo imoveis.sql atual) não precisam dela.
+
+ALTER TABLE imoveis
+    DROP INDEX idx_localizacao,
+    MODIFY COLUMN localizacao POINT SRID 4326 AS (
+        ST_SRID(POINT(COALESCE(longitude, 0), COALESCE(latitude, 0)), 4326)) STORED NOT NULL;
+
+ALTER TABLE imoveis
+    ADD SPATIAL INDEX idx_localizacao (localizacao);
+
+COMMIT;
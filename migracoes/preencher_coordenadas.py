@@ -0,0 +1,90 @@
+"""Preenche latitude/longitude dos imóveis a partir de um CSV de CEPs (migração 004).
+
+    python migracoes/preencher_coordenadas.py ceps.csv [--lote 500] [--sobrescrever]
+
+O CSV tem cabeçalho com as colunas cep, latitude e longitude; o CEP pode vir com
+ou sem hífen e é comparado com a coluna cep_num. Só imóveis ainda sem
+coordenadas são alterados (a não ser com --sobrescrever), então o script pode
+ser interrompido e executado de novo. Cada lote é uma transação que grava como
+as escritas da API: incrementa a versão de cada imóvel (ETag e If-Match do
+PATCH) e o contador de alterações e acrescenta uma entrada 'atualizado' por
+imóvel ao log de /imoveis/changes. Depois do commit, as linhas gravadas (com a
+versão nova) são aplicadas ao instantâneo e o cache dos grupos afetados é
+invalidado.
+"""
+import argparse
+import csv
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+from utils import (obter_conexao, normaliza_cep, cache_imoveis, instantaneo_imoveis, coalescedor_imoveis,
+                   _incrementar_versao, _registrar_alteracoes, _linhas_gravadas, _tags_escrita, _em_lotes)
+
+
+def ler_coordenadas(caminho):
+    """{cep_num: (latitude, longitude)} do CSV e a quantidade de linhas descartadas"""
+    coordenadas, descartadas = {}, 0
+    with open(caminho, encoding='utf-8', newline='') as arquivo:
+        for linha in csv.DictReader(arquivo):
+            try:
+                latitude, longitude = float(linha['latitude']), float(linha['longitude'])
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    raise ValueError(linha)
+                coordenadas[normaliza_cep(linha['cep'])] = (latitude, longitude)
+            except (KeyError, TypeError, ValueError):
+                descartadas += 1
+    return coordenadas, descartadas
+
+
+def preencher(coordenadas, tamanho_lote=500, sobrescrever=False):
+    """Grava as coordenadas nos imóveis de cada CEP; retorna quantos imóveis foram alterados"""
+    condicao = "" if sobrescrever else " AND latitude IS NULL"
+    alterados = 0
+    for ceps in _em_lotes(list(coordenadas), tamanho_lote):
+        gravadas = {}
+        with obter_conexao() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SELECT id, cidade, tipo, cep_num FROM imoveis "
+                               f"WHERE cep_num IN ({', '.join(['%s'] * len(ceps))}){condicao} FOR UPDATE", tuple(ceps))
+                linhas = cursor.fetchall()
+                if linhas:
+                    cursor.executemany(f"UPDATE imoveis SET latitude = %s, longitude = %s, versao = versao + 1 "
+                                       f"WHERE cep_num = %s{condicao}",
+                                       [coordenadas[cep] + (cep,) for cep in ceps])
+                    for ids in _em_lotes([imovel_id for imovel_id, *_ in linhas], tamanho_lote):
+                        gravadas.update(_linhas_gravadas(cursor, ids))
+                    _incrementar_versao(cursor)
+                    _registrar_alteracoes(cursor, [(imovel_id, 'atualizado') for imovel_id, *_ in linhas])
+                conn.commit()
+            finally:
+                cursor.close()
+        if linhas:
+            instantaneo_imoveis.registrar(atualizados=gravadas)
+        tags = set()
+        for imovel_id, cidade, tipo, _ in linhas:
+            tags |= _tags_escrita(imovel_id, (cidade, tipo))
+        cache_imoveis.invalidar(tags)
+        coalescedor_imoveis.invalidar()
+        alterados += len(linhas)
+    return alterados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('arquivo')
+    parser.add_argument('--lote', type=int, default=500, help='CEPs por transação (padrão 500)')
+    parser.add_argument('--sobrescrever', action='store_true', help='substitui coordenadas já preenchidas')
+    args = parser.parse_args()
+
+    coordenadas, descartadas = ler_coordenadas(args.arquivo)
+    alterados = preencher(coordenadas, args.lote, args.sobrescrever)
+    print(f'{len(coordenadas)} CEPs lidos ({descartadas} linhas descartadas); {alterados} imóveis atualizados')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import os
+import re
+from flask.json.provider import DefaultJSONProvider
+from metricas import fase
+
+try:
+    import orjson
+except ImportError:  # sem orjson a serialização usa o json da biblioteca padrão
+    orjson = None
+
+# Serialização JSON das respostas (Flask e Quart). Com o orjson instalado, as
+# coleções grandes são serializadas por ele, com a mesma saída do json padrão
+# do Flask: chaves ordenadas, separadores compactos, ensure_ascii e datas no
+# formato HTTP; o que ele escreveria diferente fica com o json padrão. IMOVEIS_JSON_RAPIDO=0 força o json da biblioteca padrão.
+
+JSON_RAPIDO = orjson is not None and os.getenv('IMOVEIS_JSON_RAPIDO', '1') != '0'
+
+# Trechos que o json.dumps com ensure_ascii=True escapa e o orjson não (DEL e não ASCII)
+_NAO_ASCII = re.compile(rb'[\x7f-\xff]+')
+
+# Faixa em que repr(float) não usa expoente; fora dela o json padrão escreve 1e+16 e
+# 1e-05, e o orjson, 1e16 e 1e-5. inf e NaN viram null no orjson e Infinity/NaN no json
+_FLOAT_MIN, _FLOAT_MAX = 1e-4, 1e16
+
+
+def _floats_compativeis(obj):
+    """Indica se todos os floats de obj saem iguais no orjson e no json padrão"""
+    pendentes = [obj]
+    while pendentes:
+        valor = pendentes.pop()
+        if isinstance(valor, float):
+            # Comparações com NaN são falsas: NaN também cai no return False
+            if valor and not _FLOAT_MIN <= abs(valor) < _FLOAT_MAX:
+                return False
+        elif isinstance(valor, dict):
+            pendentes.extend(valor.values())
+        elif isinstance(valor, (list, tuple)):
+            pendentes.extend(valor)
+    return True
+
+
+def _escapa_trecho(trecho):
+    texto = trecho.group().decode('utf-8')
+    escapado = []
+    for caractere in texto:
+        codigo = ord(caractere)
+        if codigo > 0xFFFF:
+            codigo -= 0x10000
+            escapado.append('\\u%04x\\u%04x' % (0xD800 | (codigo >> 10), 0xDC00 | (codigo & 0x3FF)))
+        else:
+            escapado.append('\\u%04x' % codigo)
+    return ''.join(escapado).encode('ascii')
+
+
+class ProvedorJSON(DefaultJSONProvider):
+    """JSON padrão do Flask, acelerado pelo orjson quando disponível.
+
+    O orjson só é usado nas chamadas que ele reproduz byte a byte: saída
+    compacta (separators=(',', ':')) ou indentada com 2 espaços, sem outros
+    argumentos do json.dumps. dumps() sem argumentos usa os separadores com
+    espaço do json padrão e fica com ele. Valores que o orjson recusa
+    (inteiros acima de 64 bits, chaves que não são str, tipos desconhecidos)
+    ou escreve de outro jeito (floats com expoente, inf e NaN) também voltam
+    para o json padrão. A serialização é medida como a fase 'json' da requisição.
+    """
+
+    def _opcoes(self, kwargs):
+        """Opções do orjson equivalentes a kwargs, ou None se não houver equivalente"""
+        if not JSON_RAPIDO:
+            return None
+        opcoes = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        if kwargs == {'separators': (',', ':')}:
+            return opcoes
+        if kwargs == {'indent': 2}:
+            return opcoes | orjson.OPT_INDENT_2
+        return None
+
+    def _serializar(self, obj, kwargs):
+        """JSON em bytes UTF-8 pelo orjson; None quando o json padrão deve ser usado"""
+        opcoes = self._opcoes(kwargs)
+        if opcoes is None or not _floats_compativeis(obj):
+            return None
+        try:
+            dados = orjson.dumps(obj, default=self.default, option=opcoes)
+        except TypeError:  # inclui orjson.JSONEncodeError
+            return None
+        if self.ensure_ascii and (not dados.isascii() or b'\x7f' in dados):
+            dados = _NAO_ASCII.sub(_escapa_trecho, dados)
+        return dados
+
+    def dumps(self, obj, **kwargs):
+        with fase('json'):
+            dados = self._serializar(obj, kwargs)
+            if dados is None:
+                return super().dumps(obj, **kwargs)
+            return dados.decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        """Igual ao DefaultJSONProvider.response, mas entrega os bytes do orjson sem reconverter"""
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args = {'indent': 2}
+        else:
+            dump_args = {'separators': (',', ':')}
+        with fase('json'):
+            dados = self._serializar(obj, dump_args)
+        if dados is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(dados + b'\n', mimetype=self.mimetype)
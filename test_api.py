@@ -1,15 +1,192 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import pickle
+import re
+import socketserver
+from datetime import date, datetime
+from decimal import Decimal
+import threading
+import time
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, PropertyMock
+from mysql.connector import Error
 from api import app
-from utils import connect_db
+import carregador
+import compressao
+import metricas
+from migracoes import preencher_coordenadas
+import serializacao
+import utils
+from utils import connect_db, ErroConexao, PoolConexoes, RoteadorReplicas
+from cache import AUSENTE, CacheArquivo, CacheRedis, ErroBackendCache
+from fila_escrita import FilaEscrita
+from coalescencia import Coalescedor
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+from urllib.parse import parse_qsl
 
+try:
+    from api_async import app as app_async
+    from quart.signals import got_request_exception, request_finished
+    from quart.wrappers.response import IterableBody
+    import utils_async
+except ImportError:  # Quart não instalado: os testes do modo assíncrono são pulados
+    app_async = None
 
-@pytest.fixture
-def client():
-    """Cliente de teste para a API. Ele simula um usuário da API de imóveis."""
+# Colunas devolvidas pelo cursor (cursor.description) para o SELECT completo da tabela imoveis
+DESCRICAO_IMOVEIS = [(coluna,) for coluna in utils.COLUNAS_IMOVEL]
+# SHOW CREATE TABLE com dois índices secundários, lido pelo carregador.py
+TABELA_COM_INDICES = ('imoveis', "CREATE TABLE `imoveis` (\n"
+                                 "  `id` int NOT NULL AUTO_INCREMENT,\n"
+                                 "  PRIMARY KEY (`id`),\n"
+                                 "  KEY `idx_valor` (`valor`),\n"
+                                 "  FULLTEXT KEY `ft_endereco` (`logradouro`,`bairro`,`cidade`)\n"
+                                 ") ENGINE=InnoDB")
+
+
+class _CursorAsync:
+    """Expõe o cursor (mock) síncrono com a interface do cursor de mysql.connector.aio"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    async def execute(self, *args):
+        return self._cursor.execute(*args)
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def fetchmany(self, tamanho):
+        return self._cursor.fetchmany(tamanho)
+
+    async def close(self):
+        return self._cursor.close()
+
+
+class _ConexaoAsync:
+    """Expõe a conexão (mock) criada por utils.connect_db com a interface assíncrona"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def cursor(self, **opcoes):
+        return _CursorAsync(self._conn.cursor(**opcoes))
+
+    async def ping(self, reconnect=False):
+        return self._conn.ping(reconnect=reconnect)
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    async def rollback(self):
+        return self._conn.rollback()
+
+    async def close(self):
+        return self._conn.close()
+
+
+class _ClienteAsync:
+    """Cliente síncrono sobre o test_client do Quart, com respostas no formato do Flask"""
+
+    def __init__(self, app_async):
+        app_async.config['TESTING'] = True
+        self.pool = utils_async.pool
+        self._cliente = app_async.test_client()
+        self._loop = asyncio.new_event_loop()
+        # O test_client do Quart transforma exceções em 500 e lê o corpo inteiro;
+        # os sinais guardam a exceção (relançada como no Flask) e o tipo do corpo
+        self._erro = None
+        self._streamed = False
+        got_request_exception.connect(self._guardar_erro, app_async)
+        request_finished.connect(self._guardar_resposta, app_async)
+
+    async def _guardar_erro(self, sender, exception, **kwargs):
+        self._erro = exception
+
+    async def _guardar_resposta(self, sender, response, **kwargs):
+        self._streamed = isinstance(response.response, IterableBody)
+
+    def _requisitar(self, metodo, caminho, headers=None, json=None, data=None, content_type=None):
+        caminho, _, query = caminho.partition('?')
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        argumentos = {'headers': headers, 'query_string': parse_qsl(query, keep_blank_values=True)}
+        if json is not None:
+            argumentos['json'] = json
+        if data is not None:
+            argumentos['data'] = data
+
+        async def requisitar():
+            self._erro, self._streamed = None, False
+            resposta = await getattr(self._cliente, metodo)(caminho, **argumentos)
+            if self._erro is not None:
+                raise self._erro
+            corpo = await resposta.get_data()
+            return Response(iter([corpo]) if self._streamed else corpo, status=resposta.status_code,
+                            headers=list(resposta.headers.items()))
+        return self._loop.run_until_complete(requisitar())
+
+    def get(self, caminho, **kwargs):
+        return self._requisitar('get', caminho, **kwargs)
+
+    def post(self, caminho, **kwargs):
+        return self._requisitar('post', caminho, **kwargs)
+
+    def put(self, caminho, **kwargs):
+        return self._requisitar('put', caminho, **kwargs)
+
+    def patch(self, caminho, **kwargs):
+        return self._requisitar('patch', caminho, **kwargs)
+
+    def delete(self, caminho, **kwargs):
+        return self._requisitar('delete', caminho, **kwargs)
+
+    def fechar(self):
+        got_request_exception.disconnect(self._guardar_erro)
+        request_finished.disconnect(self._guardar_resposta)
+        self._loop.run_until_complete(utils_async.pool.fechar())
+        self._loop.close()
+
+
+async def _connect_db_async(**opcoes):
+    return _ConexaoAsync(utils.connect_db(**opcoes))
+
+
+@pytest.fixture(params=['sync', 'async'])
+def client(request):
+    """Cliente de teste para a API. Ele simula um usuário da API de imóveis.
+
+    Cada teste roda nos dois modos: Flask (api.py) e Quart (api_async.py). No
+    modo assíncrono, a conexão criada por utils.connect_db (o mock do teste) é
+    adaptada para a interface do driver assíncrono.
+    """
     app.config['TESTING'] = True
-    with app.test_client() as client:
-        yield client
+    utils.pool.fechar()  # Descarta conexões (mocks) emprestadas por testes anteriores
+    utils.cache_imoveis.ativo = False  # Cada teste configura o próprio mock do banco
+    if request.param == 'sync':
+        with app.test_client() as client:
+            client.pool = utils.pool
+            yield client
+    else:
+        if app_async is None:
+            pytest.skip('Quart não instalado')
+        client = _ClienteAsync(app_async)
+        with patch('utils_async.connect_db', _connect_db_async):
+            yield client
+        client.fechar()
+    utils.pool.fechar()
+    utils.cache_imoveis.limpar()
 
 # GET - Todos os imóveis + atributos
 @patch("utils.connect_db")  # Substitui-se a função que conecta ao banco por um Mock
@@ -20,6 +197,7 @@ def test_get_imoveis(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchall.return_value = [
         (0, 'Rua Inhambu, 97 ', 'Rua', 'Moema', 'São Paulo', '04520-010', 'Apartamento', 7000000.0, '2022-06-02'),
         (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
@@ -66,6 +244,7 @@ def test_get_imoveis_vazio(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchall.return_value = []
     mock_connect_db.return_value = mock_conn
 
@@ -86,9 +265,10 @@ def test_get_imovel_por_id(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS + [('versao',)]
     mock_cursor.fetchone.return_value = (
         1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 
-        'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'
+        'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25', 3
     )
     mock_connect_db.return_value = mock_conn
 
@@ -117,6 +297,7 @@ def test_get_imovel_por_id(mock_connect_db, client):
         }
     }
     assert response.get_json() == expected_response
+    assert response.headers['ETag'] == '"3"'  # versão do imóvel, aceita no If-Match do PATCH
  
  # GET - Imóvel por ID não encontrado 
 @patch("utils.connect_db")
@@ -127,6 +308,7 @@ def test_get_imovel_nao_encontrado(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchone.return_value = None
     mock_connect_db.return_value = mock_conn
 
@@ -149,6 +331,7 @@ def test_post_adicionar_imovel(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.lastrowid = 4  # ID do novo imóvel criado
     mock_connect_db.return_value = mock_conn
     novo_imovel = {
@@ -197,6 +380,7 @@ def test_put_atualizar_imovel(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchone.return_value = (
         1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 
         'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'
@@ -249,6 +433,7 @@ def test_put_atualizar_imovel_inexistente(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.rowcount = 0  
     mock_connect_db.return_value = mock_conn
     
@@ -277,6 +462,7 @@ def test_delete_remove_imovel(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchone.return_value = (
         5, 'Rua Oscar Freire, 103', 'Rua', 'Cerqueira César', 
         'São Paulo', '01426-000', 'Apartamento', 15000000.0, '2006-06-10'
@@ -299,6 +485,7 @@ def test_delete_remove_imovel_inexistente(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.rowcount = 0
     mock_connect_db.return_value = mock_conn
     
@@ -318,6 +505,7 @@ def test_get_imoveis_filtro_tipo(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchall.return_value = [
         (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
     ]
@@ -337,7 +525,7 @@ def test_get_imoveis_filtro_tipo(mock_connect_db, client):
         assert '_links' in imovel
     
     mock_cursor.execute.assert_called_with(
-        "SELECT * FROM imoveis WHERE tipo = %s", 
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE tipo = %s", 
         ("Casa",)
     )
 
@@ -349,6 +537,7 @@ def test_get_imoveis_filtro_cidade(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchall.return_value = [
         (0, 'Rua Inhambu, 97 ', 'Rua', 'Moema', 'São Paulo', '04520-010', 'Apartamento', 7000000.0, '2022-06-02'),
         (3, 'Avenida Braz Leme, 1981', 'Avenida', 'Santana', 'São Paulo', '02022-010', 'Apartamento', 1800000.0, '2014-10-27')
@@ -370,7 +559,7 @@ def test_get_imoveis_filtro_cidade(mock_connect_db, client):
         assert '_links' in imovel
     
     mock_cursor.execute.assert_called_with(
-        "SELECT * FROM imoveis WHERE cidade = %s", 
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE cidade = %s", 
         ("São Paulo",)
     )
 
@@ -382,6 +571,7 @@ def test_get_imoveis_filtro_tipo_rota_separada(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchall.return_value = [
         (0, 'Rua Inhambu, 97 ', 'Rua', 'Moema', 'São Paulo', '04520-010', 'Apartamento', 7000000.0, '2022-06-02'),
         (3, 'Avenida Braz Leme, 1981', 'Avenida', 'Santana', 'São Paulo', '02022-010', 'Apartamento', 1800000.0, '2014-10-27')
@@ -403,7 +593,7 @@ def test_get_imoveis_filtro_tipo_rota_separada(mock_connect_db, client):
         assert '_links' in imovel
     
     mock_cursor.execute.assert_called_with(
-        "SELECT * FROM imoveis WHERE tipo = %s", 
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE tipo = %s", 
         ("Apartamento",)
     )
 
@@ -415,6 +605,7 @@ def test_get_imoveis_filtro_cidade_rota_separada(mock_connect_db, client):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
     mock_cursor.fetchall.return_value = [
         (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
     ]
@@ -434,6 +625,1788 @@ def test_get_imoveis_filtro_cidade_rota_separada(mock_connect_db, client):
         assert '_links' in imovel
     
     mock_cursor.execute.assert_called_with(
-        "SELECT * FROM imoveis WHERE cidade = %s", 
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE cidade = %s", 
         ("Rio de Janeiro",)
     )
+
+
+# Pool de conexões - conexão devolvida mesmo quando a consulta falha
+@patch("utils.connect_db")
+def test_pool_devolve_conexao_em_erro(mock_connect_db, client):
+    """Testa que a conexão volta ao pool e a transação é desfeita quando a consulta levanta erro"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.execute.side_effect = Error("Lost connection to MySQL server")
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    with pytest.raises(Error):
+        client.get('/imoveis')
+
+    # THEN/DANN
+    mock_conn.rollback.assert_called_once()
+    mock_cursor.close.assert_called_once()
+    assert client.pool.estatisticas()['em_uso'] == 0
+    assert client.pool.estatisticas()['ociosas'] == 1
+
+# Pool de conexões - reaproveitamento entre requisições
+@patch("utils.connect_db")
+def test_pool_reaproveita_conexao(mock_connect_db, client):
+    """Testa que requisições seguidas reutilizam a mesma conexão, sem novo handshake"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = None
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    client.get('/imoveis/1')
+    client.get('/imoveis/2')
+
+    # THEN/DANN
+    assert mock_connect_db.call_count == 1
+    mock_conn.close.assert_not_called()
+
+# Pool de conexões - a leitura não deixa o snapshot aberto na conexão devolvida
+@patch("utils.connect_db")
+def test_pool_encerra_transacao_de_leitura(mock_connect_db, client):
+    """Testa que a conexão volta ao pool sem a transação aberta pelo SELECT (senão as próximas leituras veem dados antigos)"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = None
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    mock_conn.in_transaction = True
+    client.get('/imoveis/1')
+    rollbacks_em_transacao = mock_conn.rollback.call_count
+    mock_conn.rollback.reset_mock()
+    mock_conn.in_transaction = False
+    client.get('/imoveis/2')
+
+    # THEN/DANN
+    assert rollbacks_em_transacao >= 1
+    mock_conn.rollback.assert_not_called()  # sem transação aberta, nenhuma ida extra ao banco
+    assert client.pool.estatisticas()['ociosas'] == 1
+
+# Pool de conexões - conexão quebrada é substituída no empréstimo
+@patch("utils.connect_db")
+def test_pool_substitui_conexao_quebrada(mock_connect_db):
+    """Testa que uma conexão ociosa que falha no ping é descartada e recriada"""
+
+    # GIVEN/GEGEBEN
+    conexao_velha = MagicMock()
+    conexao_velha.ping.side_effect = Error("MySQL server has gone away")
+    conexao_nova = MagicMock()
+    mock_connect_db.side_effect = [conexao_velha, conexao_nova]
+    pool = PoolConexoes(tamanho_max=1, intervalo_ping=0)
+
+    # WHEN/WANN
+    pool.devolver(pool.obter())
+    conn = pool.obter()
+
+    # THEN/DANN
+    assert conn is conexao_nova
+    conexao_velha.close.assert_called_once()
+
+# Pool de conexões - tempo esgotado aguardando conexão livre
+@patch("utils.connect_db")
+def test_pool_timeout(mock_connect_db):
+    """Testa que o pool levanta ErroConexao quando todas as conexões estão em uso"""
+
+    # GIVEN/GEGEBEN
+    mock_connect_db.return_value = MagicMock()
+    pool = PoolConexoes(tamanho_max=1, timeout=0.01)
+    pool.obter()
+
+    # WHEN/WANN / THEN/DANN
+    with pytest.raises(ErroConexao):
+        pool.obter()
+
+@pytest.mark.skipif(app_async is None, reason='Quart não instalado')
+@patch("utils.connect_db")
+def test_pool_async_suspende_ate_devolucao(mock_connect_db):
+    """Testa que, no pool assíncrono, quem espera é acordado pela devolução e o timeout levanta ErroConexao"""
+
+    # GIVEN/GEGEBEN
+    mock_connect_db.return_value = MagicMock()
+    pool = utils_async.PoolConexoesAsync(tamanho_max=1, timeout=0.05)
+
+    async def cenario():
+        with patch('utils_async.connect_db', _connect_db_async):
+            conn = await pool.obter()
+            espera = asyncio.create_task(pool.obter())
+            await asyncio.sleep(0)
+            await pool.devolver(conn)
+            reaproveitada = await espera
+            with pytest.raises(ErroConexao):
+                await pool.obter()
+            return conn, reaproveitada
+
+    # WHEN/WANN
+    conn, reaproveitada = asyncio.run(cenario())
+
+    # THEN/DANN
+    assert reaproveitada is conn
+    assert pool.estatisticas()['criadas'] == 1
+
+# Falha de conexão com o banco
+@patch("utils.mysql.connector.connect")
+def test_banco_indisponivel(mock_connect, client):
+    """Testa que uma falha de conexão responde 503 em vez de quebrar em conn.cursor()"""
+
+    # GIVEN/GEGEBEN
+    mock_connect.side_effect = Error("Can't connect to MySQL server")
+
+    # WHEN/WANN
+    response = client.get('/imoveis')
+
+    # THEN/DANN
+    assert response.status_code == 503
+    assert response.get_json() == {'erro': 'Banco de dados indisponível'}
+
+# GET - Paginação por chave (keyset)
+@patch("utils.connect_db")
+def test_get_imoveis_paginado(mock_connect_db, client):
+    """Testa a paginação com limit/after_id resolvida no banco com WHERE id > ? ORDER BY id LIMIT ?"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (3, 'Avenida Braz Leme, 1981', 'Avenida', 'Santana', 'São Paulo', '02022-010', 'Apartamento', 1800000.0, '2014-10-27'),
+        (7, 'Rua Inhambu, 97 ', 'Rua', 'Moema', 'São Paulo', '04520-010', 'Apartamento', 7000000.0, '2022-06-02'),
+        (9, 'Rua Oscar Freire, 103', 'Rua', 'Cerqueira César', 'São Paulo', '01426-000', 'Apartamento', 15000000.0, '2006-06-10')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis?cidade=São Paulo&limit=2&after_id=1')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [imovel['id'] for imovel in response_data['imoveis']] == [3, 7]
+    assert response_data['_links']['next'] == '/imoveis?cidade=S%C3%A3o+Paulo&limit=2&after_id=7'
+    assert response_data['_links']['prev'] == '/imoveis?cidade=S%C3%A3o+Paulo&limit=2&before_id=3'
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE cidade = %s AND id > %s ORDER BY id LIMIT %s",
+        ("São Paulo", 1, 3)
+    )
+
+@patch("utils.connect_db")
+def test_get_imoveis_pagina_anterior(mock_connect_db, client):
+    """Testa a volta de página com before_id, lida em ordem decrescente e devolvida em ordem crescente"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (2, 'Praça dos Três Poderes', 'Praça', 'Centro', 'Brasília', '70175-900', 'Palácio', 200000000.0, '1960-04-21'),
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis/tipo/Casa?limit=2&before_id=3')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [imovel['id'] for imovel in response_data['imoveis']] == [1, 2]
+    assert response_data['_links']['self'] == '/imoveis/tipo/Casa'
+    assert response_data['_links']['next'] == '/imoveis/tipo/Casa?limit=2&after_id=2'
+    assert 'prev' not in response_data['_links']
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE tipo = %s AND id < %s ORDER BY id DESC LIMIT %s",
+        ("Casa", 3, 3)
+    )
+
+@patch("utils.connect_db")
+def test_get_imoveis_limite_maximo(mock_connect_db, client):
+    """Testa que o limit pedido pelo cliente é limitado ao tamanho máximo de página do servidor"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = []
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis?limit=abc')
+    client.get('/imoveis?limit=1000000')
+
+    # THEN/DANN
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis ORDER BY id LIMIT %s",
+        (utils.PAGINA_MAX + 1,)
+    )
+    assert response.status_code == 400
+
+# GET - Exportação em streaming
+@patch("utils.connect_db")
+def test_get_imoveis_stream_json(mock_connect_db, client):
+    """Testa que a exportação em streaming (fetchmany) gera o mesmo JSON da listagem completa"""
+
+    # GIVEN/GEGEBEN
+    linhas = [
+        (0, 'Rua Inhambu, 97 ', 'Rua', 'Moema', 'São Paulo', '04520-010', 'Apartamento', 7000000.0, '2022-06-02'),
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
+        (2, 'Praça dos Três Poderes', 'Praça', 'Centro', 'Brasília', '70175-900', 'Palácio', 200000000.0, '1960-04-21')
+    ]
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = linhas
+    mock_cursor.fetchmany.side_effect = [linhas[:2], linhas[2:], []]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_completa = client.get('/imoveis')
+    response_stream = client.get('/imoveis?stream=1')
+
+    # THEN/DANN
+    assert response_stream.status_code == 200
+    assert response_stream.is_streamed
+    assert response_stream.data == response_completa.data
+    assert client.pool.estatisticas()['em_uso'] == 0
+
+@patch("utils.connect_db")
+def test_get_imoveis_stream_ndjson(mock_connect_db, client):
+    """Testa a exportação em NDJSON pedida via Accept: application/x-ndjson"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchmany.side_effect = [[
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
+        (5, 'Rua Oscar Freire, 103', 'Rua', 'Cerqueira César', 'São Paulo', '01426-000', 'Apartamento', 15000000.0, '2006-06-10')
+    ], []]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis/cidade/São Paulo', headers={'Accept': 'application/x-ndjson'})
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    linhas = [json.loads(linha) for linha in response.data.decode().splitlines()]
+    assert [imovel['id'] for imovel in linhas] == [1, 5]
+    assert linhas[1]['_links']['self'] == '/imoveis/5'
+    mock_cursor.execute.assert_called_with("SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis WHERE cidade = %s", ("São Paulo",))
+
+
+def _conta_execucoes(mock_cursor, sql):
+    """Conta quantas vezes o SQL foi executado no cursor mockado"""
+    return sum(1 for chamada in mock_cursor.execute.call_args_list if chamada.args[0] == sql)
+
+@pytest.fixture
+def cache_ligado():
+    """Liga o cache de leitura apenas no teste que o usa."""
+    utils.cache_imoveis.limpar()
+    utils.cache_imoveis.ativo = True
+    yield utils.cache_imoveis
+    utils.cache_imoveis.ativo = False
+    utils.cache_imoveis.limpar()
+
+# Cache de leitura - busca por id e invalidação na atualização
+@patch("utils.connect_db")
+def test_cache_imovel_por_id(mock_connect_db, client, cache_ligado):
+    """Testa que a segunda leitura vem do cache e que o PUT invalida o id alterado"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS + [('versao',)]
+    linha = (
+        1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema',
+        'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25', 1
+    )
+    versao_tabela = (7, datetime(2025, 10, 1, 12, 30, 15))
+    # O GET lê a versão da tabela (Last-Modified) antes do imóvel; o PUT lê cidade/tipo antes do UPDATE
+    mock_cursor.fetchone.side_effect = [versao_tabela, linha, ('Rio de Janeiro', 'Casa'), versao_tabela, linha[:-1] + (2,)]
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+    dados_atualizados = {
+        'logradouro': 'Rua Nascimento Silva, 107',
+        'tipo_logradouro': 'Rua',
+        'bairro': 'Ipanema',
+        'cidade': 'Rio de Janeiro',
+        'cep': '22421-025',
+        'tipo': 'Casa',
+        'valor': 13000000.0,
+        'data_aquisicao': '1974-01-25'
+    }
+
+    # WHEN/WANN
+    primeira = client.get('/imoveis/1')
+    segunda = client.get('/imoveis/1')
+    selects_antes_do_put = _conta_execucoes(mock_cursor, "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao, versao FROM imoveis WHERE id = %s")
+    client.put('/imoveis/1', json=dados_atualizados)
+    terceira = client.get('/imoveis/1')
+
+    # THEN/DANN
+    assert primeira.get_json() == segunda.get_json()
+    assert '_links' in segunda.get_json()
+    assert selects_antes_do_put == 1
+    mock_cursor.execute.assert_called_with("SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao, versao FROM imoveis WHERE id = %s", (1,))
+    assert segunda.headers['ETag'] == '"1"' and terceira.headers['ETag'] == '"2"'
+    # A segunda leitura acerta a versão da tabela e o imóvel, e o PUT invalida as duas entradas
+    assert cache_ligado.estatisticas()['acertos'] == 2
+    assert cache_ligado.estatisticas()['invalidacoes'] == 2
+
+# Cache de leitura - invalidação apenas dos grupos afetados
+@patch("utils.connect_db")
+def test_cache_invalida_apenas_grupo_afetado(mock_connect_db, client, cache_ligado):
+    """Testa que um POST em Ituverava remove a listagem da cidade e a geral, mas mantém as demais cidades"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    ]
+    mock_cursor.lastrowid = 4
+    mock_connect_db.return_value = mock_conn
+    client.get('/imoveis')
+    client.get('/imoveis/cidade/Rio de Janeiro')
+    client.get('/imoveis/cidade/Ituverava')
+
+    # WHEN/WANN
+    client.post('/imoveis', json={
+        'logradouro': 'Rua Dr Getúlio Vargas, 308',
+        'tipo_logradouro': 'Rua',
+        'bairro': 'Centro',
+        'cidade': 'Ituverava',
+        'cep': '14500-000',
+        'tipo': 'Casa',
+        'valor': 1000000.0,
+        'data_aquisicao': '1968-02-15'
+    })
+
+    # THEN/DANN
+    assert cache_ligado.obter(utils.chave_lista({'cidade': ('Rio de Janeiro',)}))[0] is not utils.AUSENTE
+    assert cache_ligado.obter(utils.chave_lista({'cidade': ('Ituverava',)}))[0] is utils.AUSENTE
+    assert cache_ligado.obter(utils.chave_lista())[0] is utils.AUSENTE
+    assert cache_ligado.obter(utils.CHAVE_VERSAO)[0] is utils.AUSENTE
+    response = client.get('/cache/estatisticas')
+    assert response.get_json()['invalidacoes'] == 3  # as duas listagens e a versão da tabela
+
+@patch("utils.connect_db")
+def test_versao_da_tabela_vem_do_cache(mock_connect_db, client, cache_ligado):
+    """Testa que o GET condicional com o cache acertando não vai ao MySQL nem para ler a versão, e que a escrita a renova"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.side_effect = [
+        (42, datetime(2025, 10, 1, 12, 30, 15)),
+        ('Rio de Janeiro', 'Casa'),
+        (43, datetime(2025, 10, 1, 12, 31, 0))
+    ]
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    ]
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    primeira = client.get('/imoveis')
+    mock_cursor.execute.reset_mock()
+    segunda = client.get('/imoveis', headers={'If-None-Match': '"v42"'})
+    execucoes_com_cache = mock_cursor.execute.call_count
+    client.delete('/imoveis/1')
+    depois_da_escrita = client.get('/imoveis', headers={'If-None-Match': '"v42"'})
+
+    # THEN/DANN
+    assert primeira.headers['ETag'] == '"v42"'
+    assert segunda.status_code == 304
+    assert execucoes_com_cache == 0
+    assert depois_da_escrita.status_code == 200
+    assert depois_da_escrita.headers['ETag'] == '"v43"'
+
+
+class _RedisFalso(socketserver.StreamRequestHandler):
+    """Servidor mínimo do protocolo Redis (MGET, SET, INCR) para testar o CacheRedis."""
+
+    def handle(self):
+        dados = self.server.dados
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            argumentos = []
+            for _ in range(int(linha[1:])):
+                tamanho = int(self.rfile.readline()[1:])
+                argumentos.append(self.rfile.read(tamanho + 2)[:-2])
+            comando = argumentos[0].upper()
+            with self.server.lock:
+                if comando == b'MGET':
+                    valores = [dados.get(chave) for chave in argumentos[1:]]
+                    resposta = b'*%d\r\n' % len(valores) + b''.join(
+                        b'$-1\r\n' if valor is None else b'$%d\r\n%s\r\n' % (len(valor), valor) for valor in valores
+                    )
+                elif comando == b'SET':
+                    dados[argumentos[1]] = argumentos[2]
+                    resposta = b'+OK\r\n'
+                elif comando == b'INCR':
+                    dados[argumentos[1]] = b'%d' % (int(dados.get(argumentos[1], 0)) + 1)
+                    resposta = b':%s\r\n' % dados[argumentos[1]]
+                else:
+                    resposta = b'-ERR comando desconhecido\r\n'
+            self.wfile.write(resposta)
+
+
+@pytest.fixture
+def servidor_redis():
+    """Sobe o servidor Redis falso em uma porta livre."""
+    servidor = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _RedisFalso)
+    servidor.daemon_threads = True
+    servidor.dados = {}
+    servidor.lock = threading.Lock()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield f'redis://127.0.0.1:{servidor.server_address[1]}/0'
+    servidor.shutdown()
+    servidor.server_close()
+
+def _verifica_invalidacao_entre_workers(worker_a, worker_b):
+    """Grava pelo worker A, invalida pelo worker B e confere que A deixa de ver a entrada."""
+    imovel = {'id': 1, 'cidade': 'Rio de Janeiro', 'tipo': 'Casa', 'valor': 5000000.0}
+    tags = [('id', 1)]
+
+    valor, marca = worker_a.obter(('id', 1), tags)
+    assert valor is AUSENTE
+    worker_a.gravar(('id', 1), imovel, tags, marca)
+    assert worker_a.obter(('id', 1), tags)[0] == imovel
+    assert worker_b.obter(('id', 1), tags)[0] == imovel
+
+    worker_b.invalidar([('id', 1), ('lista', None, None)])
+
+    assert worker_a.obter(('id', 1), tags)[0] is AUSENTE
+    assert worker_a.estatisticas()['acertos'] == 1
+
+# Cache compartilhado - arquivo SQLite usado por vários workers do mesmo host
+def test_cache_arquivo_invalidacao_entre_workers(tmp_path):
+    """Testa que a invalidação feita por um worker é vista pelo outro na leitura seguinte"""
+    caminho = str(tmp_path / 'cache.sqlite')
+    _verifica_invalidacao_entre_workers(CacheArquivo(caminho=caminho), CacheArquivo(caminho=caminho))
+
+# Cache compartilhado - servidor no protocolo Redis
+def test_cache_redis_invalidacao_entre_workers(servidor_redis):
+    """Testa o CacheRedis contra um servidor falso local, com dois clientes simulando dois workers"""
+    _verifica_invalidacao_entre_workers(CacheRedis(url=servidor_redis), CacheRedis(url=servidor_redis))
+
+def test_cache_redis_indisponivel():
+    """Testa que a falha de conexão com o Redis vira falha de cache, sem levantar erro"""
+    cache = CacheRedis(url='redis://127.0.0.1:1/0', timeout=0.1)
+
+    valor, marca = cache.obter(('id', 1), [('id', 1)])
+    cache.gravar(('id', 1), {'id': 1}, [('id', 1)], marca)
+
+    assert valor is AUSENTE
+    assert cache.estatisticas()['erros'] == 1
+
+def test_cache_com_e_s_fora_do_event_loop():
+    """Testa que, no modo assíncrono, as chamadas a um backend de cache com E/S (arquivo, redis) saem da thread do event loop"""
+    if app_async is None:
+        pytest.skip('Quart não instalado')
+
+    # GIVEN/GEGEBEN
+    threads = []
+
+    class CacheBloqueante:
+        ativo = True
+        bloqueante = True
+
+        def obter(self, chave, tags=()):
+            threads.append(threading.current_thread())
+            return {'id': 1, 'tipo': 'Casa', 'cidade': 'Rio de Janeiro'}, 0
+
+    # WHEN/WANN
+    with patch('utils_async.cache_imoveis', CacheBloqueante()):
+        imovel = asyncio.run(utils_async.get_imovel_por_id(1))
+
+    # THEN/DANN
+    assert imovel['id'] == 1
+    assert threads and threads[0] is not threading.main_thread()
+    assert CacheArquivo.bloqueante and CacheRedis.bloqueante and not utils.cache_imoveis.bloqueante
+
+def test_cache_redis_erro_descarta_conexao(servidor_redis):
+    """Testa que um -ERR no meio do pipeline ou no AUTH descarta a conexão, sem deixar respostas trocadas"""
+
+    # GIVEN/GEGEBEN
+    cache = CacheRedis(url=servidor_redis)
+    porta = servidor_redis.rsplit(':', 1)[1].split('/')[0]
+    com_senha = CacheRedis(url=f'redis://:segredo@127.0.0.1:{porta}/0')
+
+    # WHEN/WANN
+    with pytest.raises(ErroBackendCache):
+        cache._executar([('PING',), ('INCR', 'contador')])  # o servidor falso responde -ERR ao PING
+    depois_do_erro = cache._executar([('INCR', 'contador')])
+    with pytest.raises(ErroBackendCache):
+        com_senha._executar([('INCR', 'contador')])
+
+    # THEN/DANN
+    assert depois_do_erro == [2]  # a resposta do INCR do pipeline com erro não ficou no socket
+    assert com_senha._local.sock is None
+
+def test_cache_compartilhado_recusa_entrada_forjada(servidor_redis):
+    """Testa que uma entrada gravada por terceiros no Redis não executa código no load e que a assinatura é conferida"""
+
+    # GIVEN/GEGEBEN
+    class Forjada:
+        def __reduce__(self):
+            return (os.getcwd, ())
+    cache = CacheRedis(url=servidor_redis)
+    assinado = CacheRedis(url=servidor_redis, chave_assinatura='segredo', prefixo='assinado')
+    outra_chave = CacheRedis(url=servidor_redis, chave_assinatura='outra', prefixo='assinado')
+    tags = [('id', 1)]
+    imovel = {'id': 1, 'data_aquisicao': date(1974, 1, 25), 'valor': Decimal('5000000.00')}
+
+    # WHEN/WANN
+    _, marca = cache.obter(('id', 1), tags)
+    cache._escrever(cache._chave_entrada(('id', 1)), pickle.dumps((marca, Forjada())), 60)
+    forjada = cache.obter(('id', 1), tags)[0]
+    _, marca = assinado.obter(('id', 1), tags)
+    assinado.gravar(('id', 1), imovel, tags, marca)
+    lido = assinado.obter(('id', 1), tags)[0]
+    lido_com_outra_chave = outra_chave.obter(('id', 1), tags)[0]
+
+    # THEN/DANN
+    assert forjada is AUSENTE
+    assert cache.estatisticas()['erros'] == 1
+    assert lido == imovel
+    assert lido_com_outra_chave is AUSENTE
+
+# GET condicional - ETag e Last-Modified
+@patch("utils.connect_db")
+def test_get_imoveis_envia_validadores(mock_connect_db, client):
+    """Testa que a listagem traz ETag e Last-Modified derivados do contador de alterações"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = (42, datetime(2025, 10, 1, 12, 30, 15, 123456))
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis/cidade/Rio de Janeiro')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"v42"'
+    assert response.headers['Last-Modified'] == 'Wed, 01 Oct 2025 12:30:15 GMT'
+
+@patch("utils.connect_db")
+def test_get_imovel_nao_modificado(mock_connect_db, client):
+    """Testa o 304: nas listagens sem executar o SELECT dos imóveis; no imóvel, pela versão da linha (o ETag do If-Match)"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS + [('versao',)]
+    versao_tabela = (42, datetime(2025, 10, 1, 12, 30, 15))
+    linha = (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25', 3)
+    mock_cursor.fetchone.side_effect = [versao_tabela, versao_tabela] + [versao_tabela, linha] * 3
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis/cidade/Rio de Janeiro', headers={'If-None-Match': '"v42"'})
+    response_desde = client.get('/imoveis', headers={'If-Modified-Since': 'Wed, 01 Oct 2025 12:30:15 GMT'})
+    execucoes_listagens = mock_cursor.execute.call_count
+    ultima_listagem = mock_cursor.execute.call_args
+    response_imovel = client.get('/imoveis/1', headers={'If-None-Match': 'W/"3"'})
+    response_imovel_desde = client.get('/imoveis/1', headers={'If-Modified-Since': 'Wed, 01 Oct 2025 12:30:15 GMT'})
+    response_imovel_antigo = client.get('/imoveis/1', headers={'If-Modified-Since': 'Wed, 01 Oct 2025 12:30:14 GMT'})
+
+    # THEN/DANN
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == '"v42"'
+    assert response_desde.status_code == 304
+    assert ultima_listagem.args == ("SELECT versao, atualizado_em FROM imoveis_controle WHERE id = 1",)
+    assert execucoes_listagens == 2
+    assert response_imovel.status_code == 304
+    assert response_imovel.data == b''
+    assert response_imovel.headers['ETag'] == '"3"'
+    # O Last-Modified do imóvel é o da tabela, como nas listagens
+    assert response_imovel_desde.status_code == 304
+    assert response_imovel_antigo.status_code == 200
+    assert response_imovel_antigo.headers['ETag'] == '"3"'
+    assert response_imovel_antigo.headers['Last-Modified'] == 'Wed, 01 Oct 2025 12:30:15 GMT'
+
+@patch("utils.connect_db")
+def test_delete_incrementa_versao(mock_connect_db, client):
+    """Testa que a escrita incrementa o contador de alterações antes do commit"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.delete('/imoveis/5')
+
+    # THEN/DANN
+    assert response.status_code == 204
+    assert _conta_execucoes(mock_cursor, "UPDATE imoveis_controle SET versao = versao + 1, atualizado_em = CURRENT_TIMESTAMP(6) WHERE id = 1") == 1
+    mock_conn.commit.assert_called_once()
+
+# Operações em lote
+@patch("utils.BULK_LOTE", 2)
+@patch("utils.connect_db")
+def test_post_imoveis_em_lote(mock_connect_db, client):
+    """Testa o POST /imoveis/bulk em NDJSON: INSERT de várias linhas por lote e status por item"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    type(mock_cursor).lastrowid = property(MagicMock(side_effect=[10, 12]))
+    mock_connect_db.return_value = mock_conn
+    imovel = {
+        'logradouro': 'Rua Dr Getúlio Vargas, 308',
+        'tipo_logradouro': 'Rua',
+        'bairro': 'Centro',
+        'cidade': 'Ituverava',
+        'cep': '14500-000',
+        'tipo': 'Casa',
+        'valor': 1000000.0,
+        'data_aquisicao': '1968-02-15'
+    }
+    corpo = '\n'.join(json.dumps(item) for item in [imovel, {'logradouro': 'Sem cidade'}, imovel, imovel])
+
+    # WHEN/WANN
+    response = client.post('/imoveis/bulk', data=corpo, content_type='application/x-ndjson')
+
+    # THEN/DANN
+    assert response.status_code == 207
+    response_data = response.get_json()
+    assert [resultado['status'] for resultado in response_data['resultados']] == [201, 400, 201, 201]
+    assert [resultado.get('id') for resultado in response_data['resultados']] == [10, None, 11, 12]
+    assert response_data['sucesso'] == 3
+    inserts = [chamada for chamada in mock_cursor.execute.call_args_list if chamada.args[0].startswith('INSERT INTO imoveis (')]
+    assert len(inserts) == 2
+    assert inserts[0].args[0].count('(%s, %s, %s, %s, %s, %s, %s, %s)') == 2
+    mock_conn.commit.assert_called_once()
+
+@patch("utils.connect_db")
+def test_patch_imoveis_em_lote(mock_connect_db, client):
+    """Testa o PATCH /imoveis/bulk: um UPDATE com CASE para os itens existentes e 404 para os demais"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [(1, 'Rio de Janeiro', 'Casa'), (3, 'São Paulo', 'Apartamento')]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.patch('/imoveis/bulk', json=[
+        {'id': 1, 'valor': 5500000.0},
+        {'id': 2, 'valor': 100.0},
+        {'id': 3, 'valor': 1900000.0},
+        {'valor': 1.0}
+    ])
+
+    # THEN/DANN
+    assert response.status_code == 207
+    assert [resultado['status'] for resultado in response.get_json()['resultados']] == [200, 404, 200, 400]
+    assert _conta_execucoes(
+        mock_cursor,
+        "UPDATE imoveis SET valor = CASE id WHEN %s THEN %s WHEN %s THEN %s END, versao = versao + 1 WHERE id IN (%s, %s)"
+    ) == 1
+    mock_cursor.execute.assert_any_call(
+        "UPDATE imoveis SET valor = CASE id WHEN %s THEN %s WHEN %s THEN %s END, versao = versao + 1 WHERE id IN (%s, %s)",
+        (1, 5500000.0, 3, 1900000.0, 1, 3)
+    )
+
+@patch("utils.connect_db")
+def test_delete_imoveis_em_lote(mock_connect_db, client):
+    """Testa o DELETE /imoveis/bulk com ids existentes e inexistentes"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [(5, 'São Paulo', 'Apartamento')]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.delete('/imoveis/bulk', json=[5, {'id': 6}])
+    response_grande = client.delete('/imoveis/bulk', json=list(range(utils.BULK_MAX + 1)))
+
+    # THEN/DANN
+    assert response.status_code == 207
+    assert [resultado['status'] for resultado in response.get_json()['resultados']] == [204, 404]
+    mock_cursor.execute.assert_any_call("DELETE FROM imoveis WHERE id IN (%s)", (5,))
+    assert response_grande.status_code == 413
+
+# GET - Projeção de colunas com fields=
+@patch("utils.connect_db")
+def test_get_imoveis_fields_sem_links(mock_connect_db, client):
+    """Testa que fields= vira a lista de colunas do SELECT e que links=0 omite os _links de cada item"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = [('id',), ('cidade',), ('valor',)]
+    mock_cursor.fetchall.return_value = [(0, 'São Paulo', 7000000.0), (3, 'São Paulo', 1800000.0)]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis?cidade=São Paulo&fields=cidade,valor&links=0')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'imoveis': [
+            {'id': 0, 'cidade': 'São Paulo', 'valor': 7000000.0},
+            {'id': 3, 'cidade': 'São Paulo', 'valor': 1800000.0}
+        ],
+        '_links': {'self': '/imoveis', 'create': '/imoveis'}
+    }
+    mock_cursor.execute.assert_called_with("SELECT id, cidade, valor FROM imoveis WHERE cidade = %s", ("São Paulo",))
+
+@patch("utils.connect_db")
+def test_get_imovel_fields_com_links(mock_connect_db, client):
+    """Testa que, com links, a projeção inclui as colunas usadas pelos links (tipo e cidade)"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = [('id',), ('cidade',), ('tipo',), ('valor',), ('versao',)]
+    mock_cursor.fetchone.return_value = (1, 'Rio de Janeiro', 'Casa', 5000000.0, 1)
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis/1?fields=valor')
+    response_invalida = client.get('/imoveis/1?fields=valor,senha')
+
+    # THEN/DANN
+    assert response.get_json()['valor'] == 5000000.0
+    assert response.get_json()['_links']['by_city'] == '/imoveis/cidade/Rio de Janeiro'
+    assert 'logradouro' not in response.get_json() and 'versao' not in response.get_json()
+    mock_cursor.execute.assert_any_call("SELECT id, cidade, tipo, valor, versao FROM imoveis WHERE id = %s", (1,))
+    assert response_invalida.status_code == 400
+
+# GET - Filtros por faixa, listas IN e ordenação
+@patch("utils.connect_db")
+def test_get_imoveis_filtros_faixa_e_lista(mock_connect_db, client):
+    """Testa que filtros repetidos viram IN e que _min/_max viram faixas, todos parametrizados"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (3, 'Avenida Braz Leme, 1981', 'Avenida', 'Santana', 'São Paulo', '02022-010', 'Apartamento', 1800000.0, '2014-10-27')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_invalida = client.get('/imoveis?valor_min=muito')
+    response = client.get('/imoveis?cidade=São Paulo&cidade=Rio de Janeiro&bairro=Santana'
+                          '&valor_min=1000000&valor_max=2000000&data_aquisicao_min=2010-01-01')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert [imovel['id'] for imovel in response.get_json()['imoveis']] == [3]
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis "
+        "WHERE cidade IN (%s, %s) AND bairro = %s AND valor >= %s AND valor <= %s AND data_aquisicao >= %s",
+        ("São Paulo", "Rio de Janeiro", "Santana", 1000000.0, 2000000.0, "2010-01-01")
+    )
+    assert response_invalida.status_code == 400
+
+@patch("utils.connect_db")
+def test_get_imoveis_ordenado_por_valor(mock_connect_db, client):
+    """Testa sort=-valor com paginação por chave composta (valor, id) e o cursor repassado nos links"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (7, 'Rua Inhambu, 97 ', 'Rua', 'Moema', 'São Paulo', '04520-010', 'Apartamento', 7000000.0, '2022-06-02'),
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
+        (3, 'Avenida Braz Leme, 1981', 'Avenida', 'Santana', 'São Paulo', '02022-010', 'Apartamento', 1800000.0, '2014-10-27')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_sem_chave = client.get('/imoveis?sort=-valor&limit=2&after_id=9')
+    response_invalida = client.get('/imoveis?sort=logradouro')
+    response = client.get('/imoveis?sort=-valor&limit=2&after_id=9&after_key=15000000')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [imovel['id'] for imovel in response_data['imoveis']] == [7, 1]
+    assert response_data['_links']['next'] == '/imoveis?sort=-valor&limit=2&after_id=1&after_key=5000000.0'
+    assert response_data['_links']['prev'] == '/imoveis?sort=-valor&limit=2&before_id=7&before_key=7000000.0'
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis "
+        "WHERE (valor < %s OR (valor = %s AND id < %s)) ORDER BY valor DESC, id DESC LIMIT %s",
+        (15000000.0, 15000000.0, 9, 3)
+    )
+    assert response_sem_chave.status_code == 400
+    assert response_invalida.status_code == 400
+
+@patch("utils.connect_db")
+def test_server_timing_e_metricas(mock_connect_db, client):
+    """Testa o cabeçalho Server-Timing por requisição e os contadores expostos em /metrics"""
+
+    # GIVEN/GEGEBEN
+    metricas.registro.limpar()
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = (3, None)
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis?limit=1')
+    response_metricas = client.get('/metrics')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    server_timing = response.headers['Server-Timing']
+    assert 'consulta;dur=' in server_timing
+    assert 'json;dur=' in server_timing
+    assert 'db;desc="conexoes=1 consultas=2"' in server_timing
+    assert 'total;dur=' in server_timing
+    assert response_metricas.status_code == 200
+    assert response_metricas.mimetype == 'text/plain'
+    texto = response_metricas.get_data(as_text=True)
+    assert 'imoveis_consultas_total 2' in texto
+    assert 'imoveis_requisicoes_total{metodo="GET",rota="/imoveis",status="200"} 1' in texto
+    assert 'imoveis_fase_segundos_count{fase="mapeamento"} 1' in texto
+    assert 'imoveis_pool_ociosas 1' in texto
+
+def test_provedor_json_igual_ao_padrao():
+    """Testa que o ProvedorJSON (orjson, quando instalado) produz os mesmos bytes do json padrão do Flask"""
+
+    # GIVEN/GEGEBEN
+    padrao = DefaultJSONProvider(app)
+    dados = {
+        'imoveis': [utils.adiciona_hateoas_link(
+            {'id': 7, 'logradouro': 'Rua Inhambu, 97 ', 'cidade': 'São Paulo', 'tipo': 'Apartamento',
+             'valor': 7000000.0, 'data_aquisicao': '2022-06-02', 'bairro': 'Moema ✓ 😀\x7f\n'}
+        )],
+        'atualizado_em': datetime(2025, 10, 1, 12, 30, 15),
+        'preco': Decimal('10.50'),
+        '_links': {'self': '/imoveis', 'create': '/imoveis'}
+    }
+
+    # WHEN/WANN
+    with app.app_context():
+        response = app.json.response(dados)
+        esperado = padrao.response(dados)
+
+    # THEN/DANN
+    assert response.get_data() == esperado.get_data()
+    assert app.json.dumps(dados['imoveis'][0], separators=(',', ':')) == padrao.dumps(dados['imoveis'][0], separators=(',', ':'))
+    assert app.json.dumps(dados, indent=4) == padrao.dumps(dados, indent=4)
+    assert app.json.dumps({1: 'a', 2: 2 ** 70}) == padrao.dumps({1: 'a', 2: 2 ** 70})
+    assert app.json.dumps({'a': [1, 2]}) == padrao.dumps({'a': [1, 2]}) == '{"a": [1, 2]}'
+    floats = {'grande': 1e16, 'pequeno': 1e-05, 'infinito': float('inf'), 'nan': float('nan'), 'normal': [0.0, -2.5, 1e15]}
+    with app.app_context():
+        assert app.json.response(floats).get_data() == padrao.response(floats).get_data()
+    assert app.json.dumps(floats, separators=(',', ':')) == padrao.dumps(floats, separators=(',', ':'))
+    assert serializacao._floats_compativeis({'normal': [0.0, -2.5, 1e15, 0.0001]})
+    assert not serializacao._floats_compativeis({'lista': [(1.0, 1e16)]})
+    assert not serializacao._floats_compativeis([1e-05])
+    assert not serializacao._floats_compativeis({'x': float('nan')})
+
+@patch("compressao.TAMANHO_MIN", 100)
+@patch("compressao.comprimir", wraps=compressao.comprimir)
+@patch("utils.connect_db")
+def test_get_imoveis_comprimido(mock_connect_db, mock_comprimir, client, cache_ligado):
+    """Testa a compressão negociada por Accept-Encoding e o reaproveitamento dos bytes comprimidos em cache"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = (3, None)
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
+        (2, 'Avenida Brigadeiro Faria Lima, 1811', 'Avenida', 'Jardim Paulistano', 'São Paulo', '01452-001', 'Apartamento', 2500000.0, '2020-03-15')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_identidade = client.get('/imoveis')
+    response = client.get('/imoveis', headers={'Accept-Encoding': 'gzip'})
+    response_repetida = client.get('/imoveis', headers={'Accept-Encoding': 'gzip'})
+    response_nao_modificada = client.get('/imoveis', headers={'Accept-Encoding': 'gzip', 'If-None-Match': 'W/"v3"'})
+
+    # THEN/DANN
+    assert 'Content-Encoding' not in response_identidade.headers
+    assert 'Accept-Encoding' in response_identidade.headers['Vary']
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == 'W/"v3"'
+    assert gzip.decompress(response.get_data()) == response_identidade.get_data()
+    assert response_repetida.get_data() == response.get_data()
+    assert mock_comprimir.call_count == 1
+    assert response_nao_modificada.status_code == 304
+
+@patch("utils.connect_db")
+def test_get_estatisticas_por_cidade(mock_connect_db, client):
+    """Testa /imoveis/stats: agregados calculados no banco por grupo, com os filtros da listagem"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = [('cidade',), ('ano',), ('count',), ('avg',), ('p90',)]
+    mock_cursor.fetchall.return_value = [
+        ('Rio de Janeiro', '1974', 1, 5000000.0, 5000000.0),
+        ('São Paulo', '2014', 2, Decimal('1900000.5'), 2000000.0)
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_invalida = client.get('/imoveis/stats?group_by=logradouro')
+    response_percentil_invalido = client.get('/imoveis/stats?metrics=p100')
+    response = client.get('/imoveis/stats?group_by=cidade,ano&metrics=count,avg,p90&tipo=Casa&tipo=Apartamento')
+
+    # THEN/DANN
+    assert response_invalida.status_code == 400
+    assert response_percentil_invalido.status_code == 400
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data['grupos'] == [
+        {'cidade': 'Rio de Janeiro', 'ano': 1974, 'count': 1, 'avg': 5000000.0, 'p90': 5000000.0},
+        {'cidade': 'São Paulo', 'ano': 2014, 'count': 2, 'avg': 1900000.5, 'p90': 2000000.0}
+    ]
+    assert response_data['_links']['imoveis'] == '/imoveis?tipo=Casa&tipo=Apartamento'
+    mock_cursor.execute.assert_called_with(
+        "SELECT cidade, ano, COUNT(*) AS count, AVG(valor) AS avg, "
+        "MIN(CASE WHEN posicao >= CEIL(total * 90 / 100) THEN valor END) AS p90 "
+        "FROM (SELECT cidade, LEFT(data_aquisicao, 4) AS ano, valor, "
+        "ROW_NUMBER() OVER (PARTITION BY cidade, LEFT(data_aquisicao, 4) ORDER BY valor IS NULL, valor) AS posicao, "
+        "COUNT(valor) OVER (PARTITION BY cidade, LEFT(data_aquisicao, 4)) AS total "
+        "FROM imoveis WHERE tipo IN (%s, %s)) AS valores GROUP BY cidade, ano ORDER BY cidade, ano",
+        ('Casa', 'Apartamento')
+    )
+
+@patch("utils.connect_db")
+def test_busca_imoveis_por_prefixo(mock_connect_db, client):
+    """Testa /imoveis/search: cada palavra vira prefixo obrigatório no MATCH, com paginação por offset"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
+        (4, 'Rua Nascimento Silva, 200', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-000', 'Casa', 3000000.0, '1990-05-10')
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_sem_texto = client.get('/imoveis/search?q=+*')
+    response = client.get('/imoveis/search?q=nasc+"silva-&tipo=Casa&limit=1&offset=2')
+
+    # THEN/DANN
+    assert response_sem_texto.status_code == 400
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert [imovel['id'] for imovel in response_data['imoveis']] == [1]
+    assert response_data['_links']['next'] == '/imoveis/search?q=nasc+%22silva-&tipo=Casa&limit=1&offset=3'
+    assert response_data['_links']['prev'] == '/imoveis/search?q=nasc+%22silva-&tipo=Casa&limit=1&offset=1'
+    mock_cursor.execute.assert_called_with(
+        "SELECT id, logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao FROM imoveis "
+        "WHERE MATCH(logradouro, bairro, cidade) AGAINST(%s IN BOOLEAN MODE) AND tipo = %s "
+        "ORDER BY MATCH(logradouro, bairro, cidade) AGAINST(%s IN BOOLEAN MODE) DESC, id LIMIT %s OFFSET %s",
+        ('+nasc* +silva*', 'Casa', '+nasc* +silva*', 2, 2)
+    )
+
+@patch("utils.connect_db")
+def test_get_imoveis_por_cep_e_proximidade(mock_connect_db, client):
+    """Testa cep_prefix (faixa em cep_num) e near=/radius= (retângulo no índice espacial + distância)"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = [('id',), ('tipo',), ('cidade',), ('latitude',), ('longitude',)]
+    mock_cursor.fetchall.return_value = [(2, 'Apartamento', 'São Paulo', -23.5789, -46.6851)]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_cep_invalido = client.get('/imoveis?cep_prefix=01a')
+    response_raio_invalido = client.get('/imoveis?near=-23.57,-46.68&radius=0')
+    response = client.get('/imoveis?cep_prefix=01452&near=-23.578,-46.685&radius=2000&fields=latitude,longitude&limit=5')
+
+    # THEN/DANN
+    assert response_cep_invalido.status_code == 400
+    assert response_raio_invalido.status_code == 400
+    assert response.status_code == 200
+    assert response.get_json()['imoveis'][0]['latitude'] == -23.5789
+    sql, params = mock_cursor.execute.call_args.args
+    assert sql == (
+        "SELECT id, cidade, tipo, latitude, longitude FROM imoveis WHERE cep_num >= %s AND cep_num <= %s "
+        "AND latitude IS NOT NULL AND MBRContains(ST_GeomFromText(%s, 4326), localizacao) "
+        "AND ST_Distance_Sphere(localizacao, ST_GeomFromText(%s, 4326)) <= %s ORDER BY id LIMIT %s"
+    )
+    assert params[:2] == (1452000, 1452999)
+    assert params[2].startswith('POLYGON((-23.59')
+    assert params[3:] == ('POINT(-23.578 -46.685)', 2000.0, 6)
+
+def test_localizacao_com_longitude_alem_de_90():
+    """Testa se a coluna localizacao monta o ponto como o MySQL lê no SRID 4326 (x = longitude, y = latitude)
+
+    Sem banco nos testes, a expressão da coluna é lida do imoveis.sql e das
+    migrações e avaliada para um imóvel em Tóquio, cuja longitude passa de 90.
+    """
+
+    # GIVEN/GEGEBEN
+    imovel = {'latitude': 35.6812, 'longitude': 139.7671}
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    arquivos = ('imoveis.sql', 'migracoes/004_cep_e_coordenadas.sql', 'migracoes/007_localizacao_longitude_latitude.sql')
+
+    # WHEN/WANN
+    pontos = []
+    for arquivo in arquivos:
+        with open(os.path.join(raiz, arquivo), encoding='utf-8') as sql:
+            eixos = re.search(r'localizacao POINT SRID 4326 AS \(\s*ST_SRID\(POINT\(COALESCE\((\w+), 0\), COALESCE\((\w+), 0\)\), 4326\)\)',
+                              sql.read())
+        pontos.append((imovel[eixos.group(1)], imovel[eixos.group(2)]))
+    condicoes, params = utils._condicoes_filtros({'near': (35.6812, 139.7671, 1000.0)})
+
+    # THEN/DANN
+    for x, y in pontos:
+        assert -180 <= x <= 180 and -90 <= y <= 90
+        assert (x, y) == (139.7671, 35.6812)
+    # Na consulta, o WKT com SRID 4326 segue a ordem do EPSG (latitude longitude)
+    assert params[1] == 'POINT(35.6812 139.7671)'
+
+@patch("utils.connect_db")
+def test_preencher_coordenadas_grava_como_as_escritas_da_api(mock_connect_db):
+    """Testa se o preenchimento de coordenadas incrementa a versão do imóvel e o contador, grava o log e invalida o cache"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS + [('versao',)]
+    gravadas = [(3, 'Rua Alvorada, 1289', 'Rua', 'Vila Olímpia', 'São Paulo', '04550-004', 'Apartamento', 1000000.0, None, 2),
+                (4, 'Rua Alvorada, 1300', 'Rua', 'Vila Olímpia', 'São Paulo', '04550-004', 'Casa', 900000.0, None, 5)]
+    mock_cursor.fetchall.side_effect = [[(3, 'São Paulo', 'Apartamento', 1452000), (4, 'São Paulo', 'Casa', 1452000)],
+                                        gravadas]
+    mock_connect_db.return_value = mock_conn
+    utils.pool.fechar()
+
+    # WHEN/WANN
+    with patch.object(utils.cache_imoveis, 'invalidar') as invalidar, \
+            patch.object(utils.instantaneo_imoveis, 'ativo', True), \
+            patch.object(utils.instantaneo_imoveis, 'registrar') as registrar:
+        alterados = preencher_coordenadas.preencher({1452000: (-23.578, -46.685)})
+    utils.pool.fechar()
+
+    # THEN/DANN
+    assert alterados == 2
+    update = mock_cursor.executemany.call_args
+    assert 'versao = versao + 1' in update.args[0]
+    assert update.args[1] == [(-23.578, -46.685, 1452000)]
+    comandos = [chamada.args for chamada in mock_cursor.execute.call_args_list]
+    assert comandos[1][0].endswith('versao FROM imoveis WHERE id IN (%s, %s)') and comandos[1][1] == (3, 4)
+    assert comandos[2][0].startswith('UPDATE imoveis_controle')
+    assert comandos[3][0].startswith('INSERT INTO imoveis_alteracoes')
+    assert comandos[3][1] == (3, 'atualizado', 4, 'atualizado')
+    mock_conn.commit.assert_called_once()
+    # O instantâneo recebe as linhas inteiras, com a versão nova
+    atualizados = registrar.call_args.kwargs['atualizados']
+    assert sorted(atualizados) == [3, 4] and atualizados[4]['versao'] == 5 and atualizados[3]['tipo'] == 'Apartamento'
+    assert ('id', 3) in invalidar.call_args.args[0] and utils.TAG_VERSAO in invalidar.call_args.args[0]
+
+@patch("carregador.connect_db")
+def test_carregador_insere_em_lotes_e_recria_indices(mock_connect_db):
+    """Testa a carga em lotes: índices removidos antes, INSERT de várias linhas por lote e índices recriados"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.fetchone.side_effect = [TABELA_COM_INDICES, (0,), (2,)]
+    mock_connect_db.return_value = mock_conn
+    linhas = list(carregador.gerar_sinteticos(3, semente=1))
+
+    # WHEN/WANN
+    total, _ = carregador.carregar(iter(linhas), tamanho_lote=2, saida=io.StringIO())
+
+    # THEN/DANN
+    assert total == 3
+    assert list(carregador.gerar_sinteticos(3, semente=1)) == linhas
+    chamadas = mock_cursor.execute.call_args_list
+    comandos = [chamada.args[0] for chamada in chamadas]
+    assert comandos[1] == "ALTER TABLE imoveis DROP INDEX `idx_valor`, DROP INDEX `ft_endereco`"
+    assert comandos[3].count('(%s, %s, %s, %s, %s, %s, %s, %s)') == 2
+    assert comandos[7].count('(%s, %s, %s, %s, %s, %s, %s, %s)') == 1
+    assert chamadas[7].args[1] == linhas[2]
+    # Cada lote entra no log de alterações, depois do contador de versão e antes do seu commit
+    assert comandos[4].startswith('UPDATE imoveis_controle') and comandos[8].startswith('UPDATE imoveis_controle')
+    assert comandos[5].startswith('INSERT INTO imoveis_alteracoes') and chamadas[5].args[1] == (0,)
+    assert comandos[9].startswith('INSERT INTO imoveis_alteracoes') and chamadas[9].args[1] == (2,)
+    assert comandos[-1] == ("ALTER TABLE imoveis ADD KEY `idx_valor` (`valor`), "
+                            "ADD FULLTEXT KEY `ft_endereco` (`logradouro`,`bairro`,`cidade`)")
+    assert mock_conn.commit.call_count == 2
+    mock_conn.close.assert_called_once()
+
+@patch("carregador.connect_db")
+def test_carregador_falha_mantem_o_erro_da_carga(mock_connect_db):
+    """Testa se, com a carga e a recriação dos índices falhando, o lote é desfeito antes do ALTER TABLE e o erro levantado é o da carga"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.fetchone.side_effect = [TABELA_COM_INDICES, (0,)]
+    ordem = []
+    mock_conn.rollback.side_effect = lambda: ordem.append('rollback')
+
+    def executar(sql, params=None):
+        if sql.startswith('INSERT INTO imoveis ('):
+            raise ValueError('linha recusada')
+        if sql.startswith('ALTER TABLE imoveis ADD'):
+            ordem.append('alter')
+            raise OSError('conexão perdida')
+    mock_cursor.execute.side_effect = executar
+    mock_connect_db.return_value = mock_conn
+    saida = io.StringIO()
+
+    # WHEN/WANN
+    with pytest.raises(ValueError, match='linha recusada'):
+        carregador.carregar(iter(carregador.gerar_sinteticos(2, semente=1)), saida=saida)
+
+    # THEN/DANN
+    assert ordem == ['rollback', 'alter']
+    assert 'Falha ao recriar os índices (conexão perdida)' in saida.getvalue()
+    assert 'KEY `idx_valor` (`valor`)' in saida.getvalue()
+    mock_conn.commit.assert_not_called()
+    mock_conn.close.assert_called_once()
+
+@patch("utils.connect_db")
+def test_leituras_nas_replicas_com_failover(mock_connect_db, client):
+    """Testa o roteamento: GET em réplica (pulando a que falha), escrita e leitura após escrita no primário"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchall.return_value = [
+        (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    ]
+    mock_cursor.lastrowid = 7
+
+    def conectar(**opcoes):
+        if opcoes.get('host') == 'replica-1':
+            raise ErroConexao('Erro: réplica fora do ar')
+        return mock_conn
+    mock_connect_db.side_effect = conectar
+    classe_pool = PoolConexoes if client.pool is utils.pool else type(client.pool)
+    replicas = [classe_pool(opcoes={'host': host, 'port': 3306}) for host in ('replica-1', 'replica-2')]
+    roteador = RoteadorReplicas(replicas, quarentena=60)
+    novo_imovel = {'logradouro': 'Rua Teste, 1', 'tipo_logradouro': 'Rua', 'bairro': 'Centro', 'cidade': 'Rio de Janeiro',
+                   'cep': '20000-000', 'tipo': 'Casa', 'valor': 100000.0, 'data_aquisicao': '2024-01-01'}
+
+    with patch('utils.roteador', roteador), patch('utils_async.roteador', roteador), \
+            patch('utils._ultima_escrita', float('-inf')), patch.dict(utils.config_replicas, {'replicas': ['replica']}):
+        # WHEN/WANN
+        response_replica = client.get('/imoveis')
+        hosts_leitura = [chamada.kwargs.get('host') for chamada in mock_connect_db.call_args_list]
+        mock_connect_db.reset_mock()
+        response_primario = client.get('/imoveis', headers={'X-Consistencia': 'primario'})
+        response_escrita = client.post('/imoveis', json=novo_imovel)
+        hosts_primario = [chamada.kwargs.get('host') for chamada in mock_connect_db.call_args_list]
+        estatisticas = roteador.estatisticas()
+
+    # THEN/DANN
+    assert response_replica.status_code == 200
+    assert hosts_leitura == ['replica-1', 'replica-2']
+    assert estatisticas == {'total': 2, 'suspensas': 1, 'falhas': 1}
+    assert response_primario.status_code == 200
+    assert response_escrita.status_code == 201
+    assert set(hosts_primario) == {None}
+    assert response_escrita.headers['Set-Cookie'].startswith('imoveis_primario=1;')
+    assert 'Max-Age=5' in response_escrita.headers['Set-Cookie']
+    assert 'imoveis_primario' not in response_replica.headers.get('Set-Cookie', '')
+    assert [replica.estatisticas()['em_uso'] for replica in replicas] == [0, 0]
+
+@patch("utils.connect_db")
+def test_prepared_statements_reaproveitados(mock_connect_db, client):
+    """Testa que cada texto SQL é preparado uma vez por conexão e reexecutado só com novos parâmetros"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = None
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_1 = client.get('/imoveis/1')
+    response_2 = client.get('/imoveis/2')
+
+    # THEN/DANN
+    assert response_1.status_code == response_2.status_code == 404
+    # Um prepared statement para a versão da tabela e outro para o imóvel
+    preparados = [chamada for chamada in mock_conn.cursor.call_args_list if chamada.kwargs == {'prepared': True}]
+    assert len(preparados) == 2
+    execucoes = [chamada for chamada in mock_cursor.execute.call_args_list if 'FROM imoveis WHERE' in chamada.args[0]]
+    assert [chamada.args[1:] for chamada in execucoes] == [((1,),), ((2,),)]
+    # O mesmo objeto str a cada execução: o conector não envia um novo PREPARE
+    assert execucoes[0].args[0] is execucoes[1].args[0]
+    mock_cursor.close.assert_not_called()
+
+@patch("utils.connect_db")
+def test_listagem_pelo_instantaneo_colunar(mock_connect_db, client):
+    """Testa que a listagem sai do instantâneo em memória, acompanha as escritas e volta ao banco se ele fica velho"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    mock_cursor.fetchone.return_value = (5, datetime(2024, 1, 1))
+    mock_cursor.fetchall.return_value = []
+    mock_cursor.lastrowid = 9
+    mock_connect_db.return_value = mock_conn
+
+    def carregar(instantaneo):
+        instantaneo.versao = 5
+        instantaneo.adicionar([
+            (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25'),
+            (3, 'Avenida Braz Leme, 1981', 'Avenida', 'Santana', 'São Paulo', '02022-010', 'Apartamento', 1800000.0, '2014-10-27'),
+            (4, 'Rua Augusta, 500', 'Rua', 'Consolação', 'Sao Paulo', '01305-000', 'Casa', None, None)
+        ])
+
+    novo_imovel = {'logradouro': 'Rua Teste, 1', 'tipo_logradouro': 'Rua', 'bairro': 'Centro', 'cidade': 'São Paulo',
+                   'cep': '01000-000', 'tipo': 'Casa', 'valor': 100000.0, 'data_aquisicao': '2024-01-01'}
+    instantaneo = utils.instantaneo_imoveis
+    with patch.object(instantaneo, 'ativo', True), patch.object(instantaneo, '_carregar', carregar), \
+            patch.object(instantaneo, '_atual', None), patch.object(instantaneo, '_versao_vista', -1):
+        instantaneo.recarregar()
+
+        # WHEN/WANN
+        response_cidade = client.get('/imoveis?cidade=sao paulo&limit=10')
+        response_faixa = client.get('/imoveis?valor_min=1000000&limit=1&after_id=1')
+        consultas_banco = [chamada.args[0] for chamada in mock_cursor.execute.call_args_list]
+        response_escrita = client.post('/imoveis', json=novo_imovel)
+        mock_cursor.fetchone.return_value = (6, datetime(2024, 1, 2))
+        response_depois = client.get('/imoveis?cidade=São Paulo&tipo=casa&limit=10')
+        estatisticas = instantaneo.estatisticas()
+        # Outro processo alterou a tabela: a listagem vai ao banco até a recarga
+        mock_cursor.fetchone.return_value = (8, datetime(2024, 1, 3))
+        with patch.object(instantaneo, '_agendar_recarga') as mock_agendar:
+            mock_cursor.execute.reset_mock()
+            response_velho = client.get('/imoveis?cidade=sao paulo&limit=10')
+
+    # THEN/DANN
+    assert response_cidade.status_code == 200
+    assert [imovel['id'] for imovel in response_cidade.get_json()['imoveis']] == [3, 4]
+    assert response_cidade.get_json()['imoveis'][1]['valor'] is None
+    assert [imovel['id'] for imovel in response_faixa.get_json()['imoveis']] == [3]
+    assert all('FROM imoveis_controle' in sql for sql in consultas_banco)
+    assert response_escrita.status_code == 201
+    assert [imovel['id'] for imovel in response_depois.get_json()['imoveis']] == [4, 9]
+    assert estatisticas['linhas'] == 4 and estatisticas['versao'] == 6
+    assert response_velho.status_code == 404
+    assert any('FROM imoveis WHERE cidade = %s' in chamada.args[0] for chamada in mock_cursor.execute.call_args_list)
+    mock_agendar.assert_called_once()
+
+@patch("utils.connect_db")
+def test_instantaneo_aplica_escritas_pela_versao_da_linha(mock_connect_db, client):
+    """Testa que escritas registradas fora da ordem dos commits deixam no instantâneo a linha mais nova"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.fetchone.return_value = (7, datetime(2024, 1, 1))
+    mock_connect_db.return_value = mock_conn
+
+    def carregar(instantaneo):
+        instantaneo.versao = 5
+        instantaneo.adicionar([
+            (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25', 3),
+            (2, 'Rua Augusta, 500', 'Rua', 'Consolação', 'São Paulo', '01305-000', 'Casa', 700000.0, None, 1)
+        ])
+
+    linha = {'id': 2, 'logradouro': 'Rua Augusta, 500', 'tipo_logradouro': 'Rua', 'bairro': 'Consolação',
+             'cidade': 'São Paulo', 'cep': '01305-000', 'tipo': 'Casa', 'data_aquisicao': None}
+    instantaneo = utils.instantaneo_imoveis
+    with patch.object(instantaneo, 'ativo', True), patch.object(instantaneo, '_carregar', carregar), \
+            patch.object(instantaneo, '_atual', None), patch.object(instantaneo, '_versao_vista', -1):
+        instantaneo.recarregar()
+
+        # WHEN/WANN
+        # Dois commits no imóvel 2 (versões 2 e 3); a thread do segundo registra primeiro
+        instantaneo.registrar(atualizados={2: dict(linha, valor=900000.0, versao=3)})
+        instantaneo.registrar(atualizados={2: dict(linha, valor=800000.0, versao=2)})
+        response = client.get('/imoveis?cidade=sao paulo&limit=10')
+        estatisticas = instantaneo.estatisticas()
+        # Alteração de um id ainda não incluído: o instantâneo é descartado
+        instantaneo.registrar(atualizados={3: dict(linha, id=3, valor=1.0, versao=2)})
+        descartado = instantaneo._atual is None
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert [imovel['valor'] for imovel in response.get_json()['imoveis']] == [900000.0]
+    assert estatisticas['versao'] == 7
+    assert descartado
+
+@patch("utils.connect_db")
+def test_fila_de_escritas_com_commit_em_grupo(mock_connect_db, client):
+    """Testa o commit em grupo das escritas simultâneas, o isolamento da que falha e o 429 com a fila cheia"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    ids_gerados = iter(range(7, 100))
+    type(mock_cursor).lastrowid = PropertyMock(side_effect=lambda: next(ids_gerados))
+    mock_cursor.rowcount = 1
+
+    def executar(sql, params=None):
+        if params and 'Rua Inválida' in params:
+            raise Error('Erro: valor recusado')
+    mock_cursor.execute.side_effect = executar
+    mock_connect_db.return_value = mock_conn
+    imovel = {'logradouro': 'Rua Teste, 1', 'tipo_logradouro': 'Rua', 'bairro': 'Centro', 'cidade': 'Rio de Janeiro',
+              'cep': '20000-000', 'tipo': 'Casa', 'valor': 100000.0, 'data_aquisicao': '2024-01-01'}
+    invalido = dict(imovel, logradouro='Rua Inválida')
+
+    def enviar_juntos(fila, chamadas):
+        resultados = [None] * len(chamadas)
+
+        def enviar(indice, funcao, *argumentos):
+            try:
+                resultados[indice] = funcao(*argumentos)
+            except Error as erro:
+                resultados[indice] = erro
+        threads = [threading.Thread(target=enviar, args=(indice,) + chamada) for indice, chamada in enumerate(chamadas)]
+        with patch('utils.fila_escritas', fila):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        return resultados
+
+    # WHEN/WANN
+    fila = FilaEscrita(utils._gravar_escritas, lote_max=3, intervalo=5, ativa=True, sem_repetir=(ErroConexao,))
+    resultados = enviar_juntos(fila, [(utils.adicionar_imovel_db, imovel), (utils.adicionar_imovel_db, imovel),
+                                      (utils.remover_imovel_db, 3)])
+    commits_grupo = mock_conn.commit.call_count
+    mock_conn.commit.reset_mock()
+    fila_com_erro = FilaEscrita(utils._gravar_escritas, lote_max=2, intervalo=5, ativa=True, sem_repetir=(ErroConexao,))
+    resultados_com_erro = enviar_juntos(fila_com_erro, [(utils.adicionar_imovel_db, invalido),
+                                                        (utils.atualizar_imovel_db, 5, imovel)])
+    fila_cheia = FilaEscrita(utils._gravar_escritas, tamanho_max=1, ativa=True)
+    with patch('utils.fila_escritas', fila_cheia), patch.object(fila_cheia, '_iniciar'):
+        fila_cheia._fila.put_nowait(None)  # sem a thread de gravação, o pedido anterior ocupa a fila
+        response_cheia = client.post('/imoveis', json=imovel)
+
+    # THEN/DANN
+    assert sorted(resultados[:2]) == [7, 8]
+    assert resultados[2] == 1
+    assert commits_grupo == 1
+    assert fila.estatisticas() == {'pendentes': 0, 'lotes': 1, 'escritas': 3, 'rejeitadas': 0, 'maior_lote': 3}
+    assert isinstance(resultados_com_erro[0], Error)
+    assert resultados_com_erro[1] == 1
+    assert mock_conn.commit.call_count == 1  # só a escrita válida, gravada sozinha depois do lote desfeito
+    assert response_cheia.status_code == 429
+    assert response_cheia.headers['Retry-After'] == '1'
+    assert fila_cheia.estatisticas()['rejeitadas'] == 1
+
+@patch("utils.connect_db")
+def test_fila_de_escritas_isola_item_malformado(mock_connect_db, client):
+    """Testa que um corpo malformado no lote não derruba as escritas válidas do mesmo commit em grupo (e que a API o recusa antes)"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    ids_gerados = iter(range(7, 100))
+    type(mock_cursor).lastrowid = PropertyMock(side_effect=lambda: next(ids_gerados))
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+    imovel = {'logradouro': 'Rua Teste, 1', 'tipo_logradouro': 'Rua', 'bairro': 'Centro', 'cidade': 'Rio de Janeiro',
+              'cep': '20000-000', 'tipo': 'Casa', 'valor': 100000.0, 'data_aquisicao': '2024-01-01'}
+    sem_cidade = {campo: valor for campo, valor in imovel.items() if campo != 'cidade'}
+    fila = FilaEscrita(utils._gravar_escritas, lote_max=3, intervalo=5, ativa=True, sem_repetir=(ErroConexao,))
+    resultados = [None] * 3
+
+    def enviar(indice, funcao, *argumentos):
+        try:
+            resultados[indice] = funcao(*argumentos)
+        except Exception as erro:
+            resultados[indice] = erro
+
+    # WHEN/WANN
+    chamadas = [(utils.adicionar_imovel_db, imovel), (utils.adicionar_imovel_db, sem_cidade), (utils.atualizar_imovel_db, 5, imovel)]
+    threads = [threading.Thread(target=enviar, args=(indice,) + chamada) for indice, chamada in enumerate(chamadas)]
+    with patch('utils.fila_escritas', fila):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+    response_sem_campo = client.post('/imoveis', json=sem_cidade)
+    response_nao_objeto = client.put('/imoveis/5', json=[1, 2])
+
+    # THEN/DANN
+    assert isinstance(resultados[0], int)
+    assert isinstance(resultados[1], KeyError)
+    assert resultados[2] == 1
+    assert fila.estatisticas()['lotes'] == 1
+    assert response_sem_campo.status_code == 400
+    assert 'cidade' in response_sem_campo.get_json()['erro']
+    assert response_nao_objeto.status_code == 400
+
+def test_fila_de_escritas_mantem_ordem_com_operacao_em_lote():
+    """Testa que a operação em lote roda na thread da fila, sozinha, entre as escritas que chegaram antes e depois dela"""
+
+    # GIVEN/GEGEBEN
+    ordem = []
+    gravando, liberar = threading.Event(), threading.Event()
+
+    def executar(operacoes):
+        if operacoes == ['primeira']:
+            gravando.set()
+            liberar.wait(5)
+        ordem.append(list(operacoes))
+        return operacoes
+
+    fila = FilaEscrita(executar, lote_max=10, intervalo=0, ativa=True)
+    threads = [threading.Thread(target=fila.enviar, args=('primeira',))]
+    threads[0].start()
+    gravando.wait(5)
+
+    # WHEN/WANN
+    for alvo, argumento in ((fila.enviar, 'antes'), (fila.enviar_grupo, lambda: ordem.append('bulk') or 'ok'),
+                            (fila.enviar, 'depois')):
+        thread = threading.Thread(target=alvo, args=(argumento,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)
+    liberar.set()
+    for thread in threads:
+        thread.join(5)
+
+    # THEN/DANN
+    assert ordem == [['primeira'], ['antes'], 'bulk', ['depois']]
+    with patch('utils.fila_escritas', fila), patch('utils._remover_imoveis', return_value={3}) as remover:
+        assert utils.remover_imoveis_db([3]) == {3}
+    remover.assert_called_once_with([3], None)
+
+@patch("utils.connect_db")
+def test_patch_grava_so_colunas_enviadas_com_if_match(mock_connect_db, client):
+    """Testa o PATCH /imoveis/<id>: UPDATE parcial com a versão esperada, imóvel gravado na resposta e 412/404"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS + [('versao',)]
+    gravado = (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5500000.0, '1974-01-25')
+    mock_cursor.fetchone.return_value = gravado + (4,)
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.patch('/imoveis/1', json={'valor': 5500000.0, 'id': 99}, headers={'If-Match': '"3"'})
+    update, select = mock_cursor.execute.call_args_list[:2]
+    mock_cursor.rowcount = 0
+    mock_cursor.fetchone.return_value = gravado + (5,)
+    response_conflito = client.patch('/imoveis/1', json={'valor': 1.0, 'versao': 3})
+    mock_cursor.fetchone.return_value = None
+    response_inexistente = client.patch('/imoveis/2', json={'valor': 1.0})
+    response_sem_campos = client.patch('/imoveis/1', json={'preco': 1.0})
+    response_if_match_invalido = client.patch('/imoveis/1', json={'valor': 1.0}, headers={'If-Match': '"v12"'})
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert update.args == ("UPDATE imoveis SET valor = %s, versao = versao + 1 WHERE id = %s AND versao = %s", (5500000.0, 1, 3))
+    assert select.args == (f"SELECT {', '.join(utils.COLUNAS_IMOVEL)}, versao FROM imoveis WHERE id = %s", (1,))
+    corpo = response.get_json()
+    assert corpo['valor'] == 5500000.0 and corpo['versao'] == 4 and corpo['_links']['self'] == '/imoveis/1'
+    assert response.headers['ETag'] == '"4"'
+    assert response_conflito.status_code == 412
+    assert response_conflito.get_json()['versao'] == 5
+    assert response_inexistente.status_code == 404
+    assert response_sem_campos.status_code == 400
+    assert response_if_match_invalido.status_code == 412
+
+@patch("utils.connect_db")
+def test_patch_com_if_match_do_etag_do_get(mock_connect_db, client):
+    """Testa o fluxo GET -> PATCH: o ETag do GET /imoveis/<id> (forte ou fraco) é aceito no If-Match"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS + [('versao',)]
+    linha = (1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')
+    mock_cursor.fetchone.return_value = linha + (3,)
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    etag = client.get('/imoveis/1').headers['ETag']
+    mock_cursor.fetchone.return_value = linha + (4,)
+    mock_cursor.execute.reset_mock()
+    response = client.patch('/imoveis/1', json={'valor': 5500000.0}, headers={'If-Match': etag})
+    update = mock_cursor.execute.call_args_list[0]
+    mock_cursor.execute.reset_mock()
+    response_fraco = client.patch('/imoveis/1', json={'valor': 5600000.0}, headers={'If-Match': 'W/"4"'})
+    update_fraco = mock_cursor.execute.call_args_list[0]
+
+    # THEN/DANN
+    assert etag == '"3"'
+    assert response.status_code == 200
+    assert update.args[1] == (5500000.0, 1, 3)
+    assert response_fraco.status_code == 200
+    assert update_fraco.args[1] == (5600000.0, 1, 4)
+
+@patch("utils.connect_db")
+def test_log_de_alteracoes_paginado_e_sse(mock_connect_db, client):
+    """Testa o GET /imoveis/changes: página do log com o imóvel atual, 410 com log expirado, SSE e a entrada gravada no POST"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    em = datetime(2025, 3, 1, 12, 0, 0)
+    mock_cursor.fetchone.return_value = (1,)
+    mock_cursor.fetchall.return_value = [
+        (7, 1, 'atualizado', em, 1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5500000.0, '1974-01-25'),
+        (8, 2, 'removido', em) + (None,) * 9
+    ]
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response = client.get('/imoveis/changes?since=6&limit=2')
+    consulta = mock_cursor.execute.call_args_list[1]
+    response_invalida = client.get('/imoveis/changes?since=-1')
+    with patch('views.ALTERACOES_SSE_DURACAO', 0), patch('views.ALTERACOES_SSE_SYNC', True):
+        response_sse = client.get('/imoveis/changes', headers={'Accept': 'text/event-stream', 'Last-Event-ID': '6'})
+        eventos = response_sse.get_data(as_text=True)
+    mock_cursor.fetchone.return_value = (50,)
+    response_expirado = client.get('/imoveis/changes?since=6')
+
+    # THEN/DANN
+    assert response.status_code == 200
+    assert consulta.args[1] == (6, 2)
+    corpo = response.get_json()
+    assert [(item['seq'], item['id'], item['operacao']) for item in corpo['alteracoes']] == [(7, 1, 'atualizado'), (8, 2, 'removido')]
+    assert corpo['alteracoes'][0]['em'] == '2025-03-01T12:00:00'
+    assert corpo['alteracoes'][0]['imovel']['valor'] == 5500000.0
+    assert corpo['alteracoes'][0]['imovel']['_links']['self'] == '/imoveis/1'
+    assert corpo['alteracoes'][1]['imovel'] is None
+    assert corpo['ultimo_seq'] == 8 and corpo['mais'] is True
+    assert corpo['_links']['next'] == '/imoveis/changes?since=8&limit=2'
+    assert response_invalida.status_code == 400
+    assert response_sse.mimetype == 'text/event-stream'
+    assert 'id: 7\nevent: alteracao\n' in eventos and 'id: 8\nevent: alteracao\n' in eventos
+    assert response_expirado.status_code == 410
+    assert response_expirado.get_json()['primeiro_seq'] == 50
+
+@patch("utils.connect_db")
+def test_log_de_alteracoes_apagado_por_inteiro(mock_connect_db, client):
+    """Testa se, com o log vazio, since=0 recebe a lista vazia e um since já lido recebe 410 (as entradas foram todas apagadas)"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.fetchone.return_value = (None,)
+    mock_cursor.fetchall.return_value = []
+    mock_connect_db.return_value = mock_conn
+
+    # WHEN/WANN
+    response_inicio = client.get('/imoveis/changes?since=0')
+    response_apagado = client.get('/imoveis/changes?since=8')
+
+    # THEN/DANN
+    assert response_inicio.status_code == 200
+    assert response_inicio.get_json()['alteracoes'] == []
+    assert response_apagado.status_code == 410
+    assert response_apagado.get_json()['primeiro_seq'] is None
+
+@patch("utils.connect_db")
+def test_alteracoes_no_modo_sincrono_nao_prendem_a_thread(mock_connect_db):
+    """Testa se o api.py recusa o SSE (406, aponta para o api_async.py) e limita o wait do long-poll"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.fetchone.return_value = (1,)
+    mock_cursor.fetchall.return_value = []
+    mock_connect_db.return_value = mock_conn
+    utils.pool.fechar()
+
+    # WHEN/WANN
+    with app.test_client() as cliente_sync:
+        response_sse = cliente_sync.get('/imoveis/changes', headers={'Accept': 'text/event-stream'})
+        with patch('views.ALTERACOES_ESPERA_SYNC', 0.2):
+            inicio = time.monotonic()
+            response_espera = cliente_sync.get('/imoveis/changes?since=1&wait=30')
+            duracao = time.monotonic() - inicio
+    utils.pool.fechar()
+
+    # THEN/DANN
+    assert response_sse.status_code == 406
+    assert 'api_async.py' in response_sse.get_json()['erro']
+    assert response_espera.status_code == 200
+    assert response_espera.get_json()['alteracoes'] == []
+    assert duracao < 5
+
+@patch("utils.connect_db")
+def test_escrita_grava_entrada_no_log_de_alteracoes(mock_connect_db, client):
+    """Testa se o POST grava a entrada 'criado' do log na mesma transação, antes do commit"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.lastrowid = 11
+    mock_cursor.rowcount = 1
+    mock_connect_db.return_value = mock_conn
+    novo = {'logradouro': 'Rua Nova', 'tipo_logradouro': 'Rua', 'bairro': 'Centro', 'cidade': 'São Paulo',
+            'cep': '01000-000', 'tipo': 'apartamento', 'valor': 300000.0, 'data_aquisicao': '2024-01-01'}
+
+    # WHEN/WANN
+    response = client.post('/imoveis', json=novo)
+
+    # THEN/DANN
+    assert response.status_code == 201
+    log = [c for c in mock_cursor.execute.call_args_list if c.args[0].startswith('INSERT INTO imoveis_alteracoes')]
+    assert len(log) == 1
+    assert log[0].args[1] == (11, 'criado')
+    mock_conn.commit.assert_called_once()
+
+@patch("utils.connect_db")
+def test_listagens_identicas_simultaneas_fazem_uma_consulta(mock_connect_db, client):
+    """Testa a coalescência: listagens iguais em paralelo compartilham a consulta; após uma escrita ou após a espera máxima, não"""
+
+    # GIVEN/GEGEBEN
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_cursor.description = DESCRICAO_IMOVEIS
+    consultando, liberar = threading.Event(), threading.Event()
+
+    def fetchall():
+        consultando.set()
+        liberar.wait(5)
+        return [(1, 'Rua Nascimento Silva, 107', 'Rua', 'Ipanema', 'Rio de Janeiro', '22421-025', 'Casa', 5000000.0, '1974-01-25')]
+    mock_cursor.fetchall.side_effect = fetchall
+    mock_connect_db.return_value = mock_conn
+    coalescedor = Coalescedor(espera=5)
+    resultados = [None] * 4
+
+    def listar(indice):
+        resultados[indice] = utils.get_imoveis(cidade='Rio de Janeiro')
+
+    # WHEN/WANN
+    with patch('utils.coalescedor_imoveis', coalescedor):
+        threads = [threading.Thread(target=listar, args=(indice,)) for indice in range(4)]
+        threads[0].start()
+        consultando.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)  # as demais threads chegam enquanto a primeira consulta o banco
+        liberar.set()
+        for thread in threads:
+            thread.join(5)
+        consultas_em_paralelo = mock_cursor.execute.call_count
+        estatisticas = coalescedor.estatisticas()
+
+    chamadas = []
+
+    def consulta_lenta():
+        chamadas.append(1)
+        time.sleep(0.2)
+        return chamadas[:]
+    curto = Coalescedor(espera=0.05)
+    lentas = [threading.Thread(target=curto.executar, args=('chave', consulta_lenta)) for _ in range(2)]
+    for thread in lentas:
+        thread.start()
+    for thread in lentas:
+        thread.join(5)
+    apos_escrita = Coalescedor()
+    anteriores = apos_escrita.executar('chave', lambda: (apos_escrita.invalidar(), apos_escrita.executar('chave', lambda: 'novo'))[1])
+
+    async def listar_async(coalescedor_async):
+        async def consultar():
+            await asyncio.sleep(0.05)
+            return ['imovel']
+        return await asyncio.gather(*(coalescedor_async.executar_async('chave', consultar) for _ in range(3)))
+    coalescedor_async = Coalescedor()
+    resultados_async = asyncio.run(listar_async(coalescedor_async))
+    metricas_texto = client.get('/metrics').get_data(as_text=True)
+
+    # THEN/DANN
+    assert consultas_em_paralelo == 1
+    assert all(resultado[0]['cidade'] == 'Rio de Janeiro' for resultado in resultados)
+    assert resultados[0] is not resultados[1]  # cada requisição recebe a própria cópia para montar os links
+    assert estatisticas == {'em_andamento': 0, 'consultas': 1, 'coalescidas': 3, 'esgotadas': 0}
+    assert len(chamadas) == 2 and curto.estatisticas()['esgotadas'] == 1
+    assert anteriores == 'novo' and apos_escrita.estatisticas()['consultas'] == 2
+    assert resultados_async == [['imovel']] * 3
+    assert coalescedor_async.estatisticas()['coalescidas'] == 2
+    assert 'imoveis_coalescencia_coalescidas' in metricas_texto
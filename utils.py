@@ -1,7 +1,22 @@
 import mysql.connector
 import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date
+from math import cos, degrees, radians
+from decimal import Decimal
 from mysql.connector import Error
 from dotenv import load_dotenv
+from cache import AUSENTE, criar_cache
+from instantaneo import GerenciadorInstantaneo
+from fila_escrita import FilaEscrita
+from coalescencia import Coalescedor
+from metricas import fase, contar, CursorMedido, ConexaoMedida
 
 load_dotenv('.cred')
 
@@ -12,88 +27,979 @@ config = {
     'password': os.getenv('DB_PASSWORD'),  # Obtém a senha do banco de dados da variável de ambiente
     'database': os.getenv('DB_NAME'),  # Obtém o nome do banco de dados da variável de ambiente
     'port': int(os.getenv('DB_PORT', 3306)),  # Obtém a porta do banco de dados da variável de ambiente
-    'ssl_ca': os.getenv('SSL_CA_PATH')  # Caminho para o certificado SSL
+    'ssl_ca': os.getenv('SSL_CA_PATH'),  # Caminho para o certificado SSL
+    'time_zone': '+00:00'  # Datas da sessão em UTC (usadas no Last-Modified)
 }
 
-def connect_db():
-    """Estabelece a conexão com o banco de dados usando as configurações fornecidas."""
+# Configurações do pool de conexões
+config_pool = {
+    'tamanho_min': int(os.getenv('DB_POOL_MIN', 1)),  # Conexões mantidas abertas mesmo ociosas
+    'tamanho_max': int(os.getenv('DB_POOL_MAX', 10)),  # Limite de conexões abertas por processo
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 5)),  # Segundos aguardando uma conexão livre
+    'intervalo_ping': float(os.getenv('DB_POOL_PING', 30)),  # Ociosidade (s) a partir da qual a conexão é testada
+    'max_ociosidade': float(os.getenv('DB_POOL_MAX_OCIOSIDADE', 300))  # Ociosidade (s) para fechar conexões excedentes
+}
+
+
+def _enderecos_replicas(texto):
+    """'host[:porta],host[:porta]' -> opções de conexão de cada réplica (usuário, senha e banco do primário)"""
+    replicas = []
+    for item in texto.split(','):
+        host, _, porta = item.strip().partition(':')
+        if host:
+            replicas.append({'host': host, 'port': int(porta or config['port'])})
+    return replicas
+
+# Réplicas de leitura (vazio = todo o tráfego no primário)
+config_replicas = {
+    'replicas': _enderecos_replicas(os.getenv('DB_REPLICAS', '')),  # Ex.: 10.0.0.2,10.0.0.3:3307
+    'estrategia': os.getenv('DB_REPLICAS_ESTRATEGIA', 'round_robin'),  # round_robin ou menos_carregada
+    'quarentena': float(os.getenv('DB_REPLICAS_QUARENTENA', 30)),  # Segundos fora da rotação após uma falha
+    'atraso_max': float(os.getenv('DB_REPLICAS_ATRASO_MAX', 5))  # Segundos de leitura no primário após uma escrita
+}
+
+# Prepared statements reaproveitados por conexão (ver CursorPreparado)
+PREPARADAS = os.getenv('DB_PREPARADAS', '1') != '0'
+PREPARADAS_MAX = int(os.getenv('DB_PREPARADAS_MAX', 32))  # Textos SQL preparados por conexão (LRU)
+
+
+class ErroConexao(Exception):
+    """Erro ao obter uma conexão com o banco de dados."""
+
+
+def connect_db(**opcoes):
+    """Estabelece a conexão com o banco de dados usando as configurações fornecidas.
+
+    opcoes substituem ou completam as do config (ex.: host e porta de uma
+    réplica, allow_local_infile=True no carregador.py).
+    """
     try:
         # Tenta estabelecer a conexão com o banco de dados usando mysql-connector-python
-        conn = mysql.connector.connect(**config)
-        if conn.is_connected():
-            return conn
+        conn = mysql.connector.connect(**{**config, **opcoes})
     except Error as err:
-        # Em caso de erro, imprime a mensagem de erro
-        print(f"Erro: {err}")
+        # Em caso de erro, propaga uma exceção em vez de devolver None ao chamador
+        raise ErroConexao(f"Erro: {err}") from err
+    if not conn.is_connected():
+        raise ErroConexao("Erro: conexão recusada pelo banco de dados")
+    return conn
+
+
+class PoolConexoes:
+    """Pool de conexões thread-safe, com verificação de saúde no empréstimo.
+
+    As conexões são criadas sob demanda por connect_db() até tamanho_max. Uma
+    conexão ociosa há mais de intervalo_ping segundos é testada com ping antes
+    de ser emprestada e, se estiver quebrada, é substituída por uma nova.
+    Depois de um fork (Gunicorn com preload_app) o processo filho descarta as
+    conexões herdadas, sem fechá-las, para não derrubar as do processo pai.
+    opcoes vão para o connect_db (ex.: host e porta de uma réplica).
+    """
+
+    def __init__(self, tamanho_min=1, tamanho_max=10, timeout=5.0, intervalo_ping=30.0, max_ociosidade=300.0,
+                 opcoes=None):
+        self.opcoes = opcoes or {}
+        self.tamanho_min = tamanho_min
+        self.tamanho_max = tamanho_max
+        self.timeout = timeout
+        self.intervalo_ping = intervalo_ping
+        self.max_ociosidade = max_ociosidade
+        self._reiniciar()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reiniciar)
+
+    def _reiniciar(self):
+        """Zera o estado do pool (usado na criação e no processo filho após fork)."""
+        self._cond = threading.Condition()
+        self._ociosas = []  # pilha de (conexão, instante da devolução)
+        self._em_uso = 0
+        self.criadas = 0
+        self.descartadas = 0
+
+    def obter(self):
+        """Empresta uma conexão, aguardando no máximo self.timeout segundos."""
+        prazo = time.monotonic() + self.timeout
+        with self._cond:
+            while not self._ociosas and self._em_uso >= self.tamanho_max:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    raise ErroConexao("Erro: tempo esgotado aguardando conexão livre no pool")
+                self._cond.wait(restante)
+            entrada = self._ociosas.pop() if self._ociosas else None
+            self._em_uso += 1
+
+        # Criação e ping acontecem fora do lock para não bloquear as outras threads
+        try:
+            if entrada is None:
+                return self._criar()
+            conn, devolvida_em = entrada
+            if time.monotonic() - devolvida_em < self.intervalo_ping or self._saudavel(conn):
+                return conn
+            self._fechar(conn)
+            return self._criar()
+        except BaseException:
+            with self._cond:
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+
+    def devolver(self, conn, descartar=False):
+        """Devolve uma conexão ao pool; com descartar=True ela é fechada."""
+        excedentes = []
+        with self._cond:
+            self._em_uso -= 1
+            if not descartar:
+                agora = time.monotonic()
+                self._ociosas.append((conn, agora))
+                # Fecha as conexões mais antigas que passaram do limite de ociosidade
+                while len(self._ociosas) > self.tamanho_min and agora - self._ociosas[0][1] > self.max_ociosidade:
+                    excedentes.append(self._ociosas.pop(0)[0])
+            self._cond.notify()
+        if descartar:
+            excedentes.append(conn)
+        for excedente in excedentes:
+            self._fechar(excedente)
+
+    def aquecer(self):
+        """Abre conexões até tamanho_min (ex.: no hook post_fork do Gunicorn)."""
+        novas = []
+        with self._cond:
+            faltam = max(0, self.tamanho_min - len(self._ociosas) - self._em_uso)
+            self._em_uso += faltam
+        try:
+            for _ in range(faltam):
+                novas.append(self._criar())
+        finally:
+            with self._cond:
+                self._em_uso -= faltam
+                self._ociosas.extend((conn, time.monotonic()) for conn in novas)
+                self._cond.notify_all()
+
+    def fechar(self):
+        """Fecha todas as conexões ociosas."""
+        with self._cond:
+            ociosas, self._ociosas = self._ociosas, []
+        for conn, _ in ociosas:
+            self._fechar(conn)
+
+    def estatisticas(self):
+        """Retorna contadores do pool."""
+        with self._cond:
+            return {
+                'ociosas': len(self._ociosas),
+                'em_uso': self._em_uso,
+                'criadas': self.criadas,
+                'descartadas': self.descartadas
+            }
+
+    def _criar(self):
+        conn = connect_db(**self.opcoes)
+        contar('conexoes')
+        with self._cond:
+            self.criadas += 1
+        return conn
+
+    def _saudavel(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    def _fechar(self, conn):
+        with self._cond:
+            self.descartadas += 1
+        try:
+            conn.close()
+        except Error:
+            pass
+
+
+ESTRATEGIAS_REPLICAS = ('round_robin', 'menos_carregada')
+
+
+class RoteadorReplicas:
+    """Escolhe a réplica de cada leitura, com failover entre elas.
+
+    round_robin alterna entre as réplicas; menos_carregada prefere a de menos
+    conexões em uso (empates em rodízio). Uma réplica que falha ao entregar
+    conexão fica fora da rotação por `quarentena` segundos e, sem réplica
+    disponível, a leitura vai ao primário. Os pools podem ser síncronos ou
+    assíncronos: o roteador só ordena os candidatos, quem empresta é o chamador.
+    """
+
+    def __init__(self, pools, estrategia='round_robin', quarentena=30.0):
+        if estrategia not in ESTRATEGIAS_REPLICAS:
+            raise ValueError(f"Estratégia de réplicas inválida: {estrategia} (use {' ou '.join(ESTRATEGIAS_REPLICAS)})")
+        self.pools = list(pools)
+        self.estrategia = estrategia
+        self.quarentena = quarentena
+        self._reiniciar()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reiniciar)
+
+    def _reiniciar(self):
+        self._lock = threading.Lock()
+        self._proxima = 0
+        self._suspensas = {}  # pool -> instante (monotonic) em que volta à rotação
+        self.falhas = 0
+
+    def candidatos(self):
+        """Réplicas fora de quarentena, na ordem em que devem ser tentadas"""
+        agora = time.monotonic()
+        with self._lock:
+            total = len(self.pools)
+            inicio = self._proxima
+            self._proxima = (self._proxima + 1) % max(total, 1)
+            ordem = [self.pools[(inicio + passo) % total] for passo in range(total)]
+            disponiveis = [replica for replica in ordem if self._suspensas.get(replica, 0) <= agora]
+        if self.estrategia == 'menos_carregada':
+            disponiveis.sort(key=lambda replica: replica.estatisticas()['em_uso'])
+        return disponiveis
+
+    def suspender(self, replica):
+        """Tira a réplica da rotação por self.quarentena segundos"""
+        with self._lock:
+            self._suspensas[replica] = time.monotonic() + self.quarentena
+            self.falhas += 1
+
+    def estatisticas(self):
+        """Retorna contadores do roteador."""
+        agora = time.monotonic()
+        with self._lock:
+            return {
+                'total': len(self.pools),
+                'suspensas': sum(1 for ate in self._suspensas.values() if ate > agora),
+                'falhas': self.falhas
+            }
+
+
+pool = PoolConexoes(**config_pool)
+roteador = RoteadorReplicas([PoolConexoes(**config_pool, opcoes=replica) for replica in config_replicas['replicas']],
+                            config_replicas['estrategia'], config_replicas['quarentena'])
+
+# Se as leituras da requisição em andamento podem ir para uma réplica (a API
+# libera nos GET sem leitura após escrita pendente; fora dela, tudo vai ao primário)
+_leitura_em_replica = ContextVar('leitura_em_replica', default=False)
+# Instante (monotonic) da última escrita deste processo: até atraso_max segundos
+# depois dela, nenhuma leitura do processo vai às réplicas, que podem não ter
+# recebido a alteração e recolocariam dados antigos no cache recém-invalidado
+_ultima_escrita = float('-inf')
+
+
+def permitir_replica(permitir):
+    """Libera (ou não) as leituras do contexto atual (requisição) para as réplicas"""
+    _leitura_em_replica.set(bool(permitir))
+
+
+def _usar_replica(roteador_leitura):
+    return (bool(roteador_leitura.pools) and _leitura_em_replica.get()
+            and time.monotonic() - _ultima_escrita >= config_replicas['atraso_max'])
+
+
+def _emprestar(leitura):
+    """(pool, conexão) para a operação: réplica nas leituras liberadas (com failover), senão o primário"""
+    if leitura and _usar_replica(roteador):
+        for replica in roteador.candidatos():
+            try:
+                return replica, replica.obter()
+            except ErroConexao:
+                roteador.suspender(replica)
+    return pool, pool.obter()
+
+
+# Cursores preparados de cada conexão aberta: {sql: (texto da preparação, cursor)}, do menos ao mais recente
+_preparadas = weakref.WeakKeyDictionary()
+
+
+def _fechar_cursor(cursor):
+    try:
+        cursor.close()
+    except Error:
+        pass
+
+
+class CursorPreparado:
+    """Cursor que reaproveita os prepared statements da conexão entre empréstimos.
+
+    Cada texto SQL executado usa o cursor preparado da conexão para ele, criado
+    na primeira execução; as seguintes só enviam os parâmetros, sem o servidor
+    analisar o SQL de novo. O mysql-connector só pula o PREPARE quando recebe o
+    mesmo objeto str da preparação, por isso o cache guarda esse objeto junto
+    do cursor. description, fetch*, rowcount e lastrowid são os do último
+    execute; close descarta as linhas não lidas e mantém os cursores no cache.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursores = _preparadas.setdefault(conn, OrderedDict())
+        self._sql = self._atual = None
+
+    def __getattr__(self, nome):
+        return getattr(self._atual, nome)
+
+    def execute(self, sql, params=None):
+        self.close()
+        entrada = self._cursores.pop(sql, None)
+        if entrada is None:
+            entrada = (sql, self._conn.cursor(prepared=True))
+            contar('preparacoes')
+            while len(self._cursores) >= PREPARADAS_MAX:
+                _fechar_cursor(self._cursores.popitem(last=False)[1][1])
+        self._cursores[sql] = entrada
+        texto, cursor = entrada
+        self._sql, self._atual = sql, cursor
+        try:
+            return cursor.execute(texto) if params is None else cursor.execute(texto, params)
+        except BaseException:
+            self._descartar()
+            raise
+
+    def close(self):
+        """Libera o cursor atual para a próxima execução (as linhas não lidas são descartadas)"""
+        if self._atual is None:
+            return
+        try:
+            if self._atual.with_rows:
+                self._atual.fetchall()
+        except Error:
+            self._descartar()
+        self._sql = self._atual = None
+
+    def _descartar(self):
+        """Fecha o cursor atual e o tira do cache: o estado do statement ficou incerto"""
+        self._cursores.pop(self._sql, None)
+        _fechar_cursor(self._atual)
+        self._sql = self._atual = None
+
+
+class ConexaoPool(ConexaoMedida):
+    """Conexão entregue pelo obter_conexao: cursores medidos e, com DB_PREPARADAS, prepared statements"""
+
+    def cursor_preparado(self):
+        if not PREPARADAS:
+            return self.cursor()
+        return CursorMedido(CursorPreparado(self._conn))
+
+
+@contextmanager
+def obter_conexao(leitura=False):
+    """Empresta uma conexão do pool e garante a devolução mesmo se a consulta falhar.
+
+    Com leitura=True a conexão pode vir de uma réplica (ver permitir_replica);
+    escritas sempre usam o primário. Os cursores da conexão entregue são
+    medidos (tempo de consulta e fetch, consultas lentas) pelo metricas.py, e
+    cursor_preparado() reaproveita os prepared statements da conexão.
+    """
+    with fase('conexao'):
+        origem, conn = _emprestar(leitura)
+    descartar = False
+    try:
+        yield ConexaoPool(conn)
+    except BaseException:
+        # Desfaz a transação pendente; se nem isso funcionar, a conexão está quebrada
+        try:
+            conn.rollback()
+        except Error:
+            descartar = True
+        raise
+    else:
+        # Sem autocommit, um SELECT abre uma transação (e o snapshot do REPEATABLE READ);
+        # encerrá-la aqui faz o próximo empréstimo ver o que foi gravado depois
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            descartar = True
+    finally:
+        origem.devolver(conn, descartar)
+
+
+# Paginação por chave (keyset): tamanho máximo de página aceito e tamanho aplicado
+# quando o cliente não informa limit (0 mantém a listagem completa por padrão)
+PAGINA_MAX = int(os.getenv('IMOVEIS_PAGINA_MAX', 100))
+PAGINA_PADRAO = int(os.getenv('IMOVEIS_PAGINA_PADRAO', 0))
+
+# Colunas graváveis da tabela imoveis (o id é gerado pelo banco)
+CAMPOS_IMOVEL = ('logradouro', 'tipo_logradouro', 'bairro', 'cidade', 'cep', 'tipo', 'valor', 'data_aquisicao')
+
+# Colunas devolvidas por padrão e as exigidas pelos links HATEOAS
+COLUNAS_IMOVEL = ('id',) + CAMPOS_IMOVEL
+COLUNAS_LINKS = ('id', 'tipo', 'cidade')
+# Colunas que podem ser pedidas em fields= (lista branca do SELECT): as coordenadas
+# (migracoes/004_cep_e_coordenadas.sql) e a versão do imóvel (005) só saem quando pedidas
+COLUNAS_OPCIONAIS = ('latitude', 'longitude', 'versao')
+COLUNAS_PROJETAVEIS = COLUNAS_IMOVEL + COLUNAS_OPCIONAIS
+
+# Operações em lote: linhas por comando SQL e máximo de linhas por transação
+BULK_LOTE = int(os.getenv('IMOVEIS_BULK_LOTE', 500))
+BULK_MAX = int(os.getenv('IMOVEIS_BULK_MAX', 10000))
+
+# Quantidade de linhas lidas por fetchmany nas exportações em streaming
+LOTE_STREAM = int(os.getenv('IMOVEIS_LOTE_STREAM', 500))
+
+# Filtros da listagem: colunas de igualdade (um valor ou lista IN) e faixas
+# coluna_min/coluna_max com o conversor que valida o valor recebido. As datas são
+# guardadas como texto ISO (AAAA-MM-DD), cuja ordem alfabética é a cronológica
+FILTROS_IGUALDADE = ('cidade', 'tipo', 'bairro', 'cep', 'tipo_logradouro')
+FILTROS_FAIXA = {
+    'valor': float,
+    'data_aquisicao': lambda texto: date.fromisoformat(texto).isoformat(),
+    'cep': lambda texto: normaliza_cep(texto)
+}
+_CHAVES_FAIXA = {f'{coluna}_{sufixo}' for coluna in FILTROS_FAIXA for sufixo in ('min', 'max')}
+# Faixas comparadas com outra coluna: o CEP em texto tem formatos variados, cep_num é numérico e indexado
+COLUNAS_FAIXA = {'cep': 'cep_num'}
+
+# Filtro near (latitude, longitude, raio em metros), resolvido pelo índice espacial de localizacao
+RAIO_TERRA = 6371008.8
+RAIO_MAX = float(os.getenv('IMOVEIS_RAIO_MAX', 50000))
+
+# Colunas com índice aceitas em sort= (ver migracoes/002_indices_filtros.sql)
+COLUNAS_ORDENAVEIS = ('id', 'valor', 'data_aquisicao', 'cidade', 'tipo')
+
+# Agrupamentos de /imoveis/stats (nome -> expressão SQL); data_aquisicao é ISO, o ano são os 4 primeiros caracteres
+AGRUPAMENTOS = {'cidade': 'cidade', 'tipo': 'tipo', 'bairro': 'bairro', 'ano': 'LEFT(data_aquisicao, 4)'}
+# Agregados de valor em /imoveis/stats; além deles, pNN é o percentil NN (p50, p90...)
+AGREGADOS = {'count': 'COUNT(*)', 'sum': 'SUM(valor)', 'avg': 'AVG(valor)', 'min': 'MIN(valor)', 'max': 'MAX(valor)'}
+AGREGADOS_PADRAO = ('count', 'avg', 'min', 'max')
+
+# Busca textual de /imoveis/search, pelo índice FULLTEXT ft_endereco (ver migracoes/003_busca_textual.sql)
+COLUNAS_BUSCA = ('logradouro', 'bairro', 'cidade')
+BUSCA_PADRAO = int(os.getenv('IMOVEIS_BUSCA_PADRAO', 10))
+BUSCA_MAX_PALAVRAS = 8
+
+# Log de alterações de /imoveis/changes (migracoes/006_log_alteracoes.sql): entradas por página,
+# espera máxima do long-poll (wait=), intervalo entre leituras do log e duração de um stream SSE
+ALTERACOES_PAGINA = int(os.getenv('IMOVEIS_ALTERACOES_PAGINA', 100))
+ALTERACOES_MAX = int(os.getenv('IMOVEIS_ALTERACOES_MAX', 1000))
+ALTERACOES_ESPERA_MAX = float(os.getenv('IMOVEIS_ALTERACOES_ESPERA_MAX', 30))
+ALTERACOES_INTERVALO = float(os.getenv('IMOVEIS_ALTERACOES_INTERVALO', 0.5))
+ALTERACOES_SSE_DURACAO = float(os.getenv('IMOVEIS_ALTERACOES_SSE_DURACAO', 300))
+# No api.py (WSGI) cada espera prende uma thread do servidor: long-poll mais curto e SSE só se ligado
+ALTERACOES_ESPERA_SYNC = float(os.getenv('IMOVEIS_ALTERACOES_ESPERA_SYNC', 5))
+ALTERACOES_SSE_SYNC = os.getenv('IMOVEIS_ALTERACOES_SSE_SYNC', '0') == '1'
+
+def linhas_para_imoveis(cursor, linhas):
+    """Converte linhas em dicionários usando os nomes de coluna de cursor.description"""
+    with fase('mapeamento'):
+        colunas = [descricao[0] for descricao in cursor.description]
+        return [dict(zip(colunas, linha)) for linha in linhas]
+
+def projecao(campos=None, com_links=True, coluna_ordem=None):
+    """Colunas do SELECT para os campos pedidos, na ordem da tabela.
+
+    O id sempre é incluído (chave da paginação) e, quando os links HATEOAS de
+    cada item são gerados, também tipo e cidade. A coluna de sort= também entra,
+    pois o cursor das páginas seguintes é montado a partir dela.
+    """
+    if not campos:
+        return COLUNAS_IMOVEL
+    obrigatorias = (COLUNAS_LINKS if com_links else ('id',)) + ((coluna_ordem,) if coluna_ordem else ())
+    return tuple(coluna for coluna in COLUNAS_PROJETAVEIS if coluna in campos or coluna in obrigatorias)
+
+def normaliza_cep(texto):
+    """CEP com ou sem hífen -> inteiro de 8 dígitos, como a coluna cep_num (5 dígitos = CEP antigo, completado com 000)"""
+    digitos = re.sub(r'\D', '', str(texto))
+    if len(digitos) not in (5, 8):
+        raise ValueError(f'CEP inválido: {texto}')
+    return int(digitos.ljust(8, '0'))
+
+def normaliza_filtros(filtros=None, cidade=None, tipo=None):
+    """Filtros em forma canônica (listas viram tuplas sem repetição e vazios somem).
+
+    cidade/tipo, quando informados, substituem os filtros de mesmo nome. Chaves
+    fora da lista branca geram ValueError, já que viram nomes de coluna no SQL.
+    """
+    resultado = {}
+    for chave, valor in (filtros or {}).items():
+        if chave in FILTROS_IGUALDADE:
+            valores = valor if isinstance(valor, (list, tuple)) else [valor]
+            valores = tuple(dict.fromkeys(v for v in valores if v not in (None, '')))
+            if valores:
+                resultado[chave] = valores
+        elif chave in _CHAVES_FAIXA:
+            if valor is not None:
+                resultado[chave] = valor
+        elif chave == 'near':
+            if valor:
+                resultado[chave] = tuple(valor)
+        else:
+            raise ValueError(f'Filtro desconhecido: {chave}')
+    if cidade:
+        resultado['cidade'] = (cidade,)
+    if tipo:
+        resultado['tipo'] = (tipo,)
+    return resultado
+
+def _condicoes_filtros(filtros):
+    """Condições do WHERE (e seus parâmetros) para os filtros da listagem"""
+    filtros = normaliza_filtros(filtros)
+    condicoes = []
+    params = []
+    for coluna in FILTROS_IGUALDADE:
+        valores = filtros.get(coluna)
+        if not valores:
+            continue
+        if len(valores) == 1:
+            condicoes.append(f"{coluna} = %s")
+        else:
+            condicoes.append(f"{coluna} IN ({', '.join(['%s'] * len(valores))})")
+        params.extend(valores)
+    for coluna in FILTROS_FAIXA:
+        for sufixo, operador in (('min', '>='), ('max', '<=')):
+            valor = filtros.get(f'{coluna}_{sufixo}')
+            if valor is not None:
+                condicoes.append(f"{COLUNAS_FAIXA.get(coluna, coluna)} {operador} %s")
+                params.append(valor)
+    if 'near' in filtros:
+        latitude, longitude, raio = filtros['near']
+        # O retângulo em volta do círculo usa o índice espacial; a distância confirma cada candidato
+        condicoes.append("latitude IS NOT NULL AND MBRContains(ST_GeomFromText(%s, 4326), localizacao) "
+                         "AND ST_Distance_Sphere(localizacao, ST_GeomFromText(%s, 4326)) <= %s")
+        params.extend((retangulo_wkt(latitude, longitude, raio), f'POINT({latitude!r} {longitude!r})', raio))
+    return condicoes, params
+
+def retangulo_wkt(latitude, longitude, raio):
+    """Polígono (WKT, ordem latitude longitude do SRID 4326) que contém o círculo de raio metros"""
+    delta_lat = degrees(raio / RAIO_TERRA)
+    delta_lon = min(degrees(raio / (RAIO_TERRA * max(cos(radians(latitude)), 1e-6))), 180.0)
+    sul, norte = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+    oeste, leste = max(longitude - delta_lon, -180.0), min(longitude + delta_lon, 180.0)
+    return (f'POLYGON(({sul!r} {oeste!r}, {norte!r} {oeste!r}, {norte!r} {leste!r}, '
+            f'{sul!r} {leste!r}, {sul!r} {oeste!r}))')
+
+def monta_consulta_imoveis(filtros=None, limite=None, apos_id=None, antes_id=None, colunas=None,
+                           ordem=None, chave_cursor=None):
+    """Monta o SELECT parametrizado da listagem de imóveis.
+
+    Colunas, filtros e ordenação vêm de listas brancas (projecao(),
+    FILTROS_IGUALDADE, FILTROS_FAIXA e COLUNAS_ORDENAVEIS); da requisição só
+    chegam valores, sempre passados como parâmetros. ordem é (coluna,
+    decrescente), por padrão ('id', False).
+
+    Com limite, a página é resolvida pelo banco via índice: WHERE id > apos_id
+    ORDER BY id LIMIT n, ou, ordenando por outra coluna, a comparação de
+    (coluna, id) com o cursor (chave_cursor, apos_id). antes_id lê no sentido
+    inverso para voltar uma página.
+    """
+    condicoes, params = _condicoes_filtros(filtros)
+
+    coluna_ordem, decrescente = ordem or ('id', False)
+    if coluna_ordem not in COLUNAS_ORDENAVEIS:
+        raise ValueError(f'Coluna de ordenação inválida: {coluna_ordem}')
+    para_tras = antes_id is not None
+    if para_tras:
+        # A página anterior é lida no sentido inverso e desvirada por quem chamou
+        decrescente = not decrescente
+    cursor_id = antes_id if para_tras else apos_id
+    if cursor_id is not None:
+        operador = '<' if decrescente else '>'
+        if coluna_ordem == 'id':
+            condicoes.append(f"id {operador} %s")
+            params.append(cursor_id)
+        else:
+            # Desempate pelo id; linhas com NULL na coluna de ordenação não entram nas páginas seguintes
+            condicoes.append(f"({coluna_ordem} {operador} %s OR ({coluna_ordem} = %s AND id {operador} %s))")
+            params.extend((chave_cursor, chave_cursor, cursor_id))
+
+    sql = f"SELECT {', '.join(colunas or COLUNAS_IMOVEL)} FROM imoveis"
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    if ordem or limite is not None:
+        direcao = " DESC" if decrescente else ""
+        if coluna_ordem == 'id':
+            sql += f" ORDER BY id{direcao}"
+        else:
+            sql += f" ORDER BY {coluna_ordem}{direcao}, id{direcao}"
+    if limite is not None:
+        sql += " LIMIT %s"
+        params.append(limite)
+    return sql, tuple(params)
+
+# Cache de leitura das consultas de listagem e por id (IMOVEIS_CACHE=0 desliga).
+# IMOVEIS_CACHE_BACKEND escolhe entre 'local' (por processo), 'arquivo' (compartilhado
+# pelos workers do host) e 'redis' (compartilhado entre hosts)
+cache_imoveis = criar_cache(
+    backend=os.getenv('IMOVEIS_CACHE_BACKEND', 'local'),
+    max_entradas=int(os.getenv('IMOVEIS_CACHE_MAX', 1024)),
+    ttl=float(os.getenv('IMOVEIS_CACHE_TTL', 60)),
+    ativo=os.getenv('IMOVEIS_CACHE', '1') != '0',
+    arquivo=os.getenv('IMOVEIS_CACHE_ARQUIVO'),
+    url_redis=os.getenv('IMOVEIS_CACHE_REDIS'),
+    chave_assinatura=os.getenv('IMOVEIS_CACHE_CHAVE')
+)
+
+# Listagens idênticas simultâneas que não estão no cache fazem uma só consulta
+# ao banco (IMOVEIS_COALESCER=0 desliga; ver coalescencia.py)
+coalescedor_imoveis = Coalescedor(
+    ativo=os.getenv('IMOVEIS_COALESCER', '1') != '0',
+    espera=float(os.getenv('IMOVEIS_COALESCER_ESPERA', 5))
+)
+
+def tag_lista(cidade=None, tipo=None):
+    """Tag do grupo de listagens filtradas por cidade/tipo (None = sem filtro)"""
+    return ('lista', cidade or None, tipo or None)
+
+# Entrada do cache com a versão da tabela (ETag/Last-Modified); toda escrita a invalida
+CHAVE_VERSAO = TAG_VERSAO = ('versao_tabela',)
+
+def _tags_escrita(imovel_id, *linhas):
+    """Tags afetadas por uma escrita: a versão da tabela, o id e os grupos cidade/tipo de cada versão da linha"""
+    tags = {TAG_VERSAO, ('id', imovel_id)}
+    for cidade, tipo in linhas:
+        tags.update((tag_lista(), tag_lista(cidade), tag_lista(tipo=tipo), tag_lista(cidade, tipo)))
+    return tags
+
+def _grupos_atuais(cursor, imovel_id):
+    """Lê cidade/tipo gravados antes de uma alteração (só necessário com o cache ligado)"""
+    if not cache_imoveis.ativo:
+        return []
+    cursor.execute("SELECT cidade, tipo FROM imoveis WHERE id = %s", (imovel_id,))
+    linha = cursor.fetchone()
+    return [tuple(linha)] if linha else []
+
+def percentil(agregado):
+    """N de um agregado 'pN' (1 a 99); None se não for um percentil"""
+    if agregado[:1] == 'p' and agregado[1:].isdigit() and 0 < int(agregado[1:]) < 100:
+        return int(agregado[1:])
+    return None
+
+def monta_consulta_estatisticas(filtros=None, agrupamento=(), agregados=AGREGADOS_PADRAO):
+    """Monta o SELECT com GROUP BY de /imoveis/stats.
+
+    Agrupamentos e agregados vêm das listas brancas AGRUPAMENTOS e AGREGADOS;
+    os filtros são os mesmos da listagem. Percentis (pN) usam a posição de cada
+    valor no grupo (ROW_NUMBER, MySQL 8): o percentil N é o menor valor cuja
+    posição alcança N% das linhas com valor (método nearest-rank).
+    """
+    if any(nome not in AGRUPAMENTOS for nome in agrupamento):
+        raise ValueError(f'Agrupamento inválido: {agrupamento}')
+    if not agregados or any(nome not in AGREGADOS and percentil(nome) is None for nome in agregados):
+        raise ValueError(f'Agregado inválido: {agregados}')
+    condicoes, params = _condicoes_filtros(filtros)
+    where = " WHERE " + " AND ".join(condicoes) if condicoes else ""
+    grupos = [nome if AGRUPAMENTOS[nome] == nome else f"{AGRUPAMENTOS[nome]} AS {nome}" for nome in agrupamento]
+    selecao = list(agrupamento)
+    for nome in agregados:
+        n = percentil(nome)
+        if n is None:
+            selecao.append(f"{AGREGADOS[nome]} AS {nome}")
+        else:
+            selecao.append(f"MIN(CASE WHEN posicao >= CEIL(total * {n} / 100) THEN valor END) AS {nome}")
+
+    if any(percentil(nome) is not None for nome in agregados):
+        particao = f"PARTITION BY {', '.join(AGRUPAMENTOS[nome] for nome in agrupamento)} " if agrupamento else ""
+        origem = (f"(SELECT {', '.join(grupos + ['valor'])}, "
+                  f"ROW_NUMBER() OVER ({particao}ORDER BY valor IS NULL, valor) AS posicao, "
+                  f"COUNT(valor) OVER ({particao.strip()}) AS total FROM imoveis{where}) AS valores")
+        sql = f"SELECT {', '.join(selecao)} FROM {origem}"
+    else:
+        selecao[:len(grupos)] = grupos
+        sql = f"SELECT {', '.join(selecao)} FROM imoveis{where}"
+    if agrupamento:
+        sql += f" GROUP BY {', '.join(agrupamento)} ORDER BY {', '.join(agrupamento)}"
+    return sql, tuple(params)
+
+def termos_busca(texto):
+    """Texto digitado -> consulta do MATCH em modo booleano: toda palavra é obrigatória e vale como prefixo.
+
+    Só as palavras são aproveitadas; operadores do modo booleano digitados pelo
+    usuário (+ - * " ~ < > ( ) @) são descartados. Retorna '' se não houver palavra.
+    """
+    palavras = re.findall(r'\w+', texto or '')[:BUSCA_MAX_PALAVRAS]
+    return ' '.join(f'+{palavra}*' for palavra in palavras)
+
+def monta_consulta_busca(termos, filtros=None, limite=None, deslocamento=0, colunas=None):
+    """Monta o SELECT de /imoveis/search: MATCH ... AGAINST no índice FULLTEXT, do mais ao menos relevante.
+
+    termos vem de termos_busca(); os filtros da listagem restringem o resultado.
+    Empates de relevância saem na ordem do id, para que a paginação por
+    deslocamento seja estável.
+    """
+    match = f"MATCH({', '.join(COLUNAS_BUSCA)}) AGAINST(%s IN BOOLEAN MODE)"
+    condicoes, params = _condicoes_filtros(filtros)
+    sql = f"SELECT {', '.join(colunas or COLUNAS_IMOVEL)} FROM imoveis WHERE {' AND '.join([match] + condicoes)}"
+    sql += f" ORDER BY {match} DESC, id"
+    params = [termos] + params + [termos]
+    if limite is not None:
+        sql += " LIMIT %s OFFSET %s"
+        params.extend((limite, deslocamento))
+    return sql, tuple(params)
+
+def _copia(imoveis):
+    """Cópia rasa do que está no cache, já que as views acrescentam _links nos dicionários"""
+    if imoveis is None:
         return None
+    if isinstance(imoveis, dict):
+        return dict(imoveis)
+    return [dict(imovel) for imovel in imoveis]
+
+def _tags_consulta(filtros):
+    """Grupos de cidade/tipo que contêm todas as linhas que a consulta pode devolver.
+
+    Listas IN viram uma tag por combinação; filtros das demais colunas não
+    estreitam o grupo (a escrita em qualquer linha da cidade/tipo invalida).
+    """
+    cidades = filtros.get('cidade') or (None,)
+    tipos = filtros.get('tipo') or (None,)
+    return [tag_lista(cidade, tipo) for cidade in cidades for tipo in tipos]
+
+def chave_lista(filtros=None, limite=None, apos_id=None, antes_id=None, colunas=None, ordem=None, chave_cursor=None):
+    """Chave de cache de uma consulta de listagem (filtros já normalizados)"""
+    return ('lista', tuple(sorted((filtros or {}).items())), limite, apos_id, antes_id,
+            tuple(colunas or COLUNAS_IMOVEL), ordem, chave_cursor)
+
+def chave_estatisticas(filtros, agrupamento, agregados):
+    """Chave de cache de uma consulta de /imoveis/stats (filtros já normalizados)"""
+    return ('stats', tuple(sorted(filtros.items())), tuple(agrupamento), tuple(agregados))
 
-def get_imoveis(cidade=None, tipo=None):
-    conn = connect_db()
-    cursor = conn.cursor()
+def get_imoveis(cidade=None, tipo=None, limite=None, apos_id=None, antes_id=None, colunas=None,
+                filtros=None, ordem=None, chave_cursor=None):
+    filtros = normaliza_filtros(filtros, cidade=cidade, tipo=tipo)
+    colunas = tuple(colunas or COLUNAS_IMOVEL)
+    ordem = tuple(ordem) if ordem else None
+    chave = chave_lista(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor)
+    imoveis = instantaneo_imoveis.consultar(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor)
+    if imoveis is not AUSENTE:
+        return imoveis
+    tags = _tags_consulta(filtros)
+    imoveis, marca = cache_imoveis.obter(chave, tags)
+    if imoveis is AUSENTE:
+        # Réplica e primário podem estar em momentos diferentes: leituras de um não esperam pelas do outro
+        imoveis = coalescedor_imoveis.executar(
+            (chave, _usar_replica(roteador)),
+            lambda: _consulta_imoveis(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor))
+        cache_imoveis.gravar(chave, imoveis, tags, marca)
+    return _copia(imoveis)
+
+def _consulta_imoveis(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor):
+    sql, params = monta_consulta_imoveis(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor)
+    with obter_conexao(leitura=True) as conn:
+        cursor = conn.cursor_preparado()
+        try:
+            cursor.execute(sql, params)
+            results = cursor.fetchall()
+            imoveis = linhas_para_imoveis(cursor, results)
+        finally:
+            cursor.close()
     
-    if cidade and tipo:
-        cursor.execute("SELECT * FROM imoveis WHERE cidade = %s AND tipo = %s", (cidade, tipo))
-    elif cidade:
-        cursor.execute("SELECT * FROM imoveis WHERE cidade = %s", (cidade,))
-    elif tipo:
-        cursor.execute("SELECT * FROM imoveis WHERE tipo = %s", (tipo,))
-    else:
-        cursor.execute("SELECT * FROM imoveis")
-    results = cursor.fetchall()
+    if antes_id is not None and limite is not None:
+        # A página anterior é lida no sentido inverso; devolve na ordem pedida
+        imoveis.reverse()
     
-    if not results:
-        cursor.close()
-        conn.close()
+    if not imoveis:
         return None
-    
-    imoveis = []
-    for row in results:
-        imovel = {
-            'id': row[0],
-            'logradouro': row[1],
-            'tipo_logradouro': row[2],
-            'bairro': row[3],
-            'cidade': row[4],
-            'cep': row[5],
-            'tipo': row[6],
-            'valor': row[7],
-            'data_aquisicao': row[8]
-        }
-        imoveis.append(imovel)
-     
-    cursor.close()
-    conn.close()
     return imoveis
 
-def get_imovel_por_id(imovel_id):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM imoveis WHERE id = %s", (imovel_id,))
-    result = cursor.fetchone()
-    
-    if result:
-        imovel = {
-            'id': result[0],
-            'logradouro': result[1],
-            'tipo_logradouro': result[2],
-            'bairro': result[3],
-            'cidade': result[4],
-            'cep': result[5],
-            'tipo': result[6],
-            'valor': result[7],
-            'data_aquisicao': result[8]
-        }
+def iterar_imoveis(cidade=None, tipo=None, tamanho_lote=None, colunas=None, filtros=None, ordem=None):
+    """Gera os imóveis lendo o cursor em lotes com fetchmany, sem materializar a tabela.
+
+    A conexão só é emprestada no primeiro next() e fica presa ao gerador até o
+    fim da leitura. Se a iteração for interrompida (erro ou cliente que
+    desconectou), ainda há linhas não lidas no socket, então a conexão é
+    descartada em vez de voltar ao pool.
+    """
+    filtros = normaliza_filtros(filtros, cidade=cidade, tipo=tipo)
+    sql, params = monta_consulta_imoveis(filtros, colunas=colunas, ordem=ordem)
+    tamanho_lote = tamanho_lote or LOTE_STREAM
+    with fase('conexao'):
+        origem, conn = _emprestar(leitura=True)
+    completo = False
+    try:
+        # Cursor sem buffer: as linhas vêm do socket a cada fetchmany, nunca todas de uma vez
+        cursor = CursorMedido(conn.cursor(buffered=False))
+        cursor.execute(sql, params)
+        nomes = [descricao[0] for descricao in cursor.description]
+        while True:
+            lote = cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            for row in lote:
+                yield dict(zip(nomes, row))
         cursor.close()
-        conn.close()
-        return imovel
-    
-    cursor.close()
-    conn.close()
-    return None
+        completo = True
+    finally:
+        origem.devolver(conn, descartar=not completo)
 
-def adicionar_imovel_db(dados):
-    conn = connect_db()
-    cursor = conn.cursor()
+def buscar_imoveis(termos, filtros=None, limite=None, deslocamento=0, colunas=None):
+    """Imóveis cujo endereço (logradouro, bairro, cidade) casa com termos, do mais relevante ao menos"""
+    filtros = normaliza_filtros(filtros)
+    colunas = tuple(colunas or COLUNAS_IMOVEL)
+    chave = ('busca', termos, tuple(sorted(filtros.items())), limite, deslocamento, colunas)
+    tags = _tags_consulta(filtros)
+    imoveis, marca = cache_imoveis.obter(chave, tags)
+    if imoveis is AUSENTE:
+        sql, params = monta_consulta_busca(termos, filtros, limite, deslocamento, colunas)
+        with obter_conexao(leitura=True) as conn:
+            cursor = conn.cursor_preparado()
+            try:
+                cursor.execute(sql, params)
+                imoveis = linhas_para_imoveis(cursor, cursor.fetchall())
+            finally:
+                cursor.close()
+        cache_imoveis.gravar(chave, imoveis, tags, marca)
+    return _copia(imoveis)
+
+def get_estatisticas(filtros=None, agrupamento=(), agregados=AGREGADOS_PADRAO):
+    """Agregados de valor por grupo, calculados no banco (lista de dicionários, um por grupo)"""
+    filtros = normaliza_filtros(filtros)
+    chave = chave_estatisticas(filtros, agrupamento, agregados)
+    tags = _tags_consulta(filtros)
+    grupos, marca = cache_imoveis.obter(chave, tags)
+    if grupos is AUSENTE:
+        sql, params = monta_consulta_estatisticas(filtros, agrupamento, agregados)
+        with obter_conexao(leitura=True) as conn:
+            cursor = conn.cursor_preparado()
+            try:
+                cursor.execute(sql, params)
+                grupos = linhas_para_estatisticas(cursor, cursor.fetchall())
+            finally:
+                cursor.close()
+        cache_imoveis.gravar(chave, grupos, tags, marca)
+    return _copia(grupos)
+
+def linhas_para_estatisticas(cursor, linhas):
+    """Converte as linhas do GROUP BY em dicionários (ano como inteiro, somas e médias como float)"""
+    grupos = linhas_para_imoveis(cursor, linhas)
+    for grupo in grupos:
+        for nome, valor in grupo.items():
+            if nome == 'ano' and valor is not None:
+                grupo[nome] = int(valor)
+            elif isinstance(valor, Decimal):
+                grupo[nome] = float(valor)
+    return grupos
+
+INICIO_ALTERACOES = "SELECT MIN(seq) FROM imoveis_alteracoes"
+
+def monta_consulta_alteracoes(desde, limite):
+    """SELECT das entradas do log com seq maior que desde, com o estado atual de cada imóvel"""
+    colunas = ', '.join(f'i.{coluna}' for coluna in COLUNAS_IMOVEL)
+    sql = (f"SELECT a.seq, a.imovel_id, a.operacao, a.criado_em, {colunas} FROM imoveis_alteracoes a "
+           "LEFT JOIN imoveis i ON i.id = a.imovel_id WHERE a.seq > %s ORDER BY a.seq LIMIT %s")
+    return sql, (desde, limite)
+
+def linhas_para_alteracoes(cursor, linhas):
+    """Converte as linhas do log em dicionários; imovel é None se o imóvel não existe mais"""
+    with fase('mapeamento'):
+        alteracoes = []
+        for seq, imovel_id, operacao, criado_em, *colunas in linhas:
+            imovel = dict(zip(COLUNAS_IMOVEL, colunas)) if colunas[0] is not None else None
+            alteracoes.append({'seq': seq, 'id': imovel_id, 'operacao': operacao, 'em': criado_em, 'imovel': imovel})
+        return alteracoes
+
+def get_alteracoes(desde=0, limite=ALTERACOES_PAGINA):
+    """Retorna (alterações com seq maior que desde, menor seq ainda no log ou None se vazio).
+
+    Cada alteração traz o imóvel como está agora, não como estava no seq:
+    quem sincroniza aplica as entradas em ordem e termina no estado atual.
+    """
+    sql, params = monta_consulta_alteracoes(desde, limite)
+    with obter_conexao(leitura=True) as conn:
+        cursor = conn.cursor_preparado()
+        try:
+            cursor.execute(INICIO_ALTERACOES)
+            linha = cursor.fetchone()
+            cursor.execute(sql, params)
+            alteracoes = linhas_para_alteracoes(cursor, cursor.fetchall())
+        finally:
+            cursor.close()
+    return alteracoes, linha[0] if linha else None
+
+def get_imovel_por_id(imovel_id, colunas=None):
+    colunas = tuple(colunas or COLUNAS_IMOVEL)
+    tags = [('id', imovel_id)]
+    chave = ('id', imovel_id, colunas)
+    imovel, marca = cache_imoveis.obter(chave, tags)
+    if imovel is AUSENTE:
+        imovel = _consulta_imovel_por_id(imovel_id, colunas)
+        cache_imoveis.gravar(chave, imovel, tags, marca)
+    return _copia(imovel)
+
+def _consulta_imovel_por_id(imovel_id, colunas):
+    with obter_conexao(leitura=True) as conn:
+        cursor = conn.cursor_preparado()
+        try:
+            cursor.execute(f"SELECT {', '.join(colunas)} FROM imoveis WHERE id = %s", (imovel_id,))
+            result = cursor.fetchone()
+            imovel = linhas_para_imoveis(cursor, [result])[0] if result else None
+        finally:
+            cursor.close()
+    return imovel
+
+CONSULTA_VERSAO = "SELECT versao, atualizado_em FROM imoveis_controle WHERE id = 1"
+
+def get_versao_tabela():
+    """Retorna (versao, atualizado_em) do contador de alterações da tabela imoveis.
+
+    A versão fica no cache de leitura, invalidada por toda escrita (TAG_VERSAO):
+    as requisições condicionais que acertam o cache não vão ao MySQL.
+    """
+    versao, marca = cache_imoveis.obter(CHAVE_VERSAO, [TAG_VERSAO])
+    if versao is AUSENTE:
+        versao = _consulta_versao_tabela()
+        cache_imoveis.gravar(CHAVE_VERSAO, versao, [TAG_VERSAO], marca)
+    instantaneo_imoveis.observar_versao(versao[0])
+    return versao
+
+def _consulta_versao_tabela():
+    with obter_conexao(leitura=True) as conn:
+        cursor = conn.cursor_preparado()
+        try:
+            cursor.execute(CONSULTA_VERSAO)
+            linha = cursor.fetchone()
+        finally:
+            cursor.close()
+    if not linha:
+        return 0, None
+    return linha[0], linha[1]
+
+def _ler_instantaneo(instantaneo):
+    """Preenche o instantâneo com a versão e as linhas da tabela, lidas na mesma transação do primário"""
+    with obter_conexao() as conn:
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+            cursor.execute("SELECT versao FROM imoveis_controle WHERE id = 1")
+            linhas = cursor.fetchall()
+            instantaneo.versao = linhas[0][0] if linhas else 0
+            cursor.execute(f"SELECT {', '.join(COLUNAS_IMOVEL)}, versao FROM imoveis ORDER BY id")
+            while True:
+                lote = cursor.fetchmany(LOTE_STREAM)
+                if not lote:
+                    break
+                instantaneo.adicionar(lote)
+            conn.commit()
+        finally:
+            cursor.close()
+
+# Instantâneo colunar da tabela para as listagens (IMOVEIS_INSTANTANEO=1 liga; ver instantaneo.py).
+# As escritas deste processo são aplicadas a ele; as de outros processos, detectadas pela versão
+instantaneo_imoveis = GerenciadorInstantaneo(
+    _ler_instantaneo,
+    lambda: get_versao_tabela()[0],
+    ativo=os.getenv('IMOVEIS_INSTANTANEO', '0') == '1',
+    intervalo=float(os.getenv('IMOVEIS_INSTANTANEO_INTERVALO', 1))
+)
+
+def _incrementar_versao(cursor):
+    """Incrementa o contador de alterações na mesma transação da escrita (e segura as leituras no primário)"""
+    global _ultima_escrita
+    _ultima_escrita = time.monotonic()
+    cursor.execute("UPDATE imoveis_controle SET versao = versao + 1, atualizado_em = CURRENT_TIMESTAMP(6) WHERE id = 1")
+
+def _registrar_alteracoes(cursor, alteracoes):
+    """Acrescenta (id, operacao) ao log de alterações, na transação da escrita.
+
+    Deve vir depois de _incrementar_versao: a trava da linha de
+    imoveis_controle, mantida até o commit, faz os seq serem gerados na ordem
+    dos commits, então quem lê o log a partir de um seq nunca pula uma
+    transação que confirmou depois.
+    """
+    for lote in _em_lotes(alteracoes, BULK_LOTE):
+        cursor.execute(f"INSERT INTO imoveis_alteracoes (imovel_id, operacao) VALUES {', '.join(['(%s, %s)'] * len(lote))}",
+                       tuple(valor for alteracao in lote for valor in alteracao))
+
+def _inserir_imovel(cursor, dados):
     cursor.execute("""
         INSERT INTO imoveis (logradouro, tipo_logradouro, bairro, cidade, cep, tipo, valor, data_aquisicao) 
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
@@ -107,60 +1013,327 @@ def adicionar_imovel_db(dados):
         dados['valor'],
         dados['data_aquisicao']
     ))
-    conn.commit()
-    novo_id = cursor.lastrowid
-    
-    cursor.close()
-    conn.close()
-    return novo_id
+    return cursor.lastrowid
 
-def atualizar_imovel_db(imovel_id, dados):
-    conn = connect_db()
-    cursor = conn.cursor()
+def _atualizar_imovel(cursor, imovel_id, dados):
+    grupos = _grupos_atuais(cursor, imovel_id)
     cursor.execute("""
         UPDATE imoveis 
         SET logradouro=%s, tipo_logradouro=%s, bairro=%s, cidade=%s, 
-            cep=%s, tipo=%s, valor=%s, data_aquisicao=%s
+            cep=%s, tipo=%s, valor=%s, data_aquisicao=%s, versao=versao+1
         WHERE id=%s""", 
         (dados['logradouro'], dados['tipo_logradouro'], dados['bairro'], dados['cidade'], dados['cep'], dados['tipo'], dados['valor'], dados['data_aquisicao'], imovel_id))
-    conn.commit()
+    return cursor.rowcount, grupos
+
+def _alterar_imovel(cursor, imovel_id, dados, versao=None):
+    """UPDATE só das colunas enviadas e leitura da linha gravada, na mesma transação.
+
+    Com versao, a linha só é alterada se ainda estiver nessa versão. Retorna
+    (linhas alteradas, grupos anteriores, imóvel com a versão ou None).
+    """
+    grupos = _grupos_atuais(cursor, imovel_id)
+    colunas = [campo for campo in CAMPOS_IMOVEL if campo in dados]
+    atribuicoes = ''.join(f'{coluna} = %s, ' for coluna in colunas)
+    params = [dados[coluna] for coluna in colunas] + [imovel_id]
+    condicao = ''
+    if versao is not None:
+        condicao = ' AND versao = %s'
+        params.append(versao)
+    cursor.execute(f"UPDATE imoveis SET {atribuicoes}versao = versao + 1 WHERE id = %s{condicao}", tuple(params))
     linhas_alteradas = cursor.rowcount
-    
-    cursor.close()
-    conn.close()
-    return linhas_alteradas
+    cursor.execute(f"SELECT {', '.join(COLUNAS_IMOVEL)}, versao FROM imoveis WHERE id = %s", (imovel_id,))
+    linha = cursor.fetchone()
+    imovel = linhas_para_imoveis(cursor, [linha])[0] if linha else None
+    return linhas_alteradas, grupos, imovel
 
-def remover_imovel_db(imovel_id):
-    conn = connect_db()
-    cursor = conn.cursor()
+def _linhas_gravadas(cursor, ids):
+    """Lê as linhas alteradas, com a versão nova, na transação da escrita (só necessário com o instantâneo ligado)"""
+    if not instantaneo_imoveis.ativo or not ids:
+        return {}
+    cursor.execute(f"SELECT {', '.join(COLUNAS_IMOVEL)}, versao FROM imoveis "
+                   f"WHERE id IN ({', '.join(['%s'] * len(ids))})", tuple(ids))
+    return {imovel['id']: imovel for imovel in linhas_para_imoveis(cursor, cursor.fetchall())}
+
+def _remover_imovel(cursor, imovel_id):
+    grupos = _grupos_atuais(cursor, imovel_id)
     cursor.execute("DELETE FROM imoveis WHERE id = %s", (imovel_id,))
-    conn.commit()
-    linhas_excluidas = cursor.rowcount
-    
-    cursor.close()
-    conn.close()
-    return linhas_excluidas
+    return cursor.rowcount, grupos
+
+def _gravar_escritas(operacoes):
+    """Executa escritas de um imóvel em uma única transação (um commit) e retorna o resultado de cada uma.
+
+    Cada operação é ('inserir', dados), ('atualizar', id, dados),
+    ('alterar', id, dados, versao) ou ('remover', id); o resultado é o id
+    gerado, as linhas afetadas ou, em 'alterar', (linhas, imóvel gravado).
+    Usado pelas funções abaixo e, com a fila ligada, para gravar um lote inteiro.
+    """
+    resultados = []
+    tags = set()
+    inseridos, atualizados, removidos = [], {}, []
+    alteracoes = []
+    with obter_conexao() as conn:
+        cursor = conn.cursor_preparado()
+        try:
+            for operacao, *argumentos in operacoes:
+                if operacao == 'inserir':
+                    dados, = argumentos
+                    novo_id = _inserir_imovel(cursor, dados)
+                    inseridos.append((novo_id, dados))
+                    alteracoes.append((novo_id, 'criado'))
+                    tags |= _tags_escrita(novo_id, (dados['cidade'], dados['tipo']))
+                    resultados.append(novo_id)
+                elif operacao == 'atualizar':
+                    imovel_id, dados = argumentos
+                    linhas_alteradas, grupos = _atualizar_imovel(cursor, imovel_id, dados)
+                    if linhas_alteradas > 0:
+                        atualizados.update(_linhas_gravadas(cursor, [imovel_id]))
+                        alteracoes.append((imovel_id, 'atualizado'))
+                    tags |= _tags_escrita(imovel_id, *grupos, (dados['cidade'], dados['tipo']))
+                    resultados.append(linhas_alteradas)
+                elif operacao == 'alterar':
+                    imovel_id, dados, versao = argumentos
+                    linhas_alteradas, grupos, imovel = _alterar_imovel(cursor, imovel_id, dados, versao)
+                    if linhas_alteradas > 0:
+                        atualizados[imovel_id] = imovel
+                        alteracoes.append((imovel_id, 'atualizado'))
+                        tags |= _tags_escrita(imovel_id, *grupos, (imovel['cidade'], imovel['tipo']))
+                    resultados.append((linhas_alteradas, imovel))
+                else:
+                    imovel_id, = argumentos
+                    linhas_excluidas, grupos = _remover_imovel(cursor, imovel_id)
+                    if linhas_excluidas > 0:
+                        removidos.append(imovel_id)
+                        alteracoes.append((imovel_id, 'removido'))
+                    tags |= _tags_escrita(imovel_id, *grupos)
+                    resultados.append(linhas_excluidas)
+            alterou = bool(alteracoes)
+            if alterou:
+                _incrementar_versao(cursor)
+                _registrar_alteracoes(cursor, alteracoes)
+            conn.commit()
+        finally:
+            cursor.close()
+    if alterou:
+        instantaneo_imoveis.registrar(inseridos=inseridos, atualizados=atualizados, removidos=removidos)
+    cache_imoveis.invalidar(tags)
+    coalescedor_imoveis.invalidar()
+    return resultados
+
+# Fila de escritas com commit em grupo para POST/PUT/DELETE de um imóvel (IMOVEIS_FILA_ESCRITA=1
+# liga; ver fila_escrita.py). As rotas /imoveis/bulk passam por ela como grupos (_escrever_em_grupo). Com a fila cheia, a escrita é recusada com FilaCheia (HTTP 429)
+fila_escritas = FilaEscrita(
+    _gravar_escritas,
+    tamanho_max=int(os.getenv('IMOVEIS_FILA_MAX', 1000)),
+    lote_max=int(os.getenv('IMOVEIS_FILA_LOTE', 100)),
+    intervalo=float(os.getenv('IMOVEIS_FILA_INTERVALO', 0.002)),
+    ativa=os.getenv('IMOVEIS_FILA_ESCRITA', '0') == '1',
+    sem_repetir=(ErroConexao,)
+)
+
+def _escrever(operacao):
+    if fila_escritas.ativa:
+        return fila_escritas.enviar(operacao)
+    return _gravar_escritas([operacao])[0]
+
+def adicionar_imovel_db(dados):
+    return _escrever(('inserir', dados))
+
+def atualizar_imovel_db(imovel_id, dados):
+    return _escrever(('atualizar', imovel_id, dados))
+
+def alterar_imovel_db(imovel_id, dados, versao=None):
+    """Grava só as colunas de dados (PATCH); com versao, só se o imóvel ainda estiver nela.
+
+    Retorna (linhas alteradas, imóvel gravado com a versão nova, ou None se
+    não existe). Zero linhas com o imóvel presente indica outra versão.
+    """
+    return _escrever(('alterar', imovel_id, dados, versao))
+
+def remover_imovel_db(imovel_id):
+    return _escrever(('remover', imovel_id))
+
+def _em_lotes(itens, tamanho):
+    """Divide a lista em fatias de até `tamanho` itens"""
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+def _bloquear_existentes(cursor, ids, tamanho_lote):
+    """Trava as linhas existentes entre os ids e retorna {id: (cidade, tipo)}"""
+    existentes = {}
+    for lote in _em_lotes(list(dict.fromkeys(ids)), tamanho_lote):
+        marcadores = ', '.join(['%s'] * len(lote))
+        cursor.execute(f"SELECT id, cidade, tipo FROM imoveis WHERE id IN ({marcadores}) FOR UPDATE", tuple(lote))
+        for imovel_id, cidade, tipo in cursor.fetchall():
+            existentes[imovel_id] = (cidade, tipo)
+    return existentes
+
+def _adicionar_imoveis(lista_dados, tamanho_lote=None):
+    """Insere vários imóveis em uma única transação, com um INSERT de várias linhas por lote.
+
+    Retorna os ids gerados, na mesma ordem de lista_dados. Em um INSERT de
+    várias linhas o InnoDB reserva ids consecutivos para o comando, então os
+    ids de cada lote são calculados a partir do lastrowid (id da primeira linha).
+    """
+    tamanho_lote = tamanho_lote or BULK_LOTE
+    colunas = ', '.join(CAMPOS_IMOVEL)
+    linha = '(' + ', '.join(['%s'] * len(CAMPOS_IMOVEL)) + ')'
+    ids = []
+    with obter_conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            for lote in _em_lotes(lista_dados, tamanho_lote):
+                params = tuple(dados[campo] for dados in lote for campo in CAMPOS_IMOVEL)
+                cursor.execute(f"INSERT INTO imoveis ({colunas}) VALUES {', '.join([linha] * len(lote))}", params)
+                primeiro_id = cursor.lastrowid
+                ids.extend(range(primeiro_id, primeiro_id + len(lote)))
+            if ids:
+                _incrementar_versao(cursor)
+                _registrar_alteracoes(cursor, [(novo_id, 'criado') for novo_id in ids])
+            conn.commit()
+        finally:
+            cursor.close()
+    if ids:
+        instantaneo_imoveis.registrar(inseridos=zip(ids, lista_dados))
+    tags = set()
+    for novo_id, dados in zip(ids, lista_dados):
+        tags |= _tags_escrita(novo_id, (dados['cidade'], dados['tipo']))
+    cache_imoveis.invalidar(tags)
+    coalescedor_imoveis.invalidar()
+    return ids
+
+def _atualizar_imoveis(lista_dados, tamanho_lote=None):
+    """Atualiza vários imóveis em uma única transação, gravando só as colunas enviadas.
+
+    Cada item traz o 'id' e as colunas a alterar. Os itens com o mesmo conjunto
+    de colunas viram um único UPDATE por lote (SET coluna = CASE id WHEN ...).
+    Retorna o conjunto de ids encontrados e atualizados.
+    """
+    tamanho_lote = tamanho_lote or BULK_LOTE
+    # Itens repetidos para o mesmo id são mesclados; o último valor enviado prevalece
+    mesclados = {}
+    for dados in lista_dados:
+        mesclados.setdefault(dados['id'], {}).update(dados)
+
+    with obter_conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            existentes = _bloquear_existentes(cursor, list(mesclados), tamanho_lote)
+            grupos = {}
+            for imovel_id, dados in mesclados.items():
+                if imovel_id in existentes:
+                    colunas = tuple(campo for campo in CAMPOS_IMOVEL if campo in dados)
+                    grupos.setdefault(colunas, []).append(dados)
+            for colunas, itens in grupos.items():
+                for lote in _em_lotes(itens, tamanho_lote):
+                    casos = ' '.join(['WHEN %s THEN %s'] * len(lote))
+                    atribuicoes = ', '.join(f"{coluna} = CASE id {casos} END" for coluna in colunas)
+                    params = [valor for coluna in colunas for dados in lote for valor in (dados['id'], dados[coluna])]
+                    params.extend(dados['id'] for dados in lote)
+                    marcadores = ', '.join(['%s'] * len(lote))
+                    cursor.execute(f"UPDATE imoveis SET {atribuicoes}, versao = versao + 1 WHERE id IN ({marcadores})",
+                                   tuple(params))
+            gravadas = {}
+            for lote in _em_lotes(list(existentes), tamanho_lote):
+                gravadas.update(_linhas_gravadas(cursor, lote))
+            if existentes:
+                _incrementar_versao(cursor)
+                _registrar_alteracoes(cursor, [(imovel_id, 'atualizado') for imovel_id in existentes])
+            conn.commit()
+        finally:
+            cursor.close()
+    if existentes:
+        instantaneo_imoveis.registrar(atualizados=gravadas)
+    tags = set()
+    for imovel_id, (cidade, tipo) in existentes.items():
+        dados = mesclados[imovel_id]
+        tags |= _tags_escrita(imovel_id, (cidade, tipo), (dados.get('cidade', cidade), dados.get('tipo', tipo)))
+    cache_imoveis.invalidar(tags)
+    coalescedor_imoveis.invalidar()
+    return set(existentes)
+
+def _remover_imoveis(ids, tamanho_lote=None):
+    """Remove vários imóveis em uma única transação; retorna o conjunto de ids removidos"""
+    tamanho_lote = tamanho_lote or BULK_LOTE
+    with obter_conexao() as conn:
+        cursor = conn.cursor()
+        try:
+            existentes = _bloquear_existentes(cursor, ids, tamanho_lote)
+            for lote in _em_lotes(list(existentes), tamanho_lote):
+                marcadores = ', '.join(['%s'] * len(lote))
+                cursor.execute(f"DELETE FROM imoveis WHERE id IN ({marcadores})", tuple(lote))
+            if existentes:
+                _incrementar_versao(cursor)
+                _registrar_alteracoes(cursor, [(imovel_id, 'removido') for imovel_id in existentes])
+            conn.commit()
+        finally:
+            cursor.close()
+    if existentes:
+        instantaneo_imoveis.registrar(removidos=list(existentes))
+    tags = set()
+    for imovel_id, grupo in existentes.items():
+        tags |= _tags_escrita(imovel_id, grupo)
+    cache_imoveis.invalidar(tags)
+    coalescedor_imoveis.invalidar()
+    return set(existentes)
+
+def _escrever_em_grupo(funcao, *argumentos):
+    """Com a fila ligada, a operação em lote passa por ela como um grupo, depois das escritas já enfileiradas"""
+    if fila_escritas.ativa:
+        return fila_escritas.enviar_grupo(lambda: funcao(*argumentos))
+    return funcao(*argumentos)
+
+def adicionar_imoveis_db(lista_dados, tamanho_lote=None):
+    """Insere vários imóveis em uma transação (ver _adicionar_imoveis); retorna os ids gerados"""
+    return _escrever_em_grupo(_adicionar_imoveis, lista_dados, tamanho_lote)
+
+def atualizar_imoveis_db(lista_dados, tamanho_lote=None):
+    """Atualiza vários imóveis em uma transação (ver _atualizar_imoveis); retorna os ids atualizados"""
+    return _escrever_em_grupo(_atualizar_imoveis, lista_dados, tamanho_lote)
+
+def remover_imoveis_db(ids, tamanho_lote=None):
+    """Remove vários imóveis em uma transação; retorna os ids removidos"""
+    return _escrever_em_grupo(_remover_imoveis, ids, tamanho_lote)
+
+# Links by_type/by_city já montados, compartilhados por todas as linhas do
+# mesmo tipo/cidade (limpos ao passar de LINKS_MAX valores distintos)
+LINKS_MAX = 4096
+_links_tipo = {}
+_links_cidade = {}
+
+def _link_grupo(links, prefixo, valor):
+    link = links.get(valor)
+    if link is None:
+        if len(links) >= LINKS_MAX:
+            links.clear()
+        link = links[valor] = f'{prefixo}{valor}'
+    return link
 
 def adiciona_hateoas_link(imovel):
     """Adiciona link HATEOAS para um imóvel"""
-    imovel_id = imovel['id']
+    link_imovel = f"/imoveis/{imovel['id']}"
     imovel['_links'] = {
-        'self': f'/imoveis/{imovel_id}',
-        'update': f'/imoveis/{imovel_id}',
-        'delete': f'/imoveis/{imovel_id}',
+        'self': link_imovel,
+        'update': link_imovel,
+        'delete': link_imovel,
         'all': '/imoveis',
-        'by_type': f"/imoveis/tipo/{imovel['tipo']}",
-        'by_city': f"/imoveis/cidade/{imovel['cidade']}"
+        'by_type': _link_grupo(_links_tipo, '/imoveis/tipo/', imovel['tipo']),
+        'by_city': _link_grupo(_links_cidade, '/imoveis/cidade/', imovel['cidade'])
     }
     return imovel
 
-def adiciona_hateoas_em_lista(imoveis_list):
-    """Adiciona links HATEOAS para uma coleção de imóveis"""
+def adiciona_hateoas_em_lista(imoveis_list, self_link='/imoveis', proximo=None, anterior=None, links_itens=True):
+    """Adiciona links HATEOAS para uma coleção de imóveis (com next/prev quando paginada)"""
+    with fase('hateoas'):
+        imoveis = [adiciona_hateoas_link(imovel) for imovel in imoveis_list] if links_itens else imoveis_list
     result = {
-        'imoveis': [adiciona_hateoas_link(imovel) for imovel in imoveis_list],
+        'imoveis': imoveis,
         '_links': {
-            'self': '/imoveis',
+            'self': self_link,
             'create': '/imoveis'
         }
     }
+    if proximo:
+        result['_links']['next'] = proximo
+    if anterior:
+        result['_links']['prev'] = anterior
     return result
\ No newline at end of file
@@ -0,0 +1,383 @@
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import mysql.connector.aio
+from mysql.connector import Error
+from cache import AUSENTE
+from metricas import fase, contar, consulta_executada
+from utils import config, config_pool, config_replicas, ErroConexao, RoteadorReplicas, PREPARADAS, PREPARADAS_MAX, cache_imoveis, instantaneo_imoveis, coalescedor_imoveis, COLUNAS_IMOVEL, LOTE_STREAM, AGREGADOS_PADRAO, monta_consulta_imoveis, monta_consulta_estatisticas, monta_consulta_busca, monta_consulta_alteracoes, linhas_para_alteracoes, INICIO_ALTERACOES, CONSULTA_VERSAO, CHAVE_VERSAO, TAG_VERSAO, normaliza_filtros, chave_lista, chave_estatisticas, linhas_para_imoveis, linhas_para_estatisticas, _tags_consulta, _copia, _usar_replica
+
+# Leituras do modo assíncrono (api_async.py). As escritas continuam nas funções
+# do utils.py (transação, contador de versão e invalidação do cache em um só
+# lugar) e são executadas em threads pelo api_async.py.
+
+
+async def _cache(metodo, *args):
+    """Chama um método de cache_imoveis; nos backends com E/S (arquivo, redis), em uma thread, para não travar o event loop"""
+    if cache_imoveis.ativo and cache_imoveis.bloqueante:
+        return await asyncio.to_thread(metodo, *args)
+    return metodo(*args)
+
+
+async def connect_db(**opcoes):
+    """Abre uma conexão assíncrona (mysql.connector.aio) com as configurações do utils.py (opcoes substituem as do config)."""
+    try:
+        conn = await mysql.connector.aio.connect(**{**config, **opcoes})
+    except Error as err:
+        raise ErroConexao(f"Erro: {err}") from err
+    if not await conn.is_connected():
+        raise ErroConexao("Erro: conexão recusada pelo banco de dados")
+    return conn
+
+
+class PoolConexoesAsync:
+    """Pool de conexões assíncronas, com a mesma política do PoolConexoes do utils.py.
+
+    Quem espera por uma conexão livre suspende a corrotina em vez de bloquear
+    uma thread, então um único processo atende muitas requisições ao mesmo
+    tempo. As conexões pertencem ao event loop em que foram criadas: se o pool
+    passar a ser usado em outro loop, as antigas são abandonadas.
+    """
+
+    def __init__(self, tamanho_min=1, tamanho_max=10, timeout=5.0, intervalo_ping=30.0, max_ociosidade=300.0,
+                 opcoes=None):
+        self.opcoes = opcoes or {}
+        self.tamanho_min = tamanho_min
+        self.tamanho_max = tamanho_max
+        self.timeout = timeout
+        self.intervalo_ping = intervalo_ping
+        self.max_ociosidade = max_ociosidade
+        self._loop = None
+        self._reiniciar()
+
+    def _reiniciar(self):
+        """Zera o estado do pool (usado na criação e na troca de event loop)."""
+        self._cond = None
+        self._ociosas = []  # pilha de (conexão, instante da devolução)
+        self._em_uso = 0
+        self.criadas = 0
+        self.descartadas = 0
+
+    def _condicao(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._reiniciar()
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def obter(self):
+        """Empresta uma conexão, aguardando no máximo self.timeout segundos."""
+        cond = self._condicao()
+        prazo = time.monotonic() + self.timeout
+        async with cond:
+            while not self._ociosas and self._em_uso >= self.tamanho_max:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    raise ErroConexao("Erro: tempo esgotado aguardando conexão livre no pool")
+                try:
+                    await asyncio.wait_for(cond.wait(), restante)
+                except asyncio.TimeoutError:
+                    pass
+            entrada = self._ociosas.pop() if self._ociosas else None
+            self._em_uso += 1
+
+        try:
+            if entrada is None:
+                return await self._criar()
+            conn, devolvida_em = entrada
+            if time.monotonic() - devolvida_em < self.intervalo_ping or await self._saudavel(conn):
+                return conn
+            await self._fechar(conn)
+            return await self._criar()
+        except BaseException:
+            async with cond:
+                self._em_uso -= 1
+                cond.notify()
+            raise
+
+    async def devolver(self, conn, descartar=False):
+        """Devolve uma conexão ao pool; com descartar=True ela é fechada."""
+        cond = self._condicao()
+        excedentes = []
+        async with cond:
+            self._em_uso -= 1
+            if not descartar:
+                agora = time.monotonic()
+                self._ociosas.append((conn, agora))
+                # Fecha as conexões mais antigas que passaram do limite de ociosidade
+                while len(self._ociosas) > self.tamanho_min and agora - self._ociosas[0][1] > self.max_ociosidade:
+                    excedentes.append(self._ociosas.pop(0)[0])
+            cond.notify()
+        if descartar:
+            excedentes.append(conn)
+        for excedente in excedentes:
+            await self._fechar(excedente)
+
+    async def fechar(self):
+        """Fecha todas as conexões ociosas."""
+        ociosas, self._ociosas = self._ociosas, []
+        for conn, _ in ociosas:
+            await self._fechar(conn)
+
+    def estatisticas(self):
+        """Retorna contadores do pool."""
+        return {
+            'ociosas': len(self._ociosas),
+            'em_uso': self._em_uso,
+            'criadas': self.criadas,
+            'descartadas': self.descartadas
+        }
+
+    async def _criar(self):
+        conn = await connect_db(**self.opcoes)
+        contar('conexoes')
+        self.criadas += 1
+        return conn
+
+    async def _saudavel(self, conn):
+        try:
+            await conn.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    async def _fechar(self, conn):
+        self.descartadas += 1
+        try:
+            await conn.close()
+        except Error:
+            pass
+
+
+pool = PoolConexoesAsync(**config_pool)
+roteador = RoteadorReplicas([PoolConexoesAsync(**config_pool, opcoes=replica) for replica in config_replicas['replicas']],
+                            config_replicas['estrategia'], config_replicas['quarentena'])
+
+
+async def _emprestar(leitura):
+    """(pool, conexão) para a operação, com a mesma escolha de réplica do utils._emprestar"""
+    if leitura and _usar_replica(roteador):
+        for replica in roteador.candidatos():
+            try:
+                return replica, await replica.obter()
+            except ErroConexao:
+                roteador.suspender(replica)
+    return pool, await pool.obter()
+
+
+@asynccontextmanager
+async def obter_conexao(leitura=False):
+    """Empresta uma conexão do pool assíncrono (ou de uma réplica, nas leituras) e garante a devolução."""
+    with fase('conexao'):
+        origem, conn = await _emprestar(leitura)
+    descartar = False
+    try:
+        yield conn
+    except BaseException:
+        try:
+            await conn.rollback()
+        except Error:
+            descartar = True
+        raise
+    else:
+        # Encerra o snapshot aberto pelas leituras, como no utils.obter_conexao
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except Error:
+            descartar = True
+    finally:
+        await origem.devolver(conn, descartar)
+
+
+async def _execute(cursor, sql, params=None):
+    """cursor.execute medido pelo metricas.py (tempo de consulta e log de consultas lentas)"""
+    inicio = time.perf_counter()
+    try:
+        await (cursor.execute(sql) if params is None else cursor.execute(sql, params))
+    finally:
+        consulta_executada(sql, params, time.perf_counter() - inicio)
+
+
+# Cursores preparados de cada conexão assíncrona, como no utils.CursorPreparado: {sql: (texto da preparação, cursor)}
+_preparadas = weakref.WeakKeyDictionary()
+
+
+async def _fechar_cursor(cursor):
+    try:
+        await cursor.close()
+    except Error:
+        pass
+
+
+@asynccontextmanager
+async def _cursor_preparado(conn, sql):
+    """(cursor, texto) com sql preparado em conn e reaproveitado entre empréstimos (ver utils.CursorPreparado).
+
+    O texto entregue é o objeto str da preparação, que deve ser passado ao
+    execute; se algo falhar com o cursor em uso, ele é fechado e sai do cache.
+    """
+    if not PREPARADAS:
+        cursor = await conn.cursor()
+        try:
+            yield cursor, sql
+        finally:
+            await cursor.close()
+        return
+    cursores = _preparadas.setdefault(conn, OrderedDict())
+    entrada = cursores.pop(sql, None)
+    if entrada is None:
+        entrada = (sql, await conn.cursor(prepared=True))
+        contar('preparacoes')
+        while len(cursores) >= PREPARADAS_MAX:
+            await _fechar_cursor(cursores.popitem(last=False)[1][1])
+    texto, cursor = entrada
+    try:
+        yield cursor, texto
+        if cursor.with_rows:
+            await cursor.fetchall()  # descarta as linhas não lidas antes da próxima execução
+    except BaseException:
+        await _fechar_cursor(cursor)
+        raise
+    cursores[sql] = entrada
+
+
+async def _executar(sql, params, uma_linha=False, conversor=linhas_para_imoveis):
+    """Executa um SELECT e devolve as linhas como dicionários (ou só a primeira)"""
+    async with obter_conexao(leitura=True) as conn:
+        async with _cursor_preparado(conn, sql) as (cursor, texto):
+            await _execute(cursor, texto, params)
+            with fase('fetch'):
+                linhas = [await cursor.fetchone()] if uma_linha else await cursor.fetchall()
+            if uma_linha:
+                return conversor(cursor, linhas)[0] if linhas[0] else None
+            return conversor(cursor, linhas)
+
+
+async def get_imoveis(cidade=None, tipo=None, limite=None, apos_id=None, antes_id=None, colunas=None,
+                      filtros=None, ordem=None, chave_cursor=None):
+    """Versão assíncrona de utils.get_imoveis (mesmo SQL e mesmas entradas de cache)"""
+    filtros = normaliza_filtros(filtros, cidade=cidade, tipo=tipo)
+    colunas = tuple(colunas or COLUNAS_IMOVEL)
+    ordem = tuple(ordem) if ordem else None
+    chave = chave_lista(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor)
+    if instantaneo_imoveis.precisa_versao():
+        # Lê a versão aqui, para a verificação do instantâneo não bloquear o event loop
+        await get_versao_tabela()
+    imoveis = instantaneo_imoveis.consultar(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor)
+    if imoveis is not AUSENTE:
+        return imoveis
+    tags = _tags_consulta(filtros)
+    imoveis, marca = await _cache(cache_imoveis.obter, chave, tags)
+    if imoveis is AUSENTE:
+        imoveis = await coalescedor_imoveis.executar_async(
+            (chave, _usar_replica(roteador)),
+            lambda: _consulta_imoveis(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor))
+        await _cache(cache_imoveis.gravar, chave, imoveis, tags, marca)
+    return _copia(imoveis)
+
+
+async def _consulta_imoveis(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor):
+    sql, params = monta_consulta_imoveis(filtros, limite, apos_id, antes_id, colunas, ordem, chave_cursor)
+    imoveis = await _executar(sql, params)
+    if antes_id is not None and limite is not None:
+        # A página anterior é lida no sentido inverso; devolve na ordem pedida
+        imoveis.reverse()
+    return imoveis or None
+
+
+async def iterar_imoveis(cidade=None, tipo=None, tamanho_lote=None, colunas=None, filtros=None, ordem=None):
+    """Gera os imóveis em lotes com fetchmany; a conexão é descartada se a leitura for interrompida"""
+    filtros = normaliza_filtros(filtros, cidade=cidade, tipo=tipo)
+    sql, params = monta_consulta_imoveis(filtros, colunas=colunas, ordem=ordem)
+    tamanho_lote = tamanho_lote or LOTE_STREAM
+    with fase('conexao'):
+        origem, conn = await _emprestar(leitura=True)
+    completo = False
+    try:
+        cursor = await conn.cursor(buffered=False)
+        await _execute(cursor, sql, params)
+        nomes = [descricao[0] for descricao in cursor.description]
+        while True:
+            with fase('fetch'):
+                lote = await cursor.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            for row in lote:
+                yield dict(zip(nomes, row))
+        await cursor.close()
+        completo = True
+    finally:
+        await origem.devolver(conn, descartar=not completo)
+
+
+async def buscar_imoveis(termos, filtros=None, limite=None, deslocamento=0, colunas=None):
+    """Versão assíncrona de utils.buscar_imoveis"""
+    filtros = normaliza_filtros(filtros)
+    colunas = tuple(colunas or COLUNAS_IMOVEL)
+    chave = ('busca', termos, tuple(sorted(filtros.items())), limite, deslocamento, colunas)
+    tags = _tags_consulta(filtros)
+    imoveis, marca = await _cache(cache_imoveis.obter, chave, tags)
+    if imoveis is AUSENTE:
+        sql, params = monta_consulta_busca(termos, filtros, limite, deslocamento, colunas)
+        imoveis = await _executar(sql, params)
+        await _cache(cache_imoveis.gravar, chave, imoveis, tags, marca)
+    return _copia(imoveis)
+
+
+async def get_estatisticas(filtros=None, agrupamento=(), agregados=AGREGADOS_PADRAO):
+    """Versão assíncrona de utils.get_estatisticas"""
+    filtros = normaliza_filtros(filtros)
+    chave = chave_estatisticas(filtros, agrupamento, agregados)
+    tags = _tags_consulta(filtros)
+    grupos, marca = await _cache(cache_imoveis.obter, chave, tags)
+    if grupos is AUSENTE:
+        sql, params = monta_consulta_estatisticas(filtros, agrupamento, agregados)
+        grupos = await _executar(sql, params, conversor=linhas_para_estatisticas)
+        await _cache(cache_imoveis.gravar, chave, grupos, tags, marca)
+    return _copia(grupos)
+
+
+async def get_imovel_por_id(imovel_id, colunas=None):
+    """Versão assíncrona de utils.get_imovel_por_id"""
+    colunas = tuple(colunas or COLUNAS_IMOVEL)
+    tags = [('id', imovel_id)]
+    chave = ('id', imovel_id, colunas)
+    imovel, marca = await _cache(cache_imoveis.obter, chave, tags)
+    if imovel is AUSENTE:
+        imovel = await _executar(f"SELECT {', '.join(colunas)} FROM imoveis WHERE id = %s", (imovel_id,), uma_linha=True)
+        await _cache(cache_imoveis.gravar, chave, imovel, tags, marca)
+    return _copia(imovel)
+
+
+async def get_versao_tabela():
+    """Versão assíncrona de utils.get_versao_tabela (mesma entrada do cache)"""
+    versao, marca = await _cache(cache_imoveis.obter, CHAVE_VERSAO, [TAG_VERSAO])
+    if versao is AUSENTE:
+        async with obter_conexao(leitura=True) as conn:
+            async with _cursor_preparado(conn, CONSULTA_VERSAO) as (cursor, texto):
+                await _execute(cursor, texto)
+                with fase('fetch'):
+                    linha = await cursor.fetchone()
+        versao = (linha[0], linha[1]) if linha else (0, None)
+        await _cache(cache_imoveis.gravar, CHAVE_VERSAO, versao, [TAG_VERSAO], marca)
+    instantaneo_imoveis.observar_versao(versao[0])
+    return versao
+
+
+async def get_alteracoes(desde, limite):
+    """Versão assíncrona de utils.get_alteracoes"""
+    sql, params = monta_consulta_alteracoes(desde, limite)
+    async with obter_conexao(leitura=True) as conn:
+        async with _cursor_preparado(conn, INICIO_ALTERACOES) as (cursor, texto):
+            await _execute(cursor, texto)
+            with fase('fetch'):
+                linha = await cursor.fetchone()
+        async with _cursor_preparado(conn, sql) as (cursor, texto):
+            await _execute(cursor, texto, params)
+            with fase('fetch'):
+                alteracoes = linhas_para_alteracoes(cursor, await cursor.fetchall())
+    return alteracoes, linha[0] if linha else None
@@ -1,82 +1,827 @@
-from flask import jsonify, request
-from utils import get_imoveis, get_imovel_por_id, adicionar_imovel_db, atualizar_imovel_db, remover_imovel_db, adiciona_hateoas_link, adiciona_hateoas_em_lista
+import json
+import math
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Response, current_app, jsonify, make_response, request
+from werkzeug.http import http_date
+import metricas
+from utils import pool, roteador, config_replicas, get_imoveis, iterar_imoveis, get_imovel_por_id, get_versao_tabela, adicionar_imovel_db, atualizar_imovel_db, alterar_imovel_db, remover_imovel_db, adicionar_imoveis_db, atualizar_imoveis_db, remover_imoveis_db, adiciona_hateoas_link, adiciona_hateoas_em_lista, projecao, normaliza_filtros, get_estatisticas, get_alteracoes, percentil, buscar_imoveis, termos_busca, cache_imoveis, instantaneo_imoveis, fila_escritas, coalescedor_imoveis, CAMPOS_IMOVEL, COLUNAS_PROJETAVEIS, RAIO_MAX, BULK_MAX, PAGINA_MAX, PAGINA_PADRAO, FILTROS_IGUALDADE, FILTROS_FAIXA, COLUNAS_ORDENAVEIS, AGRUPAMENTOS, AGREGADOS, AGREGADOS_PADRAO, BUSCA_PADRAO, ALTERACOES_PAGINA, ALTERACOES_MAX, ALTERACOES_ESPERA_MAX, ALTERACOES_INTERVALO, ALTERACOES_SSE_DURACAO, ALTERACOES_ESPERA_SYNC, ALTERACOES_SSE_SYNC
 
-def listar_imoveis():
-    """GET /imoveis - Lista todos os imóveis"""
-    cidade = request.args.get('cidade')
-    tipo = request.args.get('tipo')
-    imoveis = get_imoveis(cidade=cidade, tipo=tipo)
-    
+# As funções sem prefixo _ recebem a query string (args) ou a requisição já lida
+# e não dependem do Flask: são compartilhadas com o modo assíncrono (api_async.py)
+
+# Parâmetros que posicionam a página; os demais são repetidos nos links next/prev
+PARAMETROS_CURSOR = ('limit', 'after_id', 'before_id', 'after_key', 'before_key', 'offset')
+
+PARAMETROS_INVALIDOS = {'erro': 'Parâmetros de paginação inválidos'}, 400
+CAMPOS_INVALIDOS = {'erro': f"Campos inválidos; use: {', '.join(COLUNAS_PROJETAVEIS)}"}, 400
+NENHUM_IMOVEL = {"erro": "Nenhum imóvel encontrado"}, 404
+IMOVEL_NAO_ENCONTRADO = {'erro': 'Imóvel não encontrado'}, 404
+DADOS_NAO_FORNECIDOS = {'erro': 'Dados não fornecidos'}, 400
+BUSCA_SEM_TEXTO = {'erro': 'Informe o texto da busca em q='}, 400
+ESTATISTICAS_INVALIDAS = {'erro': f"Estatísticas inválidas; group_by aceita {', '.join(AGRUPAMENTOS)} "
+                                  f"e metrics aceita {', '.join(AGREGADOS)} ou pN (p50, p90...)"}, 400
+
+# Leitura após escrita: por DB_REPLICAS_ATRASO_MAX segundos depois de uma escrita
+# o cliente leva este cookie, e os GET dele vão ao primário. Clientes sem cookies
+# podem pedir o mesmo com o cabeçalho X-Consistencia: primario
+COOKIE_PRIMARIO = 'imoveis_primario'
+METODOS_LEITURA = ('GET', 'HEAD')
+
+def leitura_em_replica(req):
+    """Indica se as leituras da requisição podem ir para uma réplica"""
+    return (req.method in METODOS_LEITURA and COOKIE_PRIMARIO not in req.cookies
+            and req.headers.get('X-Consistencia') != 'primario')
+
+def marcar_escrita(response, req):
+    """Após uma escrita bem-sucedida, fixa as próximas leituras do cliente no primário"""
+    if config_replicas['replicas'] and req.method not in METODOS_LEITURA and response.status_code < 400:
+        response.set_cookie(COOKIE_PRIMARIO, '1', max_age=math.ceil(config_replicas['atraso_max']),
+                            httponly=True, samesite='Lax')
+    return response
+
+def validadores(versao, atualizado_em, formato=None):
+    """ETag e Last-Modified da versão atual da tabela (a exportação NDJSON tem ETag próprio)"""
+    etag = f'v{versao}-ndjson' if formato == 'ndjson' else f'v{versao}'
+    ultima_alteracao = None
+    if isinstance(atualizado_em, datetime):
+        ultima_alteracao = atualizado_em.replace(microsecond=0, tzinfo=timezone.utc)
+    return etag, ultima_alteracao
+
+def nao_modificado(req, etag, ultima_alteracao):
+    """Indica se a cópia do cliente (If-None-Match ou If-Modified-Since) ainda é a atual"""
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag)
+    desde = req.if_modified_since
+    return bool(desde and ultima_alteracao and ultima_alteracao <= desde)
+
+def aplica_validadores(response, etag, ultima_alteracao):
+    response.set_etag(etag)
+    if ultima_alteracao:
+        response.last_modified = ultima_alteracao
+    return response
+
+def condicional(view):
+    """Acrescenta ETag/Last-Modified à resposta e responde 304 a requisições condicionais.
+
+    Os validadores vêm do contador de alterações da tabela (uma leitura por
+    chave primária), lido antes da consulta principal: se o cliente já tem a
+    versão atual, a resposta 304 sai sem executar o SELECT nem montar os links.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, ultima_alteracao = validadores(*get_versao_tabela(), formato_stream(request))
+        if nao_modificado(request, etag, ultima_alteracao):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        return aplica_validadores(response, etag, ultima_alteracao)
+    return wrapper
+
+def _parametros_paginacao(args):
+    """Lê limit/after_id/before_id da query string; retorna None se forem inválidos"""
+    try:
+        limite = int(args['limit']) if 'limit' in args else None
+        apos_id = int(args['after_id']) if 'after_id' in args else None
+        antes_id = int(args['before_id']) if 'before_id' in args else None
+    except ValueError:
+        return None
+    if (limite is not None and limite <= 0) or (apos_id is not None and antes_id is not None):
+        return None
+    if limite is None and (apos_id is not None or antes_id is not None or PAGINA_PADRAO > 0):
+        limite = PAGINA_PADRAO or PAGINA_MAX
+    if limite is not None:
+        limite = min(limite, PAGINA_MAX)
+    return limite, apos_id, antes_id
+
+def parametros_projecao(args, coluna_ordem=None):
+    """Lê fields= (lista branca de colunas) e links=; retorna None se houver campo inválido"""
+    com_links = args.get('links', '1').lower() not in ('0', 'false')
+    campos = [campo.strip() for campo in args.get('fields', '').split(',') if campo.strip()]
+    if any(campo not in COLUNAS_PROJETAVEIS for campo in campos):
+        return None
+    return projecao(campos, com_links, coluna_ordem), com_links
+
+def _parametros_consulta(args, cidade=None, tipo=None):
+    """Lê filtros e sort= da query string; retorna (filtros, ordem) ou None se inválidos.
+
+    Colunas de igualdade aceitam o parâmetro repetido (?cidade=A&cidade=B vira
+    IN); faixas usam coluna_min/coluna_max, e cep_prefix=01452 equivale à faixa
+    01452000-01452999. near=lat,lon com radius= (metros, padrão 1000) restringe a
+    um círculo. sort=-coluna ordena decrescente.
+    """
+    filtros = {coluna: args.getlist(coluna) for coluna in FILTROS_IGUALDADE if coluna in args}
+    try:
+        for coluna, conversor in FILTROS_FAIXA.items():
+            for sufixo in ('min', 'max'):
+                nome = f'{coluna}_{sufixo}'
+                if nome in args:
+                    filtros[nome] = conversor(args[nome])
+        if 'cep_prefix' in args:
+            prefixo = args['cep_prefix'].replace('-', '')
+            if not (prefixo.isdigit() and len(prefixo) <= 8):
+                return None
+            filtros['cep_min'] = max(filtros.get('cep_min', 0), int(prefixo.ljust(8, '0')))
+            filtros['cep_max'] = min(filtros.get('cep_max', 99999999), int(prefixo.ljust(8, '9')))
+        if 'near' in args:
+            latitude, longitude = (float(parte) for parte in args['near'].split(','))
+            raio = float(args.get('radius', 1000))
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < raio <= RAIO_MAX):
+                return None
+            filtros['near'] = (latitude, longitude, raio)
+    except ValueError:
+        return None
+    ordem = None
+    if 'sort' in args:
+        campo = args['sort']
+        ordem = (campo.lstrip('-'), campo.startswith('-'))
+        if ordem[0] not in COLUNAS_ORDENAVEIS:
+            return None
+    return normaliza_filtros(filtros, cidade=cidade, tipo=tipo), ordem
+
+# Marca um cursor com sort= cujo after_key/before_key falta ou não converte
+_INVALIDO = object()
+
+def _chave_cursor(args, ordem, apos_id, antes_id):
+    """Valor da coluna de sort= no cursor (after_key/before_key); _INVALIDO se faltar ou não converter"""
+    if not ordem or ordem[0] == 'id' or (apos_id is None and antes_id is None):
+        return None
+    texto = args.get('after_key' if apos_id is not None else 'before_key')
+    if texto is None:
+        return _INVALIDO
+    try:
+        return FILTROS_FAIXA.get(ordem[0], str)(texto)
+    except ValueError:
+        return _INVALIDO
+
+def _link_pagina(args, base, limite, **cursor):
+    """Monta o link de uma página preservando filtros, ordenação e projeção da query string"""
+    params = [(chave, valor) for chave, valor in args.items(multi=True) if chave not in PARAMETROS_CURSOR]
+    params += [('limit', limite)] + list(cursor.items())
+    return f'{base}?{urlencode(params)}'
+
+def formato_stream(req):
+    """Indica se o cliente pediu exportação em streaming: 'ndjson', 'json' ou None"""
+    melhor = req.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    if melhor == 'application/x-ndjson':
+        return 'ndjson'
+    if req.args.get('stream', '').lower() in ('1', 'true'):
+        return 'json'
+    return None
+
+def abertura_json(self_link, json):
+    """Início da coleção exportada em streaming, no mesmo formato do jsonify"""
+    # Começa pelos links (ordem alfabética de chaves, como o jsonify) para que
+    # o primeiro byte saia antes de a consulta terminar
+    links = json.dumps({'self': self_link, 'create': '/imoveis'}, separators=(',', ':'))
+    return f'{{"_links":{links},"imoveis":['
+
+FECHAMENTO_JSON = ']}\n'
+
+def item_stream(imovel, json, com_links=True):
+    """Um imóvel serializado (com links, se pedidos) para as exportações em streaming"""
+    return json.dumps(adiciona_hateoas_link(imovel) if com_links else imovel, separators=(',', ':'))
+
+def _gera_json(imoveis, self_link, json, com_links=True):
+    """Gera a coleção no mesmo formato do jsonify, um imóvel por vez"""
+    yield abertura_json(self_link, json)
+    separador = ''
+    for imovel in imoveis:
+        yield separador + item_stream(imovel, json, com_links)
+        separador = ','
+    yield FECHAMENTO_JSON
+
+def _gera_ndjson(imoveis, json, com_links=True):
+    """Gera um imóvel (com links, se pedidos) por linha (application/x-ndjson)"""
+    for imovel in imoveis:
+        yield item_stream(imovel, json, com_links) + '\n'
+
+def _responder_stream(formato, self_link, plano):
+    """Exporta a coleção completa sem montá-la inteira em memória"""
+    imoveis = iterar_imoveis(filtros=plano['filtros'], ordem=plano['ordem'], colunas=plano['colunas'])
+    if formato == 'ndjson':
+        return Response(_gera_ndjson(imoveis, current_app.json, plano['com_links']), mimetype='application/x-ndjson')
+    return Response(_gera_json(imoveis, self_link, current_app.json, plano['com_links']), mimetype='application/json')
+
+def _cursor_link(imovel, ordem, prefixo):
+    """Parâmetros do cursor que apontam para o imóvel (id e, com sort=, o valor da coluna)"""
+    cursor = {f'{prefixo}_id': imovel['id']}
+    if ordem and ordem[0] != 'id':
+        cursor[f'{prefixo}_key'] = imovel[ordem[0]]
+    return cursor
+
+def preparar_lista(args, cidade=None, tipo=None):
+    """Valida a query string de uma listagem.
+
+    Retorna (plano, None), com filtros, ordem, cursor e projeção já validados,
+    ou (None, resposta de erro).
+    """
+    paginacao = _parametros_paginacao(args)
+    consulta = _parametros_consulta(args, cidade=cidade, tipo=tipo)
+    if paginacao is None or consulta is None:
+        return None, PARAMETROS_INVALIDOS
+    limite, apos_id, antes_id = paginacao
+    filtros, ordem = consulta
+    chave_cursor = _chave_cursor(args, ordem, apos_id, antes_id)
+    if chave_cursor is _INVALIDO:
+        return None, PARAMETROS_INVALIDOS
+    projecao_pedida = parametros_projecao(args, coluna_ordem=ordem[0] if ordem else None)
+    if projecao_pedida is None:
+        return None, CAMPOS_INVALIDOS
+    colunas, com_links = projecao_pedida
+    plano = {
+        'filtros': filtros, 'ordem': ordem, 'limite': limite, 'apos_id': apos_id, 'antes_id': antes_id,
+        'chave_cursor': chave_cursor, 'colunas': colunas, 'com_links': com_links
+    }
+    return plano, None
+
+def consulta_do_plano(plano):
+    """Argumentos de get_imoveis para o plano da listagem"""
+    consulta = {'filtros': plano['filtros'], 'ordem': plano['ordem'], 'colunas': plano['colunas']}
+    if plano['limite'] is not None:
+        # Pede um registro a mais para saber se existe página seguinte (ou anterior)
+        consulta.update(limite=plano['limite'] + 1, apos_id=plano['apos_id'], antes_id=plano['antes_id'],
+                        chave_cursor=plano['chave_cursor'])
+    return consulta
+
+def montar_lista(imoveis, plano, args, self_link):
+    """Corpo HATEOAS da coleção (com next/prev quando paginada) ou o erro 404"""
     if not imoveis:
-        return {"erro": "Nenhum imóvel encontrado"}, 404
-    
-    result = adiciona_hateoas_em_lista(imoveis)
-    return jsonify(result)
+        return NENHUM_IMOVEL
+    limite, com_links = plano['limite'], plano['com_links']
+    if limite is None:
+        return adiciona_hateoas_em_lista(imoveis, self_link=self_link, links_itens=com_links)
+
+    if plano['antes_id'] is not None:
+        tem_anterior = len(imoveis) > limite
+        imoveis = imoveis[-limite:]
+        tem_proxima = True
+    else:
+        tem_proxima = len(imoveis) > limite
+        imoveis = imoveis[:limite]
+        tem_anterior = plano['apos_id'] is not None
+    ordem = plano['ordem']
+    proximo = _link_pagina(args, self_link, limite, **_cursor_link(imoveis[-1], ordem, 'after')) if tem_proxima else None
+    anterior = _link_pagina(args, self_link, limite, **_cursor_link(imoveis[0], ordem, 'before')) if tem_anterior else None
+    return adiciona_hateoas_em_lista(imoveis, self_link=self_link, proximo=proximo, anterior=anterior, links_itens=com_links)
+
+def _responder_lista(self_link, cidade=None, tipo=None):
+    """Busca a página pedida e monta a resposta HATEOAS da coleção"""
+    plano, erro = preparar_lista(request.args, cidade=cidade, tipo=tipo)
+    if erro:
+        return erro
+    formato = formato_stream(request)
+    if plano['limite'] is None and formato:
+        return _responder_stream(formato, self_link, plano)
+    return montar_lista(get_imoveis(**consulta_do_plano(plano)), plano, request.args, self_link)
+
+@condicional
+def listar_imoveis():
+    """GET /imoveis - Lista os imóveis (filtros, sort= e paginação com limit/after_id/before_id)"""
+    return _responder_lista('/imoveis')
+
+def montar_imovel(imovel, com_links=True):
+    """Corpo de GET /imoveis/<id> ou o erro 404"""
+    if not imovel:
+        return IMOVEL_NAO_ENCONTRADO
+    return adiciona_hateoas_link(imovel) if com_links else imovel
+
+def colunas_com_versao(colunas):
+    """Colunas de GET /imoveis/<id> acrescidas de versao, que vira o ETag da resposta"""
+    return colunas if 'versao' in colunas else colunas + ('versao',)
+
+def responder_imovel(req, imovel, colunas, com_links=True, atualizado_em=None):
+    """GET /imoveis/<id> com o ETag da versão do imóvel ("4"), o mesmo aceito no If-Match do PATCH.
+
+    O Last-Modified é o da tabela (atualizado_em do contador de alterações,
+    lido antes do imóvel): nunca é anterior à última alteração da linha. Com
+    If-None-Match igual à versão atual, ou If-Modified-Since não anterior a
+    ele, a resposta é 304. A versão só vai no corpo se foi pedida em fields=.
+    """
+    if not imovel:
+        return IMOVEL_NAO_ENCONTRADO
+    versao = str(imovel['versao'])
+    _, ultima_alteracao = validadores(imovel['versao'], atualizado_em)
+    cabecalhos = {'ETag': f'"{versao}"'}
+    if ultima_alteracao:
+        cabecalhos['Last-Modified'] = http_date(ultima_alteracao)
+    if nao_modificado(req, versao, ultima_alteracao):
+        return '', 304, cabecalhos
+    if 'versao' not in colunas:
+        del imovel['versao']
+    return montar_imovel(imovel, com_links), 200, cabecalhos
 
 def buscar_imovel_por_id(imovel_id):
-    """GET /imoveis/<id> - Busca imóvel por ID"""
-    imovel = get_imovel_por_id(imovel_id)
-    
-    if imovel:
-        imovel_com_links = adiciona_hateoas_link(imovel)
-        return jsonify(imovel_com_links)
-    
-    return jsonify({'erro': 'Imóvel não encontrado'}), 404
+    """GET /imoveis/<id> - Busca imóvel por ID (aceita fields= e links=0)"""
+    projecao_pedida = parametros_projecao(request.args)
+    if projecao_pedida is None:
+        return CAMPOS_INVALIDOS
+    colunas, com_links = projecao_pedida
+    # A versão da tabela é lida antes do imóvel, para o Last-Modified não passar da linha lida
+    _, atualizado_em = get_versao_tabela()
+    imovel = get_imovel_por_id(imovel_id, colunas=colunas_com_versao(colunas))
+    return responder_imovel(request, imovel, colunas, com_links, atualizado_em)
 
-def adicionar_imovel():
-    """POST /imoveis - Adiciona um novo imóvel"""
-    dados = request.get_json()
+def campos_ausentes(dados):
+    """Campos de CAMPOS_IMOVEL que faltam no imóvel (todos, se o corpo não for um objeto)"""
+    return [campo for campo in CAMPOS_IMOVEL if not isinstance(dados, dict) or campo not in dados]
+
+def _erro_campos_ausentes(faltando):
+    return f"Campos obrigatórios ausentes: {', '.join(faltando)}"
+
+def processar_adicao(dados):
+    """Grava o imóvel de POST /imoveis e devolve (corpo, status)"""
     if not dados:
-        return jsonify({'erro': 'Dados não fornecidos'}), 400
+        return DADOS_NAO_FORNECIDOS
+    # Validado antes da gravação: com a fila de escritas, o erro não alcança o lote dos outros
+    faltando = campos_ausentes(dados)
+    if faltando:
+        return {'erro': _erro_campos_ausentes(faltando)}, 400
     novo_id = adicionar_imovel_db(dados)
-    
+
     response = dados.copy()
     response['id'] = novo_id
-    
+
     response_com_links = adiciona_hateoas_link(response)
-    return jsonify(response_com_links), 201
+    return response_com_links, 201
 
-def atualizar_imovel(imovel_id):
-    """PUT /imoveis/<id> - Atualiza um imóvel existente"""
-    dados = request.get_json()
+def adicionar_imovel():
+    """POST /imoveis - Adiciona um novo imóvel"""
+    return processar_adicao(request.get_json())
+
+def processar_atualizacao(imovel_id, dados):
+    """Grava o imóvel de PUT /imoveis/<id> e devolve (corpo, status)"""
     if not dados:
-        return jsonify({'erro': 'Dados não fornecidos'}), 400
-    
+        return DADOS_NAO_FORNECIDOS
+    faltando = campos_ausentes(dados)
+    if faltando:
+        return {'erro': _erro_campos_ausentes(faltando)}, 400
+
     linhas_afetadas = atualizar_imovel_db(imovel_id, dados)
     if linhas_afetadas > 0:
         response = dados.copy()
         response['id'] = imovel_id
-        
+
         response_com_links = adiciona_hateoas_link(response)
-        return jsonify(response_com_links), 200
-    
-    return jsonify({'erro': 'Imóvel não encontrado'}), 404
+        return response_com_links, 200
 
-def remover_imovel(imovel_id):
-    """DELETE /imoveis/<id> - Remove um imóvel existente"""
+    return IMOVEL_NAO_ENCONTRADO
+
+def atualizar_imovel(imovel_id):
+    """PUT /imoveis/<id> - Atualiza um imóvel existente"""
+    return processar_atualizacao(imovel_id, request.get_json())
+
+def versao_if_match(req):
+    """Versão do imóvel exigida em If-Match ("3"): None sem o cabeçalho ou com *, _INVALIDO se não for uma versão
+
+    Aceita também o ETag fraco (W/"3") que o GET /imoveis/<id> devolve quando a resposta é comprimida.
+    """
+    if not req.if_match or req.if_match.star_tag:
+        return None
+    for etag in req.if_match.as_set(include_weak=True):
+        if etag.isdigit():
+            return int(etag)
+    return _INVALIDO
+
+def processar_atualizacao_parcial(imovel_id, dados, versao=None):
+    """Grava só as colunas enviadas em PATCH /imoveis/<id> e devolve (corpo, status, cabeçalhos).
+
+    A versão esperada vem de If-Match (versao) ou do campo versao do corpo;
+    se o imóvel já estiver em outra versão, nada é gravado e a resposta é 412
+    com a versão atual. A resposta traz o imóvel como ficou gravado.
+    """
+    if not dados or not isinstance(dados, dict):
+        return DADOS_NAO_FORNECIDOS
+    if versao is None:
+        versao = dados.get('versao')
+    if versao is _INVALIDO or (versao is not None and (not isinstance(versao, int) or isinstance(versao, bool))):
+        return {'erro': 'Versão do imóvel inválida em If-Match ou versao'}, 412
+    colunas = {campo: dados[campo] for campo in CAMPOS_IMOVEL if campo in dados}
+    if not colunas:
+        return {'erro': 'Nenhum campo para atualizar'}, 400
+
+    linhas_alteradas, imovel = alterar_imovel_db(imovel_id, colunas, versao)
+    if imovel is None:
+        return IMOVEL_NAO_ENCONTRADO
+    if linhas_alteradas == 0:
+        return {'erro': 'O imóvel foi alterado por outra requisição', 'versao': imovel['versao']}, 412, {'ETag': f'"{imovel["versao"]}"'}
+    return adiciona_hateoas_link(imovel), 200, {'ETag': f'"{imovel["versao"]}"'}
+
+def atualizar_imovel_parcial(imovel_id):
+    """PATCH /imoveis/<id> - Atualiza só as colunas enviadas, com If-Match opcional"""
+    return processar_atualizacao_parcial(imovel_id, request.get_json(silent=True), versao_if_match(request))
+
+def processar_remocao(imovel_id):
+    """Remove o imóvel de DELETE /imoveis/<id> e devolve (corpo, status)"""
     linhas_afetadas = remover_imovel_db(imovel_id)
     if linhas_afetadas > 0:
-        return '', 204  
-    return jsonify({'erro': 'Imóvel não encontrado'}), 404
+        return '', 204
+    return IMOVEL_NAO_ENCONTRADO
+
+def remover_imovel(imovel_id):
+    """DELETE /imoveis/<id> - Remove um imóvel existente"""
+    return processar_remocao(imovel_id)
 
+@condicional
 def listar_imoveis_por_tipo(tipo):
     """GET /imoveis/tipo/<tipo> - rota para imóveis por tipo específico"""
-    imoveis = get_imoveis(tipo=tipo)
-    
-    if not imoveis:
-        return {"erro": "Nenhum imóvel encontrado"}, 404
-    
-    result = adiciona_hateoas_em_lista(imoveis)
-    result['_links']['self'] = f'/imoveis/tipo/{tipo}'
-    return jsonify(result)
+    return _responder_lista(f'/imoveis/tipo/{tipo}', tipo=tipo)
 
+@condicional
 def listar_imoveis_por_cidade(cidade):
     """GET /imoveis/cidade/<cidade> - rota para imóveis por cidade específica"""
-    imoveis = get_imoveis(cidade=cidade)
-    
-    if not imoveis:
-        return {"erro": "Nenhum imóvel encontrado"}, 404
-    
-    result = adiciona_hateoas_em_lista(imoveis)
-    result['_links']['self'] = f'/imoveis/cidade/{cidade}'
-    return jsonify(result)
\ No newline at end of file
+    return _responder_lista(f'/imoveis/cidade/{cidade}', cidade=cidade)
+
+def preparar_busca(args):
+    """Valida a query string de /imoveis/search (q=, limit=, offset=, filtros e projeção).
+
+    Retorna (plano, None) ou (None, resposta de erro).
+    """
+    termos = termos_busca(args.get('q'))
+    consulta = _parametros_consulta(args)
+    try:
+        limite = int(args.get('limit', BUSCA_PADRAO))
+        deslocamento = int(args.get('offset', 0))
+    except ValueError:
+        return None, PARAMETROS_INVALIDOS
+    if consulta is None or limite <= 0 or deslocamento < 0:
+        return None, PARAMETROS_INVALIDOS
+    if not termos:
+        return None, BUSCA_SEM_TEXTO
+    projecao_pedida = parametros_projecao(args)
+    if projecao_pedida is None:
+        return None, CAMPOS_INVALIDOS
+    colunas, com_links = projecao_pedida
+    plano = {
+        'termos': termos, 'filtros': consulta[0], 'limite': min(limite, PAGINA_MAX),
+        'deslocamento': deslocamento, 'colunas': colunas, 'com_links': com_links
+    }
+    return plano, None
+
+def consulta_da_busca(plano):
+    """Argumentos de buscar_imoveis para o plano da busca (um registro a mais indica a próxima página)"""
+    return {'termos': plano['termos'], 'filtros': plano['filtros'], 'limite': plano['limite'] + 1,
+            'deslocamento': plano['deslocamento'], 'colunas': plano['colunas']}
+
+def montar_busca(imoveis, plano, args, self_link='/imoveis/search'):
+    """Corpo HATEOAS da busca; sem resultados, a coleção vem vazia (não 404), como espera um autocompletar"""
+    limite, deslocamento = plano['limite'], plano['deslocamento']
+    proximo = _link_pagina(args, self_link, limite, offset=deslocamento + limite) if len(imoveis) > limite else None
+    anterior = _link_pagina(args, self_link, limite, offset=max(deslocamento - limite, 0)) if deslocamento else None
+    return adiciona_hateoas_em_lista(imoveis[:limite], self_link=self_link, proximo=proximo, anterior=anterior,
+                                     links_itens=plano['com_links'])
+
+@condicional
+def pesquisar_imoveis():
+    """GET /imoveis/search - Busca por trecho de logradouro, bairro ou cidade, ordenada por relevância"""
+    plano, erro = preparar_busca(request.args)
+    if erro:
+        return erro
+    return montar_busca(buscar_imoveis(**consulta_da_busca(plano)), plano, request.args)
+
+def _lista_parametro(args, nome):
+    """Valores separados por vírgula de um parâmetro, sem repetições e na ordem pedida"""
+    valores = [valor.strip() for valor in args.get(nome, '').split(',') if valor.strip()]
+    return tuple(dict.fromkeys(valores))
+
+def preparar_estatisticas(args):
+    """Valida a query string de /imoveis/stats (group_by=, metrics= e os filtros da listagem).
+
+    Retorna (plano, None), com os argumentos de get_estatisticas, ou (None, resposta de erro).
+    """
+    consulta = _parametros_consulta(args)
+    if consulta is None:
+        return None, PARAMETROS_INVALIDOS
+    agrupamento = _lista_parametro(args, 'group_by')
+    agregados = _lista_parametro(args, 'metrics') or AGREGADOS_PADRAO
+    if (any(nome not in AGRUPAMENTOS for nome in agrupamento)
+            or any(nome not in AGREGADOS and percentil(nome) is None for nome in agregados)):
+        return None, ESTATISTICAS_INVALIDAS
+    return {'filtros': consulta[0], 'agrupamento': agrupamento, 'agregados': agregados}, None
+
+def montar_estatisticas(grupos, args):
+    """Corpo de /imoveis/stats, com o link da listagem que tem as mesmas linhas"""
+    filtros = [(chave, valor) for chave, valor in args.items(multi=True) if chave not in ('group_by', 'metrics')]
+    return {
+        'grupos': grupos,
+        '_links': {
+            'self': f'/imoveis/stats?{urlencode(list(args.items(multi=True)))}' if args else '/imoveis/stats',
+            'imoveis': f'/imoveis?{urlencode(filtros)}' if filtros else '/imoveis'
+        }
+    }
+
+@condicional
+def estatisticas_imoveis():
+    """GET /imoveis/stats - Agregados de valor (count, sum, avg, min, max, pN) por cidade, tipo, bairro ou ano"""
+    plano, erro = preparar_estatisticas(request.args)
+    if erro:
+        return erro
+    return montar_estatisticas(get_estatisticas(**plano), request.args)
+
+def ler_itens_bulk(mimetype, texto):
+    """Itens do corpo das rotas /imoveis/bulk: array JSON ou NDJSON (um objeto por linha)"""
+    try:
+        if mimetype == 'application/x-ndjson':
+            return [json.loads(linha) for linha in texto.splitlines() if linha.strip()]
+        if mimetype != 'application/json' and not mimetype.endswith('+json'):
+            return None
+        itens = json.loads(texto)
+    except ValueError:
+        return None
+    return itens if isinstance(itens, list) else None
+
+def _ler_itens_bulk():
+    return ler_itens_bulk(request.mimetype, request.get_data(as_text=True))
+
+def _resposta_bulk(resultados, status_sucesso):
+    """Monta a resposta com o status de cada item; 207 se algum item falhou"""
+    falhas = sum(1 for resultado in resultados if resultado['status'] >= 400)
+    corpo = {
+        'resultados': resultados,
+        'total': len(resultados),
+        'sucesso': len(resultados) - falhas,
+        'falhas': falhas
+    }
+    return corpo, 207 if falhas else status_sucesso
+
+def _validar_lote(itens):
+    """Erro (resposta) para corpo inválido ou acima do limite de linhas por transação"""
+    if not itens:
+        return DADOS_NAO_FORNECIDOS
+    if len(itens) > BULK_MAX:
+        return {'erro': f'Máximo de {BULK_MAX} imóveis por requisição'}, 413
+    return None
+
+def _id_do_item(item):
+    """Id de um item de PATCH/DELETE em lote (objeto com 'id' ou o próprio número)"""
+    imovel_id = item.get('id') if isinstance(item, dict) else item
+    return imovel_id if isinstance(imovel_id, int) and not isinstance(imovel_id, bool) else None
+
+def processar_adicao_em_lote(itens):
+    """Grava os itens de POST /imoveis/bulk em uma transação e devolve (corpo, status)"""
+    erro = _validar_lote(itens)
+    if erro:
+        return erro
+
+    resultados = [None] * len(itens)
+    validos = []
+    for indice, item in enumerate(itens):
+        faltando = campos_ausentes(item)
+        if faltando:
+            resultados[indice] = {'indice': indice, 'status': 400, 'erro': _erro_campos_ausentes(faltando)}
+        else:
+            validos.append((indice, item))
+
+    ids = adicionar_imoveis_db([item for _, item in validos])
+    for (indice, _), novo_id in zip(validos, ids):
+        resultados[indice] = {'indice': indice, 'status': 201, 'id': novo_id, '_links': {'self': f'/imoveis/{novo_id}'}}
+    return _resposta_bulk(resultados, 201)
+
+def adicionar_imoveis_em_lote():
+    """POST /imoveis/bulk - Adiciona vários imóveis em uma transação"""
+    return processar_adicao_em_lote(_ler_itens_bulk())
+
+def processar_atualizacao_em_lote(itens):
+    """Grava os itens de PATCH /imoveis/bulk (só as colunas enviadas) e devolve (corpo, status)"""
+    erro = _validar_lote(itens)
+    if erro:
+        return erro
+
+    resultados = [None] * len(itens)
+    validos = []
+    for indice, item in enumerate(itens):
+        imovel_id = _id_do_item(item)
+        if imovel_id is None or not isinstance(item, dict):
+            resultados[indice] = {'indice': indice, 'status': 400, 'erro': 'Id ausente ou inválido'}
+        elif not any(campo in item for campo in CAMPOS_IMOVEL):
+            resultados[indice] = {'indice': indice, 'status': 400, 'erro': 'Nenhum campo para atualizar'}
+        else:
+            dados = {campo: item[campo] for campo in CAMPOS_IMOVEL if campo in item}
+            dados['id'] = imovel_id
+            validos.append((indice, dados))
+
+    atualizados = atualizar_imoveis_db([dados for _, dados in validos])
+    for indice, dados in validos:
+        if dados['id'] in atualizados:
+            resultados[indice] = {'indice': indice, 'status': 200, 'id': dados['id'], '_links': {'self': f"/imoveis/{dados['id']}"}}
+        else:
+            resultados[indice] = {'indice': indice, 'status': 404, 'id': dados['id'], 'erro': 'Imóvel não encontrado'}
+    return _resposta_bulk(resultados, 200)
+
+def atualizar_imoveis_em_lote():
+    """PATCH /imoveis/bulk - Atualiza vários imóveis (só as colunas enviadas) em uma transação"""
+    return processar_atualizacao_em_lote(_ler_itens_bulk())
+
+def processar_remocao_em_lote(itens):
+    """Remove os ids de DELETE /imoveis/bulk em uma transação e devolve (corpo, status)"""
+    erro = _validar_lote(itens)
+    if erro:
+        return erro
+
+    ids = [_id_do_item(item) for item in itens]
+    removidos = remover_imoveis_db([imovel_id for imovel_id in ids if imovel_id is not None])
+    resultados = []
+    for indice, imovel_id in enumerate(ids):
+        if imovel_id is None:
+            resultados.append({'indice': indice, 'status': 400, 'erro': 'Id ausente ou inválido'})
+        elif imovel_id in removidos:
+            resultados.append({'indice': indice, 'status': 204, 'id': imovel_id})
+        else:
+            resultados.append({'indice': indice, 'status': 404, 'id': imovel_id, 'erro': 'Imóvel não encontrado'})
+    return _resposta_bulk(resultados, 200)
+
+def remover_imoveis_em_lote():
+    """DELETE /imoveis/bulk - Remove vários imóveis em uma transação"""
+    return processar_remocao_em_lote(_ler_itens_bulk())
+
+# Log de alterações (/imoveis/changes)
+MIMETYPE_EVENTOS = 'text/event-stream'
+# Sem alterações por tanto tempo, o stream SSE envia um comentário para manter a conexão aberta
+ALTERACOES_PING = 15
+# X-Accel-Buffering: o nginx não deve segurar as mensagens do stream
+CABECALHOS_EVENTOS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def quer_eventos(req):
+    """Indica se o cliente pediu o stream de Server-Sent Events (Accept: text/event-stream)"""
+    return req.accept_mimetypes.best_match(['application/json', MIMETYPE_EVENTOS]) == MIMETYPE_EVENTOS
+
+def preparar_alteracoes(args, ultimo_evento=None):
+    """Valida since/limit/wait de /imoveis/changes (Last-Event-ID, na reconexão do SSE, vale como since)
+
+    Retorna (plano, None) ou (None, resposta de erro).
+    """
+    try:
+        desde = int(ultimo_evento if ultimo_evento else args.get('since', 0))
+        limite = int(args.get('limit', ALTERACOES_PAGINA))
+        espera = float(args.get('wait', 0))
+    except ValueError:
+        return None, PARAMETROS_INVALIDOS
+    if desde < 0 or not 0 < limite <= ALTERACOES_MAX or not 0 <= espera <= ALTERACOES_ESPERA_MAX:
+        return None, PARAMETROS_INVALIDOS
+    return {'desde': desde, 'limite': limite, 'espera': espera}, None
+
+def log_expirado(resultado, desde):
+    """Indica se entradas posteriores a desde já foram apagadas do log (o cliente precisa sincronizar tudo).
+
+    Com o log vazio, só since=0 continua valendo: um since maior veio de
+    entradas que foram todas apagadas, e não há como saber se havia outras
+    depois dele.
+    """
+    primeiro = resultado[1]
+    if primeiro is None:
+        return desde > 0
+    return desde < primeiro - 1
+
+def _log_expirado(resultado):
+    return {'erro': 'O log não tem mais as alterações desde esse seq; sincronize a listagem completa',
+            'primeiro_seq': resultado[1]}, 410
+
+def itens_alteracoes(alteracoes):
+    """Entradas do log no formato da resposta (data ISO e imóvel com links)"""
+    itens = []
+    for alteracao in alteracoes:
+        item = dict(alteracao)
+        if isinstance(item['em'], datetime):
+            item['em'] = item['em'].isoformat()
+        if item['imovel'] is not None:
+            item['imovel'] = adiciona_hateoas_link(item['imovel'])
+        itens.append(item)
+    return itens
+
+def montar_alteracoes(resultado, plano):
+    """Corpo de /imoveis/changes: a página de alterações e o link para continuar do último seq"""
+    if log_expirado(resultado, plano['desde']):
+        return _log_expirado(resultado)
+    alteracoes = resultado[0]
+    ultimo = alteracoes[-1]['seq'] if alteracoes else plano['desde']
+    return {
+        'alteracoes': itens_alteracoes(alteracoes),
+        'ultimo_seq': ultimo,
+        'mais': len(alteracoes) == plano['limite'],
+        '_links': {
+            'self': f"/imoveis/changes?since={plano['desde']}&limit={plano['limite']}",
+            'next': f"/imoveis/changes?since={ultimo}&limit={plano['limite']}"
+        }
+    }
+
+def eventos_alteracoes(resultado, desde, json):
+    """(texto SSE, novo since) de uma leitura do log; uma mensagem 'alteracao' por entrada, com o seq como id.
+
+    Se o log já não tem as entradas desde o since, a mensagem é 'expirado' e o
+    novo since é None (o stream termina).
+    """
+    if log_expirado(resultado, desde):
+        corpo, _ = _log_expirado(resultado)
+        return f'event: expirado\ndata: {json.dumps(corpo, separators=(",", ":"))}\n\n', None
+    alteracoes = resultado[0]
+    texto = ''.join(f'id: {item["seq"]}\nevent: alteracao\ndata: {json.dumps(item, separators=(",", ":"))}\n\n'
+                    for item in itens_alteracoes(alteracoes))
+    return texto, alteracoes[-1]['seq'] if alteracoes else desde
+
+INICIO_EVENTOS = 'retry: 1000\n\n'
+
+def inicio_eventos(plano):
+    """Estado do stream SSE: since atual, limite, fim da conexão e hora do último envio"""
+    agora = time.monotonic()
+    return {'desde': plano['desde'], 'limite': plano['limite'], 'fim': agora + ALTERACOES_SSE_DURACAO, 'ultimo_envio': agora}
+
+def passo_eventos(estado, resultado, json):
+    """Uma leitura do log no stream SSE; retorna (texto a enviar, segundos até a próxima leitura ou None para terminar).
+
+    Usado pelos dois apps, que só fazem a leitura e a espera (time.sleep ou
+    asyncio.sleep). O navegador (EventSource) reconecta sozinho enviando o
+    Last-Event-ID, que continua do último seq recebido.
+    """
+    texto, estado['desde'] = eventos_alteracoes(resultado, estado['desde'], json)
+    agora = time.monotonic()
+    if texto:
+        estado['ultimo_envio'] = agora
+    elif agora - estado['ultimo_envio'] >= ALTERACOES_PING:
+        texto = ': ping\n\n'
+        estado['ultimo_envio'] = agora
+    if estado['desde'] is None or agora >= estado['fim']:
+        return texto, None
+    # Página cheia: ainda há entradas no log, lê de novo sem esperar
+    return texto, ALTERACOES_INTERVALO if len(resultado[0]) < estado['limite'] else 0
+
+def espera_alteracoes(resultado, prazo):
+    """Long-poll: segundos até ler o log de novo, ou None se a resposta já pode ir"""
+    restante = prazo - time.monotonic()
+    if resultado[0] or restante <= 0:
+        return None
+    return min(ALTERACOES_INTERVALO, restante)
+
+def _gera_eventos(plano, json):
+    """Stream SSE: lê o log a cada ALTERACOES_INTERVALO e termina após ALTERACOES_SSE_DURACAO"""
+    estado = inicio_eventos(plano)
+    yield INICIO_EVENTOS
+    while True:
+        texto, espera = passo_eventos(estado, get_alteracoes(estado['desde'], estado['limite']), json)
+        if texto:
+            yield texto
+        if espera is None:
+            return
+        time.sleep(espera)
+
+EVENTOS_SO_ASSINCRONO = {'erro': 'O stream de eventos está disponível só no modo assíncrono (api_async.py); '
+                                 'use wait= para long-poll'}, 406
+
+def listar_alteracoes():
+    """GET /imoveis/changes - Alterações a partir de since (wait= espera por novas; SSE com Accept: text/event-stream)
+
+    No modo síncrono, o wait é limitado a ALTERACOES_ESPERA_SYNC e o SSE só
+    responde com ALTERACOES_SSE_SYNC ligado, porque cada espera ocupa uma
+    thread do servidor.
+    """
+    plano, erro = preparar_alteracoes(request.args, request.headers.get('Last-Event-ID'))
+    if erro:
+        return erro
+    if quer_eventos(request):
+        if not ALTERACOES_SSE_SYNC:
+            return EVENTOS_SO_ASSINCRONO
+        return Response(_gera_eventos(plano, current_app.json), mimetype=MIMETYPE_EVENTOS, headers=CABECALHOS_EVENTOS)
+    # Long-poll: sem alterações novas, lê o log de novo até chegar alguma ou acabar o wait
+    prazo = time.monotonic() + min(plano['espera'], ALTERACOES_ESPERA_SYNC)
+    while True:
+        resultado = get_alteracoes(plano['desde'], plano['limite'])
+        espera = espera_alteracoes(resultado, prazo)
+        if espera is None:
+            break
+        time.sleep(espera)
+    return montar_alteracoes(resultado, plano)
+
+def medidores(pool_conexoes, roteador_replicas):
+    """Estado atual do pool, das réplicas, do cache, do instantâneo, da fila de escritas e da coalescência, exportado como gauges em /metrics"""
+    valores = {}
+    for prefixo, estatisticas in (('imoveis_pool', pool_conexoes.estatisticas()),
+                                  ('imoveis_replicas', roteador_replicas.estatisticas()),
+                                  ('imoveis_cache', cache_imoveis.estatisticas()),
+                                  ('imoveis_instantaneo', instantaneo_imoveis.estatisticas()),
+                                  ('imoveis_fila', fila_escritas.estatisticas()),
+                                  ('imoveis_coalescencia', coalescedor_imoveis.estatisticas())):
+        for chave, valor in estatisticas.items():
+            if isinstance(valor, int) and not isinstance(valor, bool):
+                valores[f'{prefixo}_{chave}'] = (f'{prefixo.split("_")[1].capitalize()}: {chave}', valor)
+    return valores
+
+MIMETYPE_METRICAS = 'text/plain; version=0.0.4; charset=utf-8'
+
+def exportar_metricas():
+    """GET /metrics - Métricas no formato texto do Prometheus"""
+    return Response(metricas.exportar(medidores(pool, roteador)), content_type=MIMETYPE_METRICAS)
+
+def estatisticas_cache():
+    """GET /cache/estatisticas - Acertos, falhas e remoções do cache de leitura"""
+    return jsonify(cache_imoveis.estatisticas())
+
+def banco_indisponivel(erro):
+    """Resposta padrão quando não é possível obter conexão com o banco (nos dois apps)"""
+    return {'erro': 'Banco de dados indisponível'}, 503
+
+def fila_cheia(erro):
+    """Resposta quando a fila de escritas está cheia: o cliente tenta de novo após Retry-After (nos dois apps)"""
+    return {'erro': 'Muitas escritas simultâneas; tente novamente'}, 429, {'Retry-After': str(erro.espera)}